@@ -1,7 +1,11 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Generic, Optional, Tuple, TypeVar
+import json
+import os
+import struct
+import tempfile
+from datetime import datetime, timezone
+from typing import Any, Dict, Generic, Optional, Tuple, TypeVar, Union
 
 import numpy
 import overloads.dyn_typing as dynT
@@ -10,20 +14,93 @@ from overloads.shortcuts import assertNoInfNaN, isunique
 
 T = TypeVar("T", int, datetime)
 
+# 列式文件：魔数 | 头部长度(uint64) | JSON头部 | 日期(int64) | 数据(float64, 按列存放)
+# 日期与数据的偏移量由头部长度与行数算出，均按64字节对齐
+# datetime以自1970-01-01起的纳秒数存放
+_MAGIC = b"LKHVAR01"
+_ALIGN = 64
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGN) * _ALIGN
+
+
+def _offsets(header_length: int, rows: int) -> Tuple[int, int]:
+    dates_offset = _align(len(_MAGIC) + 8 + header_length)
+    return dates_offset, _align(dates_offset + rows * 8)
+
+
+def _as_naive_utc(d: Any) -> Any:
+    # 带时区的datetime换算为UTC后去掉时区，与datetime64[ns]的语义一致
+    if isinstance(d, datetime) and d.tzinfo is not None:
+        return d.astimezone(timezone.utc).replace(tzinfo=None)
+    return d
+
+
+def _as_date_array(date: Union[Tuple[Any, ...], ndarray]) -> ndarray:
+    """
+    日期统一存放为int64或datetime64[ns]的一维数组，整体检查dtype而非逐个元素检查
+    带时区的datetime换算为UTC存放
+    """
+    array = numpy.asarray(date)
+    assert array.ndim == 1
+    if not array.shape[0]:
+        return numpy.empty((0,), dtype=numpy.int64)
+    if array.dtype == object:
+        # 由datetime对象组成的元组只能逐个检查，传入datetime64数组可避免这一步
+        assert all(isinstance(d, datetime) for d in array), "日期须全部为int或全部为datetime"
+        aware = [d.tzinfo is not None for d in array]
+        assert all(aware) or not any(aware), "日期不能混用带时区与不带时区的datetime"
+        if aware[0]:
+            array = numpy.array([_as_naive_utc(d) for d in array], dtype=object)
+        array = array.astype("datetime64[ns]")
+    if array.dtype.kind == "M":
+        array = array.astype("datetime64[ns]", copy=False)
+        assert not numpy.any(numpy.isnat(array)), "日期中不能含有NaT"
+        return array
+    assert array.dtype.kind == "i", "日期须全部为int或全部为datetime"
+    return array.astype(numpy.int64, copy=False)
+
+
+def _encode_dates(date: ndarray) -> Tuple[str, ndarray]:
+    assert len(date), "空的变量表无需写入文件或共享内存"
+    if date.dtype.kind == "M":
+        return "datetime", date.view(numpy.int64)
+    return "int", date
+
+
+def _decode_dates(kind: str, dates: ndarray) -> ndarray:
+    if kind == "datetime":
+        return dates.view("datetime64[ns]")
+    assert kind == "int"
+    return dates
+
 
 class Variables(Generic[T]):
+    """
+    dates为int64或datetime64[ns]的一维数组，date为与之对应的int或datetime元组
+    （带时区的datetime换算为不带时区的UTC时间），只在首次访问时生成
+    """
+
     data_names: Tuple[str, ...]
-    date: Tuple[T, ...]
+    dates: ndarray
     sheet: ndarray
+    validated: bool = False
+    _date_sorted: Optional[bool] = None
+    _date_tuple: Optional[Tuple[Any, ...]] = None
+    # 映射自文件或共享内存时，pickle只传递重新映射所需的参数
+    _reduce: Optional[Tuple[Any, ...]] = None
 
     def __init__(
-        self, date: Tuple[T, ...], *datas: Tuple[str, Optional[ndarray]]
+        self,
+        date: Union[Tuple[T, ...], ndarray],
+        *datas: Tuple[str, Optional[ndarray]],
     ) -> None:
+        date = _as_date_array(date)
         length_tracker = dynT.SizeVar()
-        assert dynT.Union(
-            dynT.List(dynT.Class(datetime), length_tracker),
-            dynT.List(dynT.Int(), length_tracker),
-        )._isinstance(list(date))
+        assert dynT.NDArray(numpy.int64, (length_tracker,))._isinstance(
+            date.view(numpy.int64)
+        )
         for d in datas:
             assert dynT.Tuple(
                 (
@@ -34,38 +111,160 @@ class Variables(Generic[T]):
                     ),
                 )
             )._isinstance(d)
-            if d[1] is not None and d[1].dtype == numpy.int64:
-                d = (d[0], d[1].astype(numpy.float64))
-            if d[1] is not None:
-                assertNoInfNaN(d[1])
         assert length_tracker.value is not None
         data_names = tuple(name for name, _ in datas)
         assert isunique(data_names)
 
-        zeros = numpy.zeros((length_tracker.value,))
         self.data_names = data_names
-        self.date = date
-        self.sheet = numpy.stack(
-            [var if var is not None else zeros for _, var in datas], axis=1
-        )
+        self.dates = date
+        # 按列存放（column-major），按列切片与按行切片均可得到视图
+        self.sheet = numpy.empty((length_tracker.value, len(datas)), order="F")
+        for i, (_, var) in enumerate(datas):
+            self.sheet[:, i] = var if var is not None else 0.0
+        # 只在构造时检查一次，此后sheet只读，negLikelihood求值时不再重复检查
+        assertNoInfNaN(self.sheet)
+        self.sheet.flags.writeable = False
+        self.validated = True
+
+    @classmethod
+    def _view(
+        cls,
+        date: ndarray,
+        data_names: Tuple[str, ...],
+        sheet: ndarray,
+        date_sorted: Optional[bool] = None,
+    ) -> Variables[T]:
+        # 由已校验过的Variables（或已检查过的文件、共享内存）派生，跳过校验，不复制date与sheet
+        self: Variables[T] = cls.__new__(cls)
+        self.data_names = data_names
+        self.dates = date
+        self.sheet = sheet
+        self.validated = True
+        self._date_sorted = date_sorted
+        return self
+
+    @property
+    def date(self) -> Tuple[T, ...]:
+        if self._date_tuple is None:
+            if self.dates.dtype.kind == "M":
+                self._date_tuple = tuple(self.dates.astype("datetime64[us]").tolist())
+            else:
+                self._date_tuple = tuple(self.dates.tolist())
+        return self._date_tuple
 
     def index(self, *, from_: int, to: int) -> Variables[T]:
-        return Variables(
-            self.date[from_:to],
-            *(
-                (name, self.sheet[from_:to, i])
-                for i, name in enumerate(self.data_names)
-            ),
+        """
+        返回与原表共享内存的视图
+        """
+        return Variables._view(
+            self.dates[from_:to],
+            self.data_names,
+            self.sheet[from_:to, :],
+            self._date_sorted,
         )
 
+    def index_by_date(self, start: Any, end: Any) -> Variables[T]:
+        """
+        截取start <= date < end的行，要求日期按升序排列
+        以二分查找定位区间，返回与原表共享内存的视图
+        """
+        if self._date_sorted is None:
+            self._date_sorted = bool(numpy.all(self.dates[1:] >= self.dates[:-1]))
+        assert self._date_sorted, "日期未按升序排列，无法按日期区间截取"
+        bounds = numpy.array([start, end], dtype=self.dates.dtype)
+        from_, to = numpy.searchsorted(self.dates, bounds, side="left")
+        return self.index(from_=int(from_), to=int(to))
+
     def subset(self, *data_names: str) -> Variables[T]:
+        """
+        所选的列在原表中等间隔排列时返回视图，否则复制所选的列
+        """
         assert isunique(data_names)
         for name in data_names:
             assert name in self.data_names, f"变量{name}未出现于此变量表中"
-        return Variables(
-            self.date,
-            *(
-                (name, self.sheet[:, self.data_names.index(name)])
-                for name in data_names
-            ),
+        cols = [self.data_names.index(name) for name in data_names]
+        step = cols[1] - cols[0] if len(cols) > 1 else 1
+        if step > 0 and cols == list(range(cols[0], cols[-1] + 1, step)):
+            sheet = self.sheet[:, slice(cols[0], cols[-1] + 1, step)]
+        else:
+            sheet = numpy.asfortranarray(self.sheet[:, cols])
+            sheet.flags.writeable = False
+        return Variables._view(self.dates, data_names, sheet, self._date_sorted)
+
+    def save(self, path: str) -> None:
+        """
+        写入列式文件，供Variables.memmap直接映射
+        写入前检查一次数据，并在头部记录，映射时不再扫描整个文件
+        """
+        date_kind, dates = _encode_dates(self.dates)
+        rows = self.sheet.shape[0]
+        assertNoInfNaN(self.sheet)
+
+        header = {
+            "names": list(self.data_names),
+            "rows": rows,
+            "date": date_kind,
+            "validated": True,
+        }
+        raw = json.dumps(header).encode("utf-8")
+        dates_offset, data_offset = _offsets(len(raw), rows)
+
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(_MAGIC + struct.pack("<Q", len(raw)) + raw)
+                file.seek(dates_offset)
+                file.write(dates.astype("<i8").tobytes())
+                file.seek(data_offset)
+                file.write(
+                    numpy.asfortranarray(self.sheet, dtype="<f8").tobytes(order="F")
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def memmap(cls, path: str) -> Variables[Any]:
+        """
+        以只读方式将列式文件映射为sheet，不把数据读入内存
+        多个进程映射同一文件时共享操作系统的页缓存
+        """
+        with open(path, "rb") as file:
+            magic = file.read(len(_MAGIC))
+            assert magic == _MAGIC, f"{path}不是Variables的列式文件"
+            (length,) = struct.unpack("<Q", file.read(8))
+            header = json.loads(file.read(length).decode("utf-8"))
+        rows: int = header["rows"]
+        dates_offset, data_offset = _offsets(length, rows)
+
+        data_names = tuple(header["names"])
+        assert isunique(data_names)
+        dates = numpy.memmap(
+            path, dtype="<i8", mode="r", offset=dates_offset, shape=(rows,)
         )
+        date = _decode_dates(header["date"], dates)
+        sheet = numpy.memmap(
+            path,
+            dtype="<f8",
+            mode="r",
+            offset=data_offset,
+            shape=(rows, len(data_names)),
+            order="F",
+        )
+        if not header.get("validated", False):
+            assertNoInfNaN(sheet)
+        variables: Variables[Any] = cls._view(date, data_names, sheet)
+        variables._reduce = (Variables.memmap, (os.path.abspath(path),))
+        return variables
+
+    def __reduce_ex__(self, protocol: Any) -> Any:
+        if self._reduce is not None:
+            return self._reduce
+        return super().__reduce_ex__(protocol)
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # pickle重建的sheet是可写的新数组，恢复构造时的只读约定
+        self.__dict__.update(state)
+        self.sheet.flags.writeable = False
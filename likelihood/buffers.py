@@ -0,0 +1,58 @@
+from __future__ import annotations
+
+from typing import Dict, List, Tuple
+
+import numpy
+from overloads.typedefs import ndarray
+
+
+class BufferPool:
+    """
+    按尺寸复用的工作表缓冲区
+    acquire取出的缓冲区由调用者独占，直到显式release归还池中；
+    交给调用者的输出表从不归还，因此不会被之后的求值覆盖
+    """
+
+    max_buffers: int
+    hits: int
+    misses: int
+    _free: Dict[Tuple[int, ...], List[ndarray]]
+
+    def __init__(self, max_buffers: int) -> None:
+        assert max_buffers >= 0
+        self.max_buffers = max_buffers
+        self.hits = 0
+        self.misses = 0
+        self._free = {}
+
+    def acquire(self, shape: Tuple[int, ...]) -> ndarray:
+        """
+        返回一块尺寸为shape的C连续缓冲区，内容未初始化
+        """
+        free = self._free.get(shape)
+        if free:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return numpy.empty(shape)
+
+    def release(self, buffer: ndarray) -> None:
+        """
+        归还acquire取出的缓冲区，此后调用者不得再使用它
+        至多保留max_buffers块空闲缓冲区，多余的交给垃圾回收
+        """
+        free = self._free.setdefault(buffer.shape, [])
+        assert all(b is not buffer for b in free), "缓冲区被重复归还"
+        if len(self) < self.max_buffers:
+            free.append(buffer)
+
+    def copy(self, sheet: ndarray) -> ndarray:
+        buffer = self.acquire(sheet.shape)
+        numpy.copyto(buffer, sheet)
+        return buffer
+
+    def clear(self) -> None:
+        self._free.clear()
+
+    def __len__(self) -> int:
+        return sum(len(b) for b in self._free.values())
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+import numpy
+from overloads.typedefs import ndarray
+
+_key_t = Tuple[bytes, int, bool, bool]
+
+
+def _nbytes(obj: Any) -> int:
+    if isinstance(obj, numpy.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sum(_nbytes(x) for x in obj)
+    return 0
+
+
+class _Entry:
+    data_in: Any
+    fval: float
+    output: ndarray
+    gradinfo: Optional[Tuple[Any, ...]]
+    dL_dc: Optional[ndarray]
+    nbytes: int
+
+    def __init__(
+        self,
+        data_in: Any,
+        fval: float,
+        output: ndarray,
+        gradinfo: Optional[Tuple[Any, ...]],
+    ) -> None:
+        # 持有data_in的引用，保证其id在条目存活期间不会被复用
+        self.data_in = data_in
+        self.fval = fval
+        self.output = output
+        self.gradinfo = gradinfo
+        self.dL_dc = None
+        self.nbytes = _nbytes(output) + _nbytes(gradinfo)
+
+
+class EvalCache:
+    """
+    以(coeff, Variables, regularize, debug)为键的LRU缓存
+    保存前向输出与gradinfo，使同一点上的grad只需执行反向扫描
+    也可以放入已算好dL_dc而不带gradinfo的条目（见online.WarmStart.seed_cache）
+    注意：假定Variables在其生命期内不被原地修改
+    """
+
+    max_bytes: int
+    nbytes: int
+    hits: int
+    misses: int
+    evictions: int
+    _entries: OrderedDict[_key_t, _Entry]
+
+    def __init__(self, max_bytes: int) -> None:
+        assert max_bytes >= 0
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(coeff: ndarray, data_in: Any, *, regularize: bool, debug: bool) -> _key_t:
+        return (coeff.tobytes(), id(data_in), regularize, debug)
+
+    def get(self, key: _key_t, data_in: Any, *, grad: bool) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None or entry.data_in is not data_in:
+            self.misses += 1
+            return None
+        if grad and entry.gradinfo is None and entry.dL_dc is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key: _key_t, entry: _Entry) -> None:
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old.nbytes
+        if entry.nbytes > self.max_bytes:
+            return
+        while self._entries and self.nbytes + entry.nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+            self.evictions += 1
+        self._entries[key] = entry
+        self.nbytes += entry.nbytes
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,22 +1,43 @@
 from __future__ import annotations
 
+import hashlib
+import logging
 import multiprocessing
+import os
 import pickle
+import tempfile
+import threading
 import time
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    wait,
+)
+from types import CodeType, FunctionType, ModuleType
 from typing import (
     Any,
     Callable,
     Dict,
     Generic,
+    List,
+    NamedTuple,
     NewType,
     NoReturn,
     Optional,
+    Sequence,
+    Set,
     Tuple,
     TypeVar,
     cast,
 )
 
+import llvmlite  # type: ignore
 import numba  # type: ignore
+import numpy
+from numba.core import compiler  # type: ignore
+from numba.core.registry import cpu_target  # type: ignore
 
 _signature_t = NewType("_signature_t", object)
 _function_t = TypeVar("_function_t", covariant=True)
@@ -24,6 +45,249 @@ _function_t = TypeVar("_function_t", covariant=True)
 _output_width_m = 0
 _output_width_n = 0
 _Jitted_Function_Cache: Dict[Tuple[bytes, ...], Tuple[Any, Any]] = {}
+_Compile_Locks: Dict[Tuple[bytes, ...], threading.Lock] = {}
+_Compile_Locks_Guard = threading.Lock()
+_Disk_Cache_Dir: Optional[str] = os.environ.get("LIKELIHOOD_JIT_CACHE_DIR") or None
+# 磁盘缓存格式变化时递增，使旧的缓存文件不再命中
+_Disk_Cache_Version = 3
+_logger = logging.getLogger(__name__)
+
+
+class JitEvent(NamedTuple):
+    """
+    kind取值：
+        memory_hit/memory_miss  进程内缓存命中/未命中，memory_hit只在开启profiling或注册了回调时记录
+        disk_hit/disk_miss      磁盘缓存命中/未命中，disk_hit带有载入耗时
+        compile_start/compile_end  编译开始/结束，compile_end带有编译耗时
+    """
+
+    kind: str
+    module: str
+    name: str
+    pid: Optional[int]
+    duration: Optional[float]
+
+
+class JitStats:
+    memory_hits: int
+    memory_misses: int
+    disk_hits: int
+    disk_misses: int
+    disk_load_seconds: float
+    compiles: int
+    compile_seconds: float
+    calls: int
+    call_seconds: float
+
+    def __init__(self) -> None:
+        self.memory_hits = 0
+        self.memory_misses = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_load_seconds = 0.0
+        self.compiles = 0
+        self.compile_seconds = 0.0
+        self.calls = 0
+        self.call_seconds = 0.0
+
+
+_Event_Hooks: List[Callable[[JitEvent], None]] = []
+_Registry: Dict[str, JitStats] = {}
+_Registry_Lock = threading.RLock()
+_Profiling = False
+_Profiled_Cache: Dict[Tuple[bytes, ...], Any] = {}
+
+
+def add_event_hook(hook: Callable[[JitEvent], None]) -> None:
+    _Event_Hooks.append(hook)
+
+
+def remove_event_hook(hook: Callable[[JitEvent], None]) -> None:
+    _Event_Hooks.remove(hook)
+
+
+def set_profiling(enabled: bool) -> None:
+    """
+    开启后func()返回计时包装，统计每个核函数在Python侧被调用的次数与累计耗时
+    包装只作用于Python侧的调用，被其他核函数依赖时仍使用原始的numba函数
+    """
+    global _Profiling
+    _Profiling = enabled
+    _Profiled_Cache.clear()
+
+
+def get_registry() -> Dict[str, JitStats]:
+    """
+    以"模块名.生成函数名"为键汇总的统计数据，同名核函数合并计数
+    """
+    with _Registry_Lock:
+        return dict(_Registry)
+
+
+def reset_registry() -> None:
+    with _Registry_Lock:
+        _Registry.clear()
+
+
+def _stats(module: str, name: str) -> JitStats:
+    key = f"{module}.{name}"
+    with _Registry_Lock:
+        stats = _Registry.get(key)
+        if stats is None:
+            stats = _Registry[key] = JitStats()
+        return stats
+
+
+def _record(
+    kind: str, generator: Callable[..., Any], duration: Optional[float] = None
+) -> None:
+    module, name = generator.__module__, generator.__name__
+    with _Registry_Lock:
+        stats = _stats(module, name)
+        if kind == "memory_hit":
+            stats.memory_hits += 1
+        elif kind == "memory_miss":
+            stats.memory_misses += 1
+        elif kind == "disk_hit":
+            assert duration is not None
+            stats.disk_hits += 1
+            stats.disk_load_seconds += duration
+        elif kind == "disk_miss":
+            stats.disk_misses += 1
+        elif kind == "compile_end":
+            assert duration is not None
+            stats.compiles += 1
+            stats.compile_seconds += duration
+
+    if kind == "disk_hit":
+        _logger.info(
+            "pid[%s]: 载入缓存 %s .%s 完成 -- 用时%.4f秒",
+            multiprocessing.current_process().pid,
+            module.ljust(_output_width_m),
+            name.ljust(_output_width_n),
+            duration,
+        )
+    elif kind == "compile_start":
+        _logger.info(
+            "pid[%s]: 预编译 %s .%s 等候中",
+            multiprocessing.current_process().pid,
+            module.ljust(_output_width_m),
+            name.ljust(_output_width_n),
+        )
+    elif kind == "compile_end":
+        _logger.info(
+            "pid[%s]: 预编译 %s .%s 完成 -- 用时%.4f秒",
+            multiprocessing.current_process().pid,
+            module.ljust(_output_width_m),
+            name.ljust(_output_width_n),
+            duration,
+        )
+
+    if _Event_Hooks:
+        event = JitEvent(
+            kind, module, name, multiprocessing.current_process().pid, duration
+        )
+        for hook in _Event_Hooks:
+            hook(event)
+
+
+def _profiled(func: Any, stats: JitStats) -> Any:
+    def implement(*args: Any) -> Any:
+        start_time = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            stats.calls += 1
+            stats.call_seconds += time.perf_counter() - start_time
+
+    return implement
+
+
+def set_disk_cache_dir(path: Optional[str]) -> None:
+    """
+    设置编译产物的磁盘缓存目录，None表示不使用磁盘缓存
+    默认取环境变量LIKELIHOOD_JIT_CACHE_DIR，以便子进程继承同一设置
+    """
+    global _Disk_Cache_Dir
+    _Disk_Cache_Dir = path
+
+
+def get_disk_cache_dir() -> Optional[str]:
+    return _Disk_Cache_Dir
+
+
+def _compile_lock(key: Tuple[bytes, ...]) -> threading.Lock:
+    with _Compile_Locks_Guard:
+        return _Compile_Locks.setdefault(key, threading.Lock())
+
+
+def _code_fingerprint(code: CodeType, out: List[bytes]) -> None:
+    # marshal的输出受引用计数影响而不稳定，因此逐项展开code对象
+    out.append(code.co_code)
+    out.append(repr((code.co_names, code.co_varnames, code.co_freevars)).encode())
+    for c in code.co_consts:
+        if isinstance(c, CodeType):
+            _code_fingerprint(c, out)
+        else:
+            out.append(repr(c).encode())
+
+
+def _globals_fingerprint(
+    code: CodeType, namespace: Dict[str, Any], out: List[bytes], seen: Set[int]
+) -> None:
+    # numba把引用到的模块全局量（常量、辅助函数）冻结进编译结果，它们也须进入摘要
+    for name in code.co_names:
+        if name in namespace:
+            out.append(name.encode())
+            _value_fingerprint(namespace[name], out, seen)
+    for c in code.co_consts:
+        if isinstance(c, CodeType):
+            _globals_fingerprint(c, namespace, out, seen)
+
+
+def _value_fingerprint(value: Any, out: List[bytes], seen: Set[int]) -> None:
+    if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+        out.append(repr(value).encode())
+    elif isinstance(value, (numpy.ndarray, numpy.generic)):
+        out.append(repr((value.dtype.str, value.shape)).encode())
+        out.append(numpy.ascontiguousarray(value).tobytes())
+    elif isinstance(value, tuple):
+        for x in value:
+            _value_fingerprint(x, out, seen)
+    elif isinstance(value, ModuleType):
+        out.append(value.__name__.encode())
+    elif isinstance(value, FunctionType) or isinstance(
+        getattr(value, "py_func", None), FunctionType
+    ):
+        # 被引用的辅助函数（含numba的dispatcher）按其自身的代码与全局量计入，
+        # 递归引用只计一次
+        func = value if isinstance(value, FunctionType) else value.py_func
+        if id(func) in seen:
+            return
+        seen.add(id(func))
+        _code_fingerprint(func.__code__, out)
+        _globals_fingerprint(func.__code__, func.__globals__, out, seen)
+    else:
+        # 其他对象的repr可能含有内存地址，只记录类型
+        out.append(f"{type(value).__module__}.{type(value).__qualname__}".encode())
+
+
+def _umask() -> int:
+    # os.umask只能在设置的同时读出，读出后立即恢复
+    mask = os.umask(0o022)
+    os.umask(mask)
+    return mask
+
+
+def _environment_fingerprint() -> bytes:
+    return repr(
+        (
+            _Disk_Cache_Version,
+            numba.__version__,
+            llvmlite.__version__,
+            cpu_target.target_context.codegen().magic_tuple(),
+        )
+    ).encode()
 
 
 class JittedFunction(Generic[_function_t]):
@@ -63,7 +327,90 @@ class JittedFunction(Generic[_function_t]):
     def _get_generator(self) -> Callable[..., _function_t]:
         return pickle.loads(self.pickled_bytecode[0])  # type: ignore
 
-    def _compile(self, compile: bool) -> Tuple[Optional[_function_t], _function_t]:
+    def _fingerprint(self, out: List[bytes]) -> None:
+        out.append(self.pickled_bytecode[0])
+        out.append(str(self.signature).encode())
+        generator = self._get_generator()
+        _code_fingerprint(generator.__code__, out)
+        _globals_fingerprint(generator.__code__, generator.__globals__, out, set())
+        for x in self.dependent:
+            x._fingerprint(out)
+
+    def _digest(self) -> str:
+        # 摘要包含numba与llvmlite的版本，其他版本写入的缓存文件不会被找到
+        out: List[bytes] = [_environment_fingerprint()]
+        self._fingerprint(out)
+        hasher = hashlib.sha256()
+        for b in out:
+            hasher.update(hashlib.sha256(b).digest())
+        return hasher.hexdigest()
+
+    def _disk_cache_path(self, directory: str, digest: str) -> str:
+        generator = self._get_generator()
+        return os.path.join(
+            directory, f"{generator.__module__}.{generator.__name__}-{digest}.nbc"
+        )
+
+    def _load_compiled(self, path: str, py_func: Any) -> Optional[_function_t]:
+        # CompileResult._reduce/_rebuild是numba的私有接口，文件中另外记录写入时的
+        # numba与llvmlite版本，版本不一致或重建失败时视同未命中
+        func = numba.njit(py_func)
+        try:
+            with open(path, "rb") as file:
+                environment, data = pickle.load(file)
+            if environment != _environment_fingerprint():
+                return None
+            func.targetctx.refresh()
+            cres = compiler.CompileResult._rebuild(func.targetctx, *data)
+        except Exception:
+            # 缺失、损坏或不兼容的缓存文件视同未命中，随后会被重新写入
+            return None
+        func.targetctx.insert_user_function(
+            cres.entry_point, cres.fndesc, [cres.library]
+        )
+        func.add_overload(cres)
+        func.disable_compile()
+        return cast(_function_t, func)
+
+    def _save_compiled(self, path: str, func: Any) -> None:
+        cres = func.overloads[func.signatures[0]]
+        if cres.library.has_dynamic_globals or not hasattr(cres, "_reduce"):
+            return
+        payload = pickle.dumps(
+            (_environment_fingerprint(), cres._reduce()), protocol=-1
+        )
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # 先写临时文件再原子替换，并发写入者之间互不破坏
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(payload)
+            # mkstemp建立的文件权限为0600，按umask放开，共享的缓存目录可被其他用户读取
+            os.chmod(tmp_path, 0o666 & ~_umask())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _compile(
+        self, compile: bool, directory: Optional[str]
+    ) -> Tuple[Optional[_function_t], _function_t]:
+        if self.pickled_bytecode in _Jitted_Function_Cache:
+            # 命中发生在每次求值的热路径上，只在开启统计或注册了事件回调时记录
+            if compile and (_Profiling or _Event_Hooks):
+                _record("memory_hit", self._get_generator())
+            return _Jitted_Function_Cache[self.pickled_bytecode]
+        if not compile:
+            return self._compile_locked(compile, directory)
+        # 逐函数加锁，保证多线程下每个函数只编译一次；依赖关系无环，不会死锁
+        with _compile_lock(self.pickled_bytecode):
+            return self._compile_locked(compile, directory)
+
+    def _compile_locked(
+        self, compile: bool, directory: Optional[str]
+    ) -> Tuple[Optional[_function_t], _function_t]:
+        # directory为磁盘缓存目录，由调用者一次读出后显式传入，依赖的函数沿用同一目录
         if self.pickled_bytecode in _Jitted_Function_Cache:
             return _Jitted_Function_Cache[self.pickled_bytecode]
 
@@ -72,38 +419,128 @@ class JittedFunction(Generic[_function_t]):
         if not compile:
             return None, py_func
 
-        print(
-            f"pid[{multiprocessing.current_process().pid}]: "
-            f"预编译 {generator.__module__.ljust(_output_width_m)} "
-            f".{generator.__name__.ljust(_output_width_n)} 等候中\n",
-            end="",
-        )
+        _record("memory_miss", generator)
+        digest: Optional[str] = None
+        disk_path: Optional[str] = None
+        if directory is not None:
+            digest = self._digest()
+            disk_path = self._disk_cache_path(directory, digest)
+            start_time = time.time()
+            loaded = self._load_compiled(disk_path, py_func)
+            if loaded is not None:
+                _Jitted_Function_Cache[self.pickled_bytecode] = (loaded, py_func)
+                _record("disk_hit", generator, time.time() - start_time)
+                return loaded, py_func
+            _record("disk_miss", generator)
+
+        dependent = tuple(x._jitted(directory) for x in self.dependent)
 
+        _record("compile_start", generator)
         start_time = time.time()
-        func = cast(
-            _function_t,
-            numba.njit(self.signature)(generator(*(x.func() for x in self.dependent))),
-        )
+        implement: Any = generator(*dependent)
+        if digest is not None:
+            # numba的符号名只在本进程内唯一，不同进程编译、写入磁盘缓存的函数可能同名，
+            # 一同载入后会链接到错误的函数；以摘要区分符号名，同名即同一份代码
+            implement.__qualname__ = f"{implement.__qualname__}_{digest[:16]}"
+        func = cast(_function_t, numba.njit(self.signature)(implement))
         _Jitted_Function_Cache[self.pickled_bytecode] = (func, py_func)
+        _record("compile_end", generator, time.time() - start_time)
 
-        print(
-            f"pid[{multiprocessing.current_process().pid}]: "
-            f"预编译 {generator.__module__.ljust(_output_width_m)} "
-            f".{generator.__name__.ljust(_output_width_n)} 完成"
-            f" -- 用时{time.time()-start_time:.4f}秒\n",
-            end="",
-        )
+        if disk_path is not None:
+            self._save_compiled(disk_path, func)
 
         return func, py_func
 
-    def func(self) -> _function_t:
-        func, _ = self._compile(True)
+    def _jitted(self, directory: Optional[str]) -> _function_t:
+        func, _ = self._compile(True, directory)
         assert func is not None
         return func
 
+    def func(self) -> _function_t:
+        func = self._jitted(_Disk_Cache_Dir)
+        if not _Profiling:
+            return func
+        profiled = _Profiled_Cache.get(self.pickled_bytecode)
+        if profiled is None:
+            generator = self._get_generator()
+            profiled = _profiled(func, _stats(generator.__module__, generator.__name__))
+            _Profiled_Cache[self.pickled_bytecode] = profiled
+        return cast(_function_t, profiled)
+
     def py_func(self) -> _function_t:
-        _, py_func = self._compile(False)
+        _, py_func = self._compile(False, None)
         return py_func
 
     def __call__(self) -> NoReturn:
         assert False  # pragma: no cover
+
+
+def _compile_node(node: JittedFunction[Any], directory: str) -> Tuple[str, float]:
+    generator = node._get_generator()
+    start_time = time.time()
+    node._jitted(directory)
+    return f"{generator.__module__}.{generator.__name__}", time.time() - start_time
+
+
+def _collect_nodes(
+    node: JittedFunction[Any], nodes: Dict[Tuple[bytes, ...], JittedFunction[Any]]
+) -> None:
+    if (
+        node.pickled_bytecode in nodes
+        or node.pickled_bytecode in _Jitted_Function_Cache
+    ):
+        return
+    nodes[node.pickled_bytecode] = node
+    for x in node.dependent:
+        _collect_nodes(x, nodes)
+
+
+def _schedule(
+    executor: Executor,
+    nodes: Dict[Tuple[bytes, ...], JittedFunction[Any]],
+    directory: str,
+) -> List[Tuple[str, float]]:
+    pending: Dict[Tuple[bytes, ...], Set[Tuple[bytes, ...]]] = {
+        key: {x.pickled_bytecode for x in node.dependent if x.pickled_bytecode in nodes}
+        for key, node in nodes.items()
+    }
+    running: Dict[Future[Tuple[str, float]], Tuple[bytes, ...]] = {}
+    timings: List[Tuple[str, float]] = []
+    while pending or running:
+        for key in [k for k, deps in pending.items() if not deps]:
+            del pending[key]
+            running[executor.submit(_compile_node, nodes[key], directory)] = key
+        done, _ = wait(running.keys(), return_when=FIRST_COMPLETED)
+        for future in done:
+            key = running.pop(future)
+            timings.append(future.result())
+            for deps in pending.values():
+                deps.discard(key)
+    return timings
+
+
+def compile_parallel(
+    functions: Sequence[JittedFunction[Any]],
+    *,
+    workers: Optional[int] = None,
+) -> List[Tuple[str, float]]:
+    """
+    按依赖关系构造有向无环图，以多进程并发编译互不依赖的节点，返回(函数名, 编译耗时秒数)
+    numba以全局锁串行化同一进程内的编译，因此不用线程；各worker经由磁盘缓存交换
+    已编译的依赖，最后本进程从磁盘缓存载入结果；未设置磁盘缓存时使用临时目录
+    """
+    nodes: Dict[Tuple[bytes, ...], JittedFunction[Any]] = {}
+    for f in functions:
+        _collect_nodes(f, nodes)
+    if not nodes:
+        return []
+
+    directory = _Disk_Cache_Dir
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if directory is None:
+            directory = tmp_dir
+        with ProcessPoolExecutor(workers) as executor:
+            timings = _schedule(executor, nodes, directory)
+        for f in functions:
+            f._jitted(directory)
+    return timings
@@ -1,17 +1,22 @@
 from __future__ import annotations
 
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Any, List, Optional, Tuple, Type, TypeVar
+from typing import Any, Iterator, List, Optional, Sequence, Tuple, Type, TypeVar
 
 import numpy
 from overloads.shortcuts import assertNoInfNaN, isunique
 from overloads.typedefs import ndarray
 
+from likelihood.buffers import BufferPool
+from likelihood.cache import EvalCache, _Entry
+from likelihood.stages.abc.Iterative import Iterative
 from likelihood.stages.abc.Logpdf import Logpdf
 from likelihood.stages.abc.Penalty import Penalty
 from likelihood.stages.abc.Stage import Constraints, Stage
 from likelihood.stages.Mapping import Mapping
 from likelihood.Variables import Variables
+from likelihood.workspace import Workspace
 
 T = TypeVar("T", int, datetime)
 
@@ -46,8 +51,13 @@ def _grad_loop(
     dL_do: ndarray,
     *,
     debug: bool,
+    out: Optional[ndarray] = None,
 ) -> Tuple[ndarray, ndarray]:
-    dL_dc = numpy.zeros(coeff.shape)
+    if out is not None:
+        out.fill(0.0)
+        dL_dc = out
+    else:
+        dL_dc = numpy.zeros(coeff.shape)
     for s, g in zip(stages[::-1], gradinfo[::-1]):
         assert s.coeff_index is not None
         dL_do, _dL_dc = s.grad(coeff[s.coeff_index], g, dL_do, debug=debug)
@@ -55,6 +65,57 @@ def _grad_loop(
     return dL_do, dL_dc
 
 
+def _eval_loop_batch(
+    stages: Tuple[Stage[Any], ...],
+    coeffs: ndarray,
+    inputs: List[ndarray],
+    *,
+    grad: bool,
+    debug: bool,
+) -> Tuple[List[ndarray], Optional[Tuple[Any, ...]]]:
+    outputs: List[ndarray] = inputs
+    gradinfo: List[Optional[Any]] = []
+    for s in stages:
+        assert s.coeff_index is not None
+        outputs, g = s.eval_batch(
+            coeffs[:, s.coeff_index], outputs, grad=grad, debug=debug
+        )
+        gradinfo.append(g)
+    if not grad:
+        return outputs, None
+    return outputs, tuple(gradinfo)
+
+
+def _grad_loop_batch(
+    stages: Tuple[Stage[Any], ...],
+    coeffs: ndarray,
+    gradinfo: Tuple[Any, ...],
+    dL_do: List[ndarray],
+    *,
+    debug: bool,
+) -> Tuple[List[ndarray], ndarray]:
+    dL_dc = numpy.zeros(coeffs.shape)
+    for s, g in zip(stages[::-1], gradinfo[::-1]):
+        assert s.coeff_index is not None
+        dL_do, _dL_dc = s.grad_batch(coeffs[:, s.coeff_index], g, dL_do, debug=debug)
+        dL_dc[:, s.coeff_index] += _dL_dc
+    return dL_do, dL_dc
+
+
+def _streamable(s: Stage[Any]) -> bool:
+    if isinstance(s, Iterative):
+        return False
+    if isinstance(s, Mapping):
+        return _streamable(s.submodel)
+    return all(_streamable(x) for x in s.submodels)
+
+
+def _check_sheet(data_in: Variables[Any]) -> None:
+    # 构造时已校验且此后只读的sheet无需在每次求值时重新检查
+    if not (data_in.validated and not data_in.sheet.flags.writeable):
+        assertNoInfNaN(data_in.sheet)
+
+
 def _check_stages(
     coeff_names: Tuple[str, ...], stages: Tuple[Stage[Any], ...], firstColName: str
 ) -> None:
@@ -76,6 +137,9 @@ class negLikelihood:
     stages: Tuple[Stage[Any], ...]
     penalty: Optional[Penalty[Any]]
     constraints: Constraints
+    cache: Optional[EvalCache] = None
+    buffers: Optional[BufferPool]
+    workspace: Optional[Workspace]
 
     def __init__(
         self,
@@ -91,6 +155,8 @@ class negLikelihood:
         self.data_names = data_names
         self.stages = stages
         self.penalty = penalty
+        self.buffers = None
+        self.workspace = None
         self.constraints = Constraints(
             numpy.empty((0, len(coeff_names))),
             numpy.empty((0,)),
@@ -113,7 +179,52 @@ class negLikelihood:
         else:
             return self.stages
 
-    def _eval(
+    def enable_cache(self, *, max_bytes: int) -> EvalCache:
+        self.cache = EvalCache(max_bytes)
+        return self.cache
+
+    def disable_cache(self) -> None:
+        self.cache = None
+
+    def enable_buffer_pool(self, *, max_buffers: int) -> BufferPool:
+        """
+        复用工作表缓冲区，同一个negLikelihood不能被多个线程同时求值
+        只有输出表不交给调用者的求值（未启用缓存时的grad、分块求值）才会归还缓冲区
+        """
+        self.buffers = BufferPool(max_buffers)
+        return self.buffers
+
+    def disable_buffer_pool(self) -> None:
+        self.buffers = None
+
+    def enable_workspace(self) -> Workspace:
+        """
+        反向扫描复用预分配的梯度表，同一个negLikelihood不能被多个线程同时求梯度
+        """
+        self.workspace = Workspace(len(self.coeff_names))
+        return self.workspace
+
+    def disable_workspace(self) -> None:
+        self.workspace = None
+
+    def _working_sheet(self, data_in: Variables[T]) -> ndarray:
+        # 各stage在工作表上原地写入输出，不能直接使用data_in.sheet
+        if self.buffers is None:
+            return data_in.sheet.copy()
+        return self.buffers.copy(data_in.sheet)
+
+    @contextmanager
+    def _borrowed_sheet(self, data_in: Variables[T]) -> Iterator[ndarray]:
+        # 输出表与gradinfo都不会离开with块时，工作表用完即归还缓冲池
+        buffers = self.buffers
+        sheet = self._working_sheet(data_in)
+        try:
+            yield sheet
+        finally:
+            if buffers is not None:
+                buffers.release(sheet)
+
+    def _eval_entry(
         self: negLikelihood,
         coeff: ndarray,
         data_in: Variables[T],
@@ -121,7 +232,8 @@ class negLikelihood:
         grad: bool,
         regularize: bool,
         debug: bool,
-    ) -> Tuple[float, ndarray, Optional[Tuple[Any, ...]]]:
+        sheet: Optional[ndarray] = None,
+    ) -> _Entry:
 
         assert coeff.shape == (
             len(self.coeff_names),
@@ -130,17 +242,50 @@ class negLikelihood:
             data_in.data_names == self.data_names
         ), "Variables中定义的变量与negLikelihood需要的变量似乎不同"
 
+        if self.cache is not None:
+            key = EvalCache.key(coeff, data_in, regularize=regularize, debug=debug)
+            entry = self.cache.get(key, data_in, grad=grad)
+            if entry is not None:
+                return entry
+            # 启用缓存时总是保留gradinfo，之后同一点上的grad只需反向扫描
+            grad = True
+
         assertNoInfNaN(coeff)
-        assertNoInfNaN(data_in.sheet)
+        _check_sheet(data_in)
 
         output, gradinfo = _eval_loop(
             self._get_stages(regularize=regularize),
             coeff,
-            data_in.sheet.copy(),
+            self._working_sheet(data_in) if sheet is None else sheet,
             grad=grad,
             debug=debug,
         )
-        return -numpy.sum(output[:, 0]), output, gradinfo
+        entry = _Entry(data_in, -numpy.sum(output[:, 0]), output, gradinfo)
+        if self.cache is not None:
+            self.cache.put(key, entry)
+        return entry
+
+    def _eval(
+        self: negLikelihood,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        grad: bool,
+        regularize: bool,
+        debug: bool,
+    ) -> Tuple[float, ndarray, Optional[Tuple[Any, ...]]]:
+        entry = self._eval_entry(
+            coeff, data_in, grad=grad, regularize=regularize, debug=debug
+        )
+        return entry.fval, self._output(entry), entry.gradinfo
+
+    def _output(self, entry: _Entry) -> ndarray:
+        # 缓存中的输出表会在之后的命中时再次返回，只交给调用者只读视图
+        if self.cache is None:
+            return entry.output
+        output: ndarray = entry.output.view()
+        output.flags.writeable = False
+        return output
 
     def eval(
         self,
@@ -163,20 +308,300 @@ class negLikelihood:
         regularize: bool,
         debug: bool = False,
     ) -> ndarray:
-        _, o, gradinfo = self._eval(
+        if self.cache is not None:
+            _, _, dL_dc = self.value_and_grad(
+                coeff, data_in, regularize=regularize, debug=debug
+            )
+            return dL_dc
+
+        # 输出表不交给调用者，反向扫描结束后即可归还工作表
+        with self._borrowed_sheet(data_in) as sheet:
+            entry = self._eval_entry(
+                coeff,
+                data_in,
+                grad=True,
+                regularize=regularize,
+                debug=debug,
+                sheet=sheet,
+            )
+            assert entry.gradinfo is not None
+            dL_dc = self._backward(
+                coeff,
+                data_in.sheet.shape,
+                entry.output.shape,
+                entry.gradinfo,
+                regularize=regularize,
+                debug=debug,
+            )
+        return dL_dc if self.workspace is None else dL_dc.copy()
+
+    def value_and_grad(
+        self,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        regularize: bool,
+        debug: bool = False,
+    ) -> Tuple[float, ndarray, ndarray]:
+        """
+        单次前向+反向扫描，同时给出fval、输出表与dL_dc
+        供需要在同一点同时取得函数值与梯度的优化器使用
+        """
+        entry = self._eval_entry(
             coeff, data_in, grad=True, regularize=regularize, debug=debug
         )
 
-        dL_dL = numpy.zeros(o.shape)
-        dL_dL[:, 0] = -1.0
+        if entry.dL_dc is None:
+            assert entry.gradinfo is not None
+            dL_dc = self._backward(
+                coeff,
+                data_in.sheet.shape,
+                entry.output.shape,
+                entry.gradinfo,
+                regularize=regularize,
+                debug=debug,
+            )
+            entry.dL_dc = dL_dc if self.workspace is None else dL_dc.copy()
+
+        return entry.fval, self._output(entry), entry.dL_dc.copy()
+
+    def _backward(
+        self,
+        coeff: ndarray,
+        input_shape: Tuple[int, ...],
+        output_shape: Tuple[int, ...],
+        gradinfo: Tuple[Any, ...],
+        *,
+        regularize: bool,
+        debug: bool,
+    ) -> ndarray:
+        # 启用workspace时返回的dL_dc属于workspace，会被下一次反向扫描覆盖
+        if self.workspace is None:
+            dL_dL = numpy.zeros(output_shape)
+            dL_dL[:, 0] = -1.0
+            out = None
+        else:
+            (input_rows, cols), (output_rows, _) = input_shape, output_shape
+            self.workspace.resize((input_rows, cols))
+            dL_dL = self.workspace.dL_dL((output_rows, cols))
+            out = self.workspace.zero_dL_dc()
 
-        assert gradinfo is not None
         _, dL_dc = _grad_loop(
-            self._get_stages(regularize=regularize), coeff, gradinfo, dL_dL, debug=debug
+            self._get_stages(regularize=regularize),
+            coeff,
+            gradinfo,
+            dL_dL,
+            debug=debug,
+            out=out,
         )
-
         return dL_dc
 
+    def is_streamable(self) -> bool:
+        """
+        不含Iterative的stage只依赖于前k行（Convolution的lag），可以分块求值
+        """
+        stages = self.stages + ((self.penalty,) if self.penalty is not None else ())
+        return all(_streamable(s) for s in stages)
+
+    def _eval_chunk(
+        self,
+        coeff: ndarray,
+        chunk: Variables[T],
+        sheet: ndarray,
+        *,
+        grad: bool,
+        regularize: bool,
+        debug: bool,
+    ) -> Tuple[ndarray, Optional[ndarray]]:
+        # 不经过EvalCache对一块数据求值（grad时接着反向扫描），sheet为该块的工作表
+        # 启用workspace时返回的dL_dc属于workspace
+        _check_sheet(chunk)
+        output, gradinfo = _eval_loop(
+            self._get_stages(regularize=regularize),
+            coeff,
+            sheet,
+            grad=grad,
+            debug=debug,
+        )
+        if not grad:
+            return output, None
+        assert gradinfo is not None
+        dL_dc = self._backward(
+            coeff,
+            chunk.sheet.shape,
+            output.shape,
+            gradinfo,
+            regularize=regularize,
+            debug=debug,
+        )
+        return output, dL_dc
+
+    def _eval_chunked(
+        self,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        chunk_rows: int,
+        grad: bool,
+        regularize: bool,
+        debug: bool,
+    ) -> Tuple[float, Optional[ndarray]]:
+        assert self.is_streamable(), "含有Iterative的模型无法分块求值"
+        assert coeff.shape == (
+            len(self.coeff_names),
+        ), "向negLikelihood所输入的参数向量的尺寸与预期的不同"
+        assert (
+            data_in.data_names == self.data_names
+        ), "Variables中定义的变量与negLikelihood需要的变量似乎不同"
+        assertNoInfNaN(coeff)
+
+        nRows = len(data_in.dates)
+        fval = 0.0
+        dL_dc = numpy.zeros(coeff.shape) if grad else None
+        lag: Optional[int] = None
+        start = 0
+        while True:
+            # 相邻的块重叠lag行，使每块的输出恰好接续上一块的输出
+            stop = min(start + chunk_rows, nRows)
+            chunk = data_in.index(from_=start, to=stop)
+            with self._borrowed_sheet(chunk) as sheet:
+                output, _dL_dc = self._eval_chunk(
+                    coeff,
+                    chunk,
+                    sheet,
+                    grad=grad,
+                    regularize=regularize,
+                    debug=debug,
+                )
+                if lag is None:
+                    lag = chunk.sheet.shape[0] - output.shape[0]
+                    assert chunk_rows > lag, f"chunk_rows须大于模型的总lag({lag})"
+                fval -= numpy.sum(output[:, 0])
+                if dL_dc is not None:
+                    assert _dL_dc is not None
+                    dL_dc += _dL_dc
+            if stop == nRows:
+                return fval, dL_dc
+            start = stop - lag
+
+    def eval_chunked(
+        self,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        chunk_rows: int,
+        regularize: bool,
+        debug: bool = False,
+    ) -> float:
+        """
+        按chunk_rows行一块流式求值，只累加fval而不保留完整的输出表
+        峰值内存只与chunk_rows有关，可配合Variables.memmap处理大于内存的数据
+        """
+        fval, _ = self._eval_chunked(
+            coeff,
+            data_in,
+            chunk_rows=chunk_rows,
+            grad=False,
+            regularize=regularize,
+            debug=debug,
+        )
+        return fval
+
+    def value_and_grad_chunked(
+        self,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        chunk_rows: int,
+        regularize: bool,
+        debug: bool = False,
+    ) -> Tuple[float, ndarray]:
+        fval, dL_dc = self._eval_chunked(
+            coeff,
+            data_in,
+            chunk_rows=chunk_rows,
+            grad=True,
+            regularize=regularize,
+            debug=debug,
+        )
+        assert dL_dc is not None
+        return fval, dL_dc
+
+    def _eval_batch(
+        self,
+        coeffs: ndarray,
+        data_in: Sequence[Variables[T]],
+        *,
+        grad: bool,
+        regularize: bool,
+        debug: bool,
+    ) -> Tuple[ndarray, List[ndarray], Optional[Tuple[Any, ...]]]:
+        assert coeffs.shape == (
+            len(data_in),
+            len(self.coeff_names),
+        ), "向negLikelihood所输入的参数矩阵的尺寸与预期的不同"
+        for d in data_in:
+            assert (
+                d.data_names == self.data_names
+            ), "Variables中定义的变量与negLikelihood需要的变量似乎不同"
+            _check_sheet(d)
+        assertNoInfNaN(coeffs)
+
+        outputs, gradinfo = _eval_loop_batch(
+            self._get_stages(regularize=regularize),
+            coeffs,
+            [self._working_sheet(d) for d in data_in],
+            grad=grad,
+            debug=debug,
+        )
+        fvals = numpy.array([-numpy.sum(o[:, 0]) for o in outputs])
+        return fvals, outputs, gradinfo
+
+    def eval_batch(
+        self,
+        coeffs: ndarray,
+        data_in: Sequence[Variables[T]],
+        *,
+        regularize: bool,
+        debug: bool = False,
+    ) -> Tuple[ndarray, List[ndarray]]:
+        """
+        对多条等宽（长度可以不同）的序列同时求值
+        coeffs的第s行为第s条序列所用的参数，返回逐序列的fval与输出表
+        """
+        fvals, outputs, _ = self._eval_batch(
+            coeffs, data_in, grad=False, regularize=regularize, debug=debug
+        )
+        return fvals, outputs
+
+    def value_and_grad_batch(
+        self,
+        coeffs: ndarray,
+        data_in: Sequence[Variables[T]],
+        *,
+        regularize: bool,
+        debug: bool = False,
+    ) -> Tuple[ndarray, List[ndarray], ndarray]:
+        fvals, outputs, gradinfo = self._eval_batch(
+            coeffs, data_in, grad=True, regularize=regularize, debug=debug
+        )
+
+        dL_dL: List[ndarray] = []
+        for o in outputs:
+            dL_dL.append(numpy.zeros(o.shape))
+            dL_dL[-1][:, 0] = -1.0
+
+        assert gradinfo is not None
+        _, dL_dc = _grad_loop_batch(
+            self._get_stages(regularize=regularize),
+            coeffs,
+            gradinfo,
+            dL_dL,
+            debug=debug,
+        )
+
+        return fvals, outputs, dL_dc
+
     def register_constraints(
         self, coeff_index: ndarray, constraints: Constraints
     ) -> None:
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import copy
+import hashlib
+from datetime import datetime
+from typing import Any, List, Optional, Tuple, TypeVar
+
+import numpy
+from overloads.shortcuts import assertNoInfNaN
+from overloads.typedefs import ndarray
+
+from likelihood.cache import EvalCache, _Entry
+from likelihood.likelihood import _check_sheet, _streamable, negLikelihood
+from likelihood.stages.abc.Iterative import Iterative
+from likelihood.stages.abc.Stage import Stage
+from likelihood.stages.Mapping import Mapping
+from likelihood.Variables import Variables
+
+T = TypeVar("T", int, datetime)
+
+
+def _iterative(s: Stage[Any]) -> Optional[Iterative]:
+    if isinstance(s, Iterative):
+        return s
+    if isinstance(s, Mapping) and isinstance(s.submodel, Iterative):
+        return s.submodel
+    return None
+
+
+class OnlineFilter:
+    """
+    固定参数下的在线滤波：逐批追加观测，每个stage只推进新增的行
+    Iterative保留上一行输出与preserve，其余stage保留其输入的最后k行（Convolution的lag窗口）
+    首批数据的行数须超过模型的总lag，此后每批可以只有一行
+    """
+
+    nll: negLikelihood
+    coeff: ndarray
+    fval: float
+    nRows: int
+    _stages: Tuple[Stage[Any], ...]
+    _states: List[Any]
+
+    def __init__(
+        self, nll: negLikelihood, coeff: ndarray, *, regularize: bool = False
+    ) -> None:
+        assert coeff.shape == (len(nll.coeff_names),), "向negLikelihood所输入的参数向量的尺寸与预期的不同"
+        assertNoInfNaN(coeff)
+        stages = nll._get_stages(regularize=regularize)
+        for s in stages:
+            supported = _iterative(s) is not None or _streamable(s)
+            assert supported, f"{type(s).__name__}中嵌套了Iterative，无法在线推进"
+        self.nll = nll
+        self.coeff = coeff.copy()
+        self.fval = 0.0
+        self.nRows = 0
+        self._stages = stages
+        self._states = [None] * len(stages)
+
+    def update(self, data_in: Variables[T]) -> Tuple[float, ndarray]:
+        """
+        追加data_in中的观测，返回这一批的fval增量与输出表
+        首批的输出表比输入少总lag行，与negLikelihood.eval一致
+        """
+        assert (
+            data_in.data_names == self.nll.data_names
+        ), "Variables中定义的变量与negLikelihood需要的变量似乎不同"
+        _check_sheet(data_in)
+        output = data_in.sheet.copy()
+        if not output.shape[0]:
+            return 0.0, output
+
+        for i, s in enumerate(self._stages):
+            assert s.coeff_index is not None
+            if _iterative(s) is not None:
+                output = self._advance_iterative(
+                    i, s, self.coeff[s.coeff_index], output
+                )
+            else:
+                output = self._advance_window(i, s, self.coeff[s.coeff_index], output)
+
+        fval = -numpy.sum(output[:, 0])
+        self.fval += fval
+        self.nRows += output.shape[0]
+        return fval, output
+
+    def _advance_iterative(
+        self, i: int, s: Stage[Any], coeff: ndarray, input: ndarray
+    ) -> ndarray:
+        it = _iterative(s)
+        assert it is not None
+        if isinstance(s, Mapping):
+            coeff = coeff[s.expand_index]
+        if self._states[i] is None:
+            self._states[i] = it._initial_state(coeff)
+        _output, self._states[i] = it._eval_resume(
+            coeff, input[:, s.data_in_index], self._states[i]
+        )
+        return s._paste_output(input, _output)
+
+    def _advance_window(
+        self, i: int, s: Stage[Any], coeff: ndarray, input: ndarray
+    ) -> ndarray:
+        # eval会把输出原地写入其输入，须在求值之前取出下一批要用的lag窗口
+        if self._states[i] is None:
+            before = input.copy()
+            output, _ = s.eval(coeff, input, grad=False, debug=False)
+            k = input.shape[0] - output.shape[0]
+            start = before.shape[0] - k
+            self._states[i] = (k, before[start:, :])
+            return output
+
+        k, tail = self._states[i]
+        input = numpy.concatenate((tail, input), axis=0)
+        start = input.shape[0] - k
+        next_tail = input[start:, :].copy()
+        output, _ = s.eval(coeff, input, grad=False, debug=False)
+        assert output.shape[0] == input.shape[0] - k
+        self._states[i] = (k, next_tail)
+        return output
+
+
+def _digest(data_in: Variables[Any], nRows: int) -> Tuple[bytes, ...]:
+    # 逐列（含日期）分别计算前nRows行的摘要
+    columns = [data_in.dates.view(numpy.int64)[:nRows]]
+    columns.extend(data_in.sheet[:nRows, j] for j in range(data_in.sheet.shape[1]))
+    digests = []
+    for column in columns:
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(numpy.ascontiguousarray(column).data)
+        digests.append(hasher.digest())
+    return tuple(digests)
+
+
+def _same_memory(a: ndarray, b: ndarray) -> bool:
+    # Variables的sheet在构造后只读，指向同一段内存的同形数组内容必然相同
+    return (
+        not a.flags.writeable
+        and not b.flags.writeable
+        and a.shape == b.shape
+        and a.strides == b.strides
+        and a.__array_interface__["data"][0] == b.__array_interface__["data"][0]
+    )
+
+
+class WarmStart:
+    """
+    可分块求值（negLikelihood.is_streamable）的模型在coeff处对一段数据的fval、输出表与dL_dc
+    扩展窗口重新拟合时，extend先确认新数据以旧数据为前缀，然后与分块求值相同，
+    只对新增的行（向前重叠lag行）求值与反向扫描，再与前缀的结果拼接、相加，结果是精确的；
+    前缀不一致时退回到完整的求值
+    seed_cache把结果放入nll.cache，之后在coeff处对同一个Variables的eval、grad直接命中
+    digests为确认前缀时逐列计算摘要的次数
+    """
+
+    nll: negLikelihood
+    coeff: ndarray
+    regularize: bool
+    fval: float
+    output: ndarray
+    dL_dc: ndarray
+    nRows: int
+    lag: int
+    digests: int
+    _prefix: Variables[Any]
+
+    def __init__(
+        self,
+        nll: negLikelihood,
+        coeff: ndarray,
+        data_in: Variables[T],
+        *,
+        regularize: bool = False,
+    ) -> None:
+        assert nll.is_streamable(), "含有Iterative的模型无法只对新增的行求值"
+        # 通常在优化器刚求值过的点上建立，启用EvalCache时直接命中
+        fval, output, dL_dc = nll.value_and_grad(coeff, data_in, regularize=regularize)
+        self.nll = nll
+        self.coeff = coeff.copy()
+        self.regularize = regularize
+        self.fval = fval
+        self.output = output
+        self.dL_dc = dL_dc
+        self.nRows = len(data_in.dates)
+        self.lag = self.nRows - output.shape[0]
+        self.digests = 0
+        self._prefix = data_in
+
+    def matches(self, data_in: Variables[T]) -> bool:
+        """
+        data_in的前nRows行（含日期）是否与建立此状态时的数据完全相同
+        先比较列名、行数与首末日期；前缀的sheet与建立时的是同一段只读内存时
+        （如同一张表的不同index视图）直接认定相同，否则才逐列计算摘要
+        """
+        if data_in.data_names != self.nll.data_names:
+            return False
+        if len(data_in.dates) < self.nRows:
+            return False
+        prefix, last = data_in.index(from_=0, to=self.nRows), self.nRows - 1
+        if prefix.dates[0] != self._prefix.dates[0]:
+            return False
+        if prefix.dates[last] != self._prefix.dates[last]:
+            return False
+        if _same_memory(prefix.sheet, self._prefix.sheet):
+            return True
+        self.digests += 1
+        return _digest(data_in, self.nRows) == _digest(self._prefix, self.nRows)
+
+    def extend(self, data_in: Variables[T]) -> WarmStart:
+        if not self.matches(data_in):
+            return WarmStart(self.nll, self.coeff, data_in, regularize=self.regularize)
+        nRows = len(data_in.dates)
+        other = copy.copy(self)
+        other.nRows = nRows
+        other._prefix = data_in
+        if nRows == self.nRows:
+            return other
+
+        nll = self.nll
+        suffix = data_in.index(from_=self.nRows - self.lag, to=nRows)
+        output, dL_dc = nll._eval_chunk(
+            self.coeff,
+            suffix,
+            nll._working_sheet(suffix),
+            grad=True,
+            regularize=self.regularize,
+            debug=False,
+        )
+        assert dL_dc is not None
+        other.fval = self.fval - numpy.sum(output[:, 0])
+        other.output = numpy.concatenate((self.output, output), axis=0)
+        other.dL_dc = self.dL_dc + dL_dc
+        return other
+
+    def seed_cache(self) -> None:
+        """
+        以(coeff, data_in)为键把结果放入nll.cache，未启用EvalCache时什么也不做
+        """
+        cache = self.nll.cache
+        if cache is None:
+            return
+        key = EvalCache.key(
+            self.coeff, self._prefix, regularize=self.regularize, debug=False
+        )
+        entry = _Entry(self._prefix, self.fval, self.output, None)
+        entry.dL_dc = self.dL_dc
+        cache.put(key, entry)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import multiprocessing
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from likelihood.KnownIssue import KnownIssue
+from likelihood.likelihood import negLikelihood
+from likelihood.Variables import Variables
+
+T = TypeVar("T", int, datetime)
+R = TypeVar("R")
+
+_worker_nll: Optional[negLikelihood] = None
+_worker_fit: Optional[Callable[[negLikelihood, Variables[Any]], Any]] = None
+
+
+def _worker_init(
+    factory: Callable[[], negLikelihood],
+    fit: Callable[[negLikelihood, Variables[Any]], Any],
+) -> None:
+    # 每个worker只构造一次模型，其JittedFunction在该进程内只编译一次
+    global _worker_nll, _worker_fit
+    _worker_nll = factory()
+    _worker_fit = fit
+
+
+def _worker_run(task: Tuple[int, Variables[Any]]) -> Tuple[int, Any]:
+    index, data_in = task
+    assert _worker_nll is not None
+    assert _worker_fit is not None
+    try:
+        return index, _worker_fit(_worker_nll, data_in)
+    except KnownIssue as e:
+        # KnownIssue派生自BaseException，不能任其穿透Pool的worker
+        return index, e
+
+
+class FitPool(Generic[R]):
+    """
+    将多组Variables分发到进程池中逐一拟合
+    factory与fit须可被pickle（即模块顶层的函数）
+    """
+
+    _pool: Any
+
+    def __init__(
+        self,
+        factory: Callable[[], negLikelihood],
+        fit: Callable[[negLikelihood, Variables[Any]], R],
+        *,
+        processes: Optional[int] = None,
+    ) -> None:
+        self._pool = multiprocessing.Pool(
+            processes, initializer=_worker_init, initargs=(factory, fit)
+        )
+
+    def imap(
+        self, datasets: Iterable[Variables[T]], *, chunksize: int = 1
+    ) -> Iterator[Tuple[int, Union[R, KnownIssue]]]:
+        """
+        按完成顺序逐个返回(数据集序号, 拟合结果)
+        拟合中抛出的KnownIssue作为结果返回，而不是中断整个进程池
+        """
+        return self._pool.imap_unordered(  # type: ignore
+            _worker_run, enumerate(datasets), chunksize
+        )
+
+    def close(self) -> None:
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self) -> None:
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self) -> FitPool[R]:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.terminate()
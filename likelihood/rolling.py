@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import multiprocessing
+from datetime import datetime
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+import numpy
+from overloads.typedefs import ndarray
+
+from likelihood.KnownIssue import KnownIssue
+from likelihood.likelihood import negLikelihood
+from likelihood.online import WarmStart
+from likelihood.Variables import Variables
+
+T = TypeVar("T", int, datetime)
+
+_fit_t = Callable[[negLikelihood, Variables[Any], ndarray], ndarray]
+_chain_t = Tuple[int, List[Tuple[int, int]], ndarray, bool]
+_chain_result_t = List[Tuple[int, Any]]
+
+_worker_nll: Optional[negLikelihood] = None
+_worker_fit: Optional[_fit_t] = None
+_worker_data: Optional[Variables[Any]] = None
+
+
+class RollingResult(NamedTuple):
+    """
+    windows[w] = (from_, to)为第w个窗口的行区间，end_dates[w]为该窗口最后一行的日期
+    coeffs[w, :]为该窗口的估计值，拟合失败（KnownIssue）的窗口为NaN，原因见issues
+    """
+
+    windows: ndarray
+    end_dates: ndarray
+    coeffs: ndarray
+    issues: Dict[int, KnownIssue]
+
+
+def rolling_windows(
+    nRows: int, *, window: int, step: int = 1, expanding: bool = False
+) -> List[Tuple[int, int]]:
+    """
+    滚动窗口为[t-window, t)，扩展窗口为[0, t)，t从window起每次增加step直到nRows
+    """
+    assert 0 < window <= nRows
+    assert step > 0
+    return [(0 if expanding else t - window, t) for t in range(window, nRows + 1, step)]
+
+
+def _run_chain(
+    nll: negLikelihood, fit: _fit_t, data_in: Variables[Any], chain: _chain_t
+) -> _chain_result_t:
+    # 同一条链上的窗口依次拟合，每个窗口以上一个窗口的解为初始点
+    first, windows, beta, warm = chain
+    state: Optional[WarmStart] = None
+    results: _chain_result_t = []
+    for w, (from_, to) in enumerate(windows, first):
+        window_data = data_in.index(from_=from_, to=to)
+        try:
+            if state is not None:
+                # 初始点在新窗口上的结果只需对新增的行求值，预先放入缓存
+                state = state.extend(window_data)
+                state.seed_cache()
+            beta = fit(nll, window_data, beta)
+        except KnownIssue as e:
+            # KnownIssue派生自BaseException，作为结果返回；下一个窗口沿用之前的初始点
+            results.append((w, e))
+            continue
+        results.append((w, beta))
+        if warm:
+            try:
+                state = WarmStart(nll, beta, window_data)
+            except KnownIssue:
+                state = None
+    return results
+
+
+def _worker_init(nll: negLikelihood, fit: _fit_t, data_in: Variables[Any]) -> None:
+    global _worker_nll, _worker_fit, _worker_data
+    _worker_nll = nll
+    _worker_fit = fit
+    _worker_data = data_in
+
+
+def _worker_run(chain: _chain_t) -> _chain_result_t:
+    assert _worker_nll is not None
+    assert _worker_fit is not None
+    assert _worker_data is not None
+    return _run_chain(_worker_nll, _worker_fit, _worker_data, chain)
+
+
+def rolling_fit(
+    nll: negLikelihood,
+    fit: _fit_t,
+    data_in: Variables[T],
+    beta0: ndarray,
+    *,
+    window: int,
+    step: int = 1,
+    expanding: bool = False,
+    processes: Optional[int] = 0,
+    chains: Optional[int] = None,
+) -> RollingResult:
+    """
+    对每个窗口调用fit(nll, 窗口内的数据, 初始点)，窗口是data_in的视图而不是副本
+    窗口按时间顺序分成chains条链：链内依次拟合并以上一窗口的解热启动，各链之间并行
+    processes=0时在本进程内依次执行（chains默认为1），否则在进程池中执行
+    （chains默认为进程数），此时nll、fit与data_in须可被pickle；
+    由Variables.memmap或SharedVariables得到的data_in只以路径或句柄传递给worker
+    扩展窗口下，若模型可分块求值且nll启用了EvalCache，则以WarmStart
+    由上一窗口的解在旧窗口上的结果（通常命中缓存）加上新增行的求值，
+    得到它在新窗口上的fval与梯度，fit在初始点上的首次eval、grad不必完整求值
+    """
+    windows = rolling_windows(
+        len(data_in.dates), window=window, step=step, expanding=expanding
+    )
+    if chains is None:
+        chains = 1 if processes == 0 else (processes or multiprocessing.cpu_count())
+    chains = max(1, min(chains, len(windows)))
+    bounds = numpy.linspace(0, len(windows), chains + 1).astype(numpy.int64)
+    warm = expanding and nll.cache is not None and nll.is_streamable()
+    tasks: List[_chain_t] = [
+        (int(lo), windows[lo:hi], beta0, warm)
+        for lo, hi in zip(bounds[:-1], bounds[1:])
+    ]
+
+    results: _chain_result_t = []
+    if processes == 0:
+        for task in tasks:
+            results.extend(_run_chain(nll, fit, data_in, task))
+    else:
+        with multiprocessing.Pool(
+            processes, initializer=_worker_init, initargs=(nll, fit, data_in)
+        ) as pool:
+            for chain_results in pool.imap_unordered(_worker_run, tasks):
+                results.extend(chain_results)
+
+    coeffs = numpy.full((len(windows), beta0.shape[0]), numpy.nan)
+    issues: Dict[int, KnownIssue] = {}
+    for w, result in results:
+        if isinstance(result, KnownIssue):
+            issues[w] = result
+        else:
+            coeffs[w, :] = result
+    _windows = numpy.array(windows, dtype=numpy.int64)
+    return RollingResult(_windows, data_in.dates[_windows[:, 1] - 1], coeffs, issues)
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import sys
+import threading
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+from typing import Any, Dict, NamedTuple, Optional, Sized, Tuple
+
+import numpy
+from overloads.typedefs import ndarray
+
+from likelihood.Variables import Variables, _decode_dates, _encode_dates
+
+_Register_Lock = threading.Lock()
+
+
+def _open(name: str) -> shared_memory.SharedMemory:
+    # 只读挂载的一方不登记到resource_tracker，共享内存的生命期由发布方负责
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    # 3.13之前挂载时也会登记，worker若有自己的resource_tracker，退出时会删除共享内存；
+    # 挂载后再注销又会删去同一resource_tracker中发布方的登记，因此挂载期间跳过这一登记
+    attached = (name, "/" + name)
+    with _Register_Lock:
+        register = resource_tracker.register
+
+        def register_others(name: Sized, rtype: str) -> None:
+            if rtype != "shared_memory" or name not in attached:
+                register(name, rtype)
+
+        resource_tracker.register = register_others
+        try:
+            return shared_memory.SharedMemory(name=name)
+        finally:
+            resource_tracker.register = register
+
+
+class _Mapping:
+    """
+    持有共享内存的映射，由它导出的数组（及其视图、切片）都以它为base，
+    只要还有数组存在，映射就不会被关闭
+    """
+
+    shm: shared_memory.SharedMemory
+    __array_interface__: Dict[str, Any]
+
+    def __init__(self, shm: shared_memory.SharedMemory, writeable: bool) -> None:
+        self.shm = shm
+        address = numpy.frombuffer(shm.buf, dtype=numpy.uint8).ctypes.data
+        self.__array_interface__ = {
+            "shape": (shm.size,),
+            "typestr": "|u1",
+            "data": (address, not writeable),
+            "version": 3,
+        }
+
+
+def _arrays(mapping: _Mapping, rows: int, cols: int) -> Tuple[ndarray, ndarray]:
+    # 布局：日期(int64) | 数据(float64, 按列存放)
+    root: ndarray = numpy.asarray(mapping)
+    dates: ndarray = root[: rows * 8].view(numpy.int64)
+    sheet: ndarray = root[rows * 8 : rows * 8 * (1 + cols)].view(numpy.float64)
+    return dates, sheet.reshape((rows, cols), order="F")
+
+
+def _view(mapping: _Mapping, handle: SharedHandle) -> Variables[Any]:
+    dates, sheet = _arrays(mapping, handle.rows, len(handle.data_names))
+    variables: Variables[Any] = Variables._view(
+        _decode_dates(handle.date_kind, dates), handle.data_names, sheet
+    )
+    variables._reduce = (SharedHandle.attach, (handle,))
+    return variables
+
+
+class SharedHandle(NamedTuple):
+    """
+    共享内存中变量表的句柄，只含名称与尺寸，可廉价地pickle给worker进程
+    """
+
+    name: str
+    rows: int
+    data_names: Tuple[str, ...]
+    date_kind: str
+
+    def attach(self) -> Variables[Any]:
+        """
+        以只读、零复制的方式挂载共享内存中的变量表
+        """
+        return _view(_Mapping(_open(self.name), writeable=False), self)
+
+
+class SharedVariables:
+    """
+    将Variables复制一份到multiprocessing.shared_memory中
+    N个worker挂载同一份数据，而不是各自收到一份pickle的副本
+    发布方负责close/unlink，须在所有worker结束后调用
+    """
+
+    handle: SharedHandle
+    variables: Variables[Any]
+    _mapping: Optional[_Mapping]
+
+    def __init__(self, variables: Variables[Any]) -> None:
+        date_kind, dates = _encode_dates(variables.dates)
+        rows, cols = variables.sheet.shape
+        shm = shared_memory.SharedMemory(create=True, size=rows * 8 * (1 + cols))
+        self.handle = SharedHandle(shm.name, rows, variables.data_names, date_kind)
+        # 先经可写的映射填入数据，再对外给出只读的视图
+        dates_out, sheet_out = _arrays(_Mapping(shm, writeable=True), rows, cols)
+        dates_out[:] = dates
+        sheet_out[:] = variables.sheet
+        del dates_out, sheet_out
+        self._mapping = _Mapping(shm, writeable=False)
+        self.variables = _view(self._mapping, self.handle)
+
+    def close(self) -> None:
+        """
+        释放发布方的映射并删除共享内存，已挂载的worker的映射不受影响
+        发布方导出的数组仍被引用时，映射保留到这些数组被回收为止
+        """
+        if self._mapping is None:
+            return
+        del self.variables
+        mapping, self._mapping = self._mapping, None
+        shm, alive = mapping.shm, weakref.ref(mapping)
+        del mapping
+        if alive() is None:
+            shm.close()
+        shm.unlink()
+
+    def __enter__(self) -> SharedVariables:
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.close()
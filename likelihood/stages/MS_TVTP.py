@@ -426,6 +426,358 @@ def _tvtp_grad_generate(
     return implement
 
 
+def _tvtp_output0_log_generate(
+    out0_f1: Callable[[ndarray], Tuple[ndarray, ndarray, ndarray, ndarray]],
+    out0_f2: Callable[[ndarray], Tuple[ndarray, ndarray, ndarray, ndarray]],
+) -> Callable[[ndarray], Tuple[ndarray, ndarray, ndarray, ndarray]]:
+    def implement(coeff: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        halfCoeff = nCoeff // 2
+        assert halfCoeff * 2 == nCoeff
+
+        out0_1, dout_1, pre_1, dpre_1 = out0_f1(coeff[:halfCoeff])
+        out0_2, dout_2, pre_2, dpre_2 = out0_f2(coeff[halfCoeff:])
+
+        logHalf = math.log(0.5)
+        out0: ndarray = numpy.concatenate(  # type: ignore
+            (numpy.array([0.0, 0.0, 0.0, logHalf, logHalf]), out0_1, out0_2)
+        )
+        pre: ndarray = numpy.concatenate((pre_1, pre_2))  # type: ignore
+
+        (nOut,) = out0_1.shape
+        (nPre,) = pre_1.shape
+
+        dout = numpy.zeros((nOut * 2 + 5, halfCoeff * 2))
+        dout[5 : (nOut + 5), :halfCoeff] = dout_1
+        dout[(nOut + 5) : (2 * nOut + 5), halfCoeff:] = dout_2
+
+        dpre = numpy.zeros((nPre * 2, halfCoeff * 2))
+        dpre[:nPre, :halfCoeff] = dpre_1
+        dpre[nPre:, halfCoeff:] = dpre_2
+
+        return out0, dout, pre, dpre
+
+    return implement
+
+
+def _tvtp_eval_log_generate(
+    eval_f1: Callable[[ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]],
+    eval_f2: Callable[[ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]],
+    likeli_provider: Callable[[ndarray], float],
+    logaddexp: Callable[[float, float], float],
+) -> Callable[[ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]]:
+    def implement(
+        coeff: ndarray, input: ndarray, lag: ndarray, pre: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        halfCoeff = nCoeff // 2
+        assert halfCoeff * 2 == nCoeff
+
+        p11: float
+        p22: float
+        p11, p22, input = input[0], input[1], input[2:]
+        (nInput,) = input.shape
+        halfInput = nInput // 2
+        assert halfInput * 2 == nInput
+
+        # 后验概率列存放的是对数后验概率
+        lag_logpost1: float
+        lag_logpost2: float
+        lag_logpost1, lag_logpost2, lag = lag[3], lag[4], lag[5:]
+        (nLag,) = lag.shape
+        halfLag = nLag // 2
+        assert halfLag * 2 == nLag
+
+        (nPre,) = pre.shape
+        halfPre = nPre // 2
+        assert halfPre * 2 == nPre
+
+        # 转移概率为0的路径取-inf
+        logp11 = math.log(p11) if p11 > 0 else -math.inf
+        logq11 = math.log(1.0 - p11) if p11 < 1 else -math.inf
+        logp22 = math.log(p22) if p22 > 0 else -math.inf
+        logq22 = math.log(1.0 - p22) if p22 < 1 else -math.inf
+
+        logpath11 = logp11 + lag_logpost1
+        logpath12 = logq22 + lag_logpost2
+        logpath21 = logq11 + lag_logpost1
+        logpath22 = logp22 + lag_logpost2
+
+        rawprior1 = logaddexp(logpath11, logpath12)
+        rawprior2 = logaddexp(logpath21, logpath22)
+        归一化stage1 = logaddexp(rawprior1, rawprior2)
+
+        logprior1 = rawprior1 - 归一化stage1
+        logprior2 = rawprior2 - 归一化stage1
+        prior1 = math.exp(logprior1)
+        prior2 = math.exp(logprior2)
+
+        if rawprior1 > -math.inf:
+            contrib11 = math.exp(logpath11 - rawprior1)
+            contrib12 = math.exp(logpath12 - rawprior1)
+        else:
+            contrib11, contrib12 = 0.5, 0.5
+        if rawprior2 > -math.inf:
+            contrib21 = math.exp(logpath21 - rawprior2)
+            contrib22 = math.exp(logpath22 - rawprior2)
+        else:
+            contrib21, contrib22 = 0.5, 0.5
+
+        rawlag1 = lag[:halfLag]
+        rawlag2 = lag[halfLag:]
+
+        lag1 = contrib11 * rawlag1 + contrib12 * rawlag2
+        lag2 = contrib21 * rawlag1 + contrib22 * rawlag2
+
+        out_1, pre[:halfPre] = eval_f1(
+            coeff[:halfCoeff], input[:halfInput], lag1, pre[:halfPre]
+        )
+        out_2, pre[halfPre:] = eval_f2(
+            coeff[halfCoeff:], input[halfInput:], lag2, pre[halfPre:]
+        )
+
+        loglikeli1: float = likeli_provider(out_1)
+        loglikeli2: float = likeli_provider(out_2)
+
+        rawpost1 = logprior1 + loglikeli1
+        rawpost2 = logprior2 + loglikeli2
+        likelihood = logaddexp(rawpost1, rawpost2)
+
+        logpost1 = rawpost1 - likelihood
+        logpost2 = rawpost2 - likelihood
+
+        EX2_1 = out_1[2] + out_1[1] * out_1[1]
+        EX2_2 = out_2[2] + out_2[1] * out_2[1]
+        EX = prior1 * out_1[1] + prior2 * out_2[1]
+        var = max((prior1 * EX2_1 + prior2 * EX2_2) - EX * EX, 0.0)
+
+        return (
+            numpy.concatenate(  # type: ignore
+                (
+                    numpy.array(
+                        [
+                            likelihood,
+                            EX,
+                            var,
+                            logpost1,
+                            logpost2,
+                        ]
+                    ),
+                    out_1,
+                    out_2,
+                )
+            ),
+            pre,
+        )
+
+    return implement
+
+
+def _tvtp_grad_log_generate(
+    grad_f1: Callable[
+        [ndarray, ndarray, ndarray, ndarray, ndarray, ndarray],
+        Tuple[ndarray, ndarray, ndarray, ndarray],
+    ],
+    grad_f2: Callable[
+        [ndarray, ndarray, ndarray, ndarray, ndarray, ndarray],
+        Tuple[ndarray, ndarray, ndarray, ndarray],
+    ],
+    likeli_provider: Callable[[ndarray], float],
+    likeli_gradient: Callable[[ndarray, float, float], ndarray],
+    logaddexp: Callable[[float, float], float],
+) -> Callable[
+    [ndarray, ndarray, ndarray, ndarray, ndarray, ndarray],
+    Tuple[ndarray, ndarray, ndarray, ndarray],
+]:
+    def implement(
+        coeff: ndarray,
+        input: ndarray,
+        lag: ndarray,
+        output: ndarray,
+        dL_do: ndarray,
+        dL_dpre: ndarray,
+    ) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        halfCoeff = nCoeff // 2
+        assert halfCoeff * 2 == nCoeff
+
+        p11: float
+        p22: float
+        p11, p22, input = input[0], input[1], input[2:]
+        (nInput,) = input.shape
+        halfInput = nInput // 2
+        assert halfInput * 2 == nInput
+
+        lag_logpost1: float
+        lag_logpost2: float
+        lag_logpost1, lag_logpost2, lag = lag[3], lag[4], lag[5:]
+        (nLag,) = lag.shape
+        halfLag = nLag // 2
+        assert halfLag * 2 == nLag
+
+        logpost1: float
+        logpost2: float
+        dL_dlogpost1: float
+        dL_dlogpost2: float
+        logpost1, logpost2 = output[3], output[4]
+        output, dL_dlike, dL_dEX, dL_dvar, dL_dlogpost1, dL_dlogpost2, dL_do = (
+            output[5:],
+            dL_do[0],
+            dL_do[1],
+            dL_do[2],
+            dL_do[3],
+            dL_do[4],
+            dL_do[5:],
+        )
+        (nOutput,) = output.shape
+        halfOutput = nOutput // 2
+        assert halfOutput * 2 == nOutput
+
+        (nPre,) = dL_dpre.shape
+        halfPre = nPre // 2
+        assert halfPre * 2 == nPre
+
+        out1 = output[:halfOutput]
+        out2 = output[halfOutput:]
+
+        dL_dout1 = dL_do[:halfOutput]
+        dL_dout2 = dL_do[halfOutput:]
+
+        loglikeli1: float = likeli_provider(out1)
+        loglikeli2: float = likeli_provider(out2)
+
+        logp11 = math.log(p11) if p11 > 0 else -math.inf
+        logq11 = math.log(1.0 - p11) if p11 < 1 else -math.inf
+        logp22 = math.log(p22) if p22 > 0 else -math.inf
+        logq22 = math.log(1.0 - p22) if p22 < 1 else -math.inf
+
+        logpath11 = logp11 + lag_logpost1
+        logpath12 = logq22 + lag_logpost2
+        logpath21 = logq11 + lag_logpost1
+        logpath22 = logp22 + lag_logpost2
+
+        rawprior1 = logaddexp(logpath11, logpath12)
+        rawprior2 = logaddexp(logpath21, logpath22)
+        归一化stage1 = logaddexp(rawprior1, rawprior2)
+
+        prior1 = math.exp(rawprior1 - 归一化stage1)
+        prior2 = math.exp(rawprior2 - 归一化stage1)
+
+        if rawprior1 > -math.inf:
+            contrib11 = math.exp(logpath11 - rawprior1)
+            contrib12 = math.exp(logpath12 - rawprior1)
+            prior1_patched = False
+        else:
+            contrib11, contrib12 = 0.5, 0.5
+            prior1_patched = True
+        if rawprior2 > -math.inf:
+            contrib21 = math.exp(logpath21 - rawprior2)
+            contrib22 = math.exp(logpath22 - rawprior2)
+            prior2_patched = False
+        else:
+            contrib21, contrib22 = 0.5, 0.5
+            prior2_patched = True
+
+        rawlag1 = lag[:halfLag]
+        rawlag2 = lag[halfLag:]
+
+        lag1 = contrib11 * rawlag1 + contrib12 * rawlag2
+        lag2 = contrib21 * rawlag1 + contrib22 * rawlag2
+
+        post1 = math.exp(logpost1)
+        post2 = math.exp(logpost2)
+
+        EX2_1 = out1[2] + out1[1] * out1[1]
+        EX2_2 = out2[2] + out2[1] * out2[1]
+        EX = prior1 * out1[1] + prior2 * out2[1]
+
+        dL_dEX2_1 = dL_dvar * prior1
+        dL_dEX2_2 = dL_dvar * prior2
+        dL_dEX += -dL_dvar * (2 * EX)
+
+        # likelihood = logaddexp(rawpost1, rawpost2)，其对rawpost的导数为post
+        dL_dlikelihood = dL_dlike - (dL_dlogpost1 + dL_dlogpost2)
+        dL_drawpost1 = dL_dlogpost1 + dL_dlikelihood * post1
+        dL_drawpost2 = dL_dlogpost2 + dL_dlikelihood * post2
+
+        dL_dlogprior1 = dL_drawpost1 + (dL_dvar * EX2_1 + dL_dEX * out1[1]) * prior1
+        dL_dlogprior2 = dL_drawpost2 + (dL_dvar * EX2_2 + dL_dEX * out2[1]) * prior2
+
+        dL_dout1 += likeli_gradient(out1, loglikeli1, dL_drawpost1)
+        dL_dout2 += likeli_gradient(out2, loglikeli2, dL_drawpost2)
+        dL_dout1[1] += dL_dEX * prior1 + dL_dEX2_1 * (2 * out1[1])
+        dL_dout2[1] += dL_dEX * prior2 + dL_dEX2_2 * (2 * out2[1])
+        dL_dout1[2] += dL_dEX2_1
+        dL_dout2[2] += dL_dEX2_2
+
+        dL_dcoeff1, dL_dinput1, dL_dlag1, dL_dpre[:halfPre] = grad_f1(
+            coeff[:halfCoeff],
+            input[:halfInput],
+            lag1,
+            out1,
+            dL_dout1,
+            dL_dpre[:halfPre],
+        )
+        dL_dcoeff2, dL_dinput2, dL_dlag2, dL_dpre[halfPre:] = grad_f2(
+            coeff[halfCoeff:],
+            input[halfInput:],
+            lag2,
+            out2,
+            dL_dout2,
+            dL_dpre[halfPre:],
+        )
+
+        dL_drawlag1: ndarray = (
+            dL_dlag1 * contrib11 + dL_dlag2 * contrib21  # type: ignore
+        )
+        dL_drawlag2: ndarray = (
+            dL_dlag1 * contrib12 + dL_dlag2 * contrib22  # type: ignore
+        )
+
+        # contrib是logpath在各自rawprior内的softmax
+        if prior1_patched:
+            dL_dlogpath11, dL_dlogpath12 = 0.0, 0.0
+        else:
+            dL_dcontrib1 = float(dL_dlag1 @ (rawlag1 - rawlag2))
+            dL_drawprior1 = dL_dlogprior1 * (1.0 - prior1) - dL_dlogprior2 * prior1
+            dL_dlogpath11 = contrib11 * (dL_drawprior1 + contrib12 * dL_dcontrib1)
+            dL_dlogpath12 = contrib12 * (dL_drawprior1 - contrib11 * dL_dcontrib1)
+        if prior2_patched:
+            dL_dlogpath21, dL_dlogpath22 = 0.0, 0.0
+        else:
+            dL_dcontrib2 = float(dL_dlag2 @ (rawlag1 - rawlag2))
+            dL_drawprior2 = dL_dlogprior2 * (1.0 - prior2) - dL_dlogprior1 * prior2
+            dL_dlogpath21 = contrib21 * (dL_drawprior2 + contrib22 * dL_dcontrib2)
+            dL_dlogpath22 = contrib22 * (dL_drawprior2 - contrib21 * dL_dcontrib2)
+
+        dL_dlaglogpost1 = dL_dlogpath11 + dL_dlogpath21
+        dL_dlaglogpost2 = dL_dlogpath12 + dL_dlogpath22
+
+        # 转移概率为0的路径对应的导数也为0
+        dL_dp11 = (dL_dlogpath11 / p11 if p11 > 0 else 0.0) - (
+            dL_dlogpath21 / (1.0 - p11) if p11 < 1 else 0.0
+        )
+        dL_dp22 = (dL_dlogpath22 / p22 if p22 > 0 else 0.0) - (
+            dL_dlogpath12 / (1.0 - p22) if p22 < 1 else 0.0
+        )
+
+        dL_dcoeff: ndarray = numpy.concatenate((dL_dcoeff1, dL_dcoeff2))  # type: ignore
+        dL_dinput: ndarray = numpy.concatenate(  # type: ignore
+            (numpy.array([dL_dp11, dL_dp22]), dL_dinput1, dL_dinput2)
+        )
+        dL_drawlag: ndarray = numpy.concatenate(  # type: ignore
+            (
+                numpy.array([0.0, 0.0, 0.0, dL_dlaglogpost1, dL_dlaglogpost2]),
+                dL_drawlag1,
+                dL_drawlag2,
+            )
+        )
+
+        return (dL_dcoeff, dL_dinput, dL_drawlag, dL_dpre)
+
+    return implement
+
+
 def normpdf_provider() -> Callable[[ndarray], float]:
     def implement(output: ndarray) -> float:
         """
@@ -465,6 +817,64 @@ def normpdf_provider_gradient() -> Callable[[ndarray, float, float], ndarray]:
     return implement
 
 
+def _logaddexp_generate() -> Callable[[float, float], float]:
+    def implement(x: float, y: float) -> float:
+        """
+        log(exp(x) + exp(y))，两者均为-inf时结果为-inf
+        """
+        m = max(x, y)
+        if m == -math.inf:
+            return m
+        return m + math.log(math.exp(x - m) + math.exp(y - m))  # type: ignore
+
+    return implement
+
+
+_logaddexp = JittedFunction(
+    _signature_t(float64(float64, float64)), (), _logaddexp_generate
+)
+
+
+def _kim_smoother_generate() -> Callable[[ndarray, ndarray, ndarray, ndarray], ndarray]:
+    def implement(
+        p11: ndarray, p22: ndarray, post1: ndarray, post2: ndarray
+    ) -> ndarray:
+        """
+        Kim smoother：由滤波得到的后验概率自后向前一遍得到平滑概率
+        第t行的转移概率p11[t], p22[t]描述由第t-1行到第t行的转移
+        smooth[t, i] = post[t, i] * sum_j P[t+1](i->j) * smooth[t+1, j] / prior[t+1, j]
+        """
+        (n,) = post1.shape
+        smooth = numpy.empty((n, 2))
+        if n == 0:
+            return smooth
+        smooth[n - 1, 0] = post1[n - 1]
+        smooth[n - 1, 1] = post2[n - 1]
+        for t in range(n - 2, -1, -1):
+            q11, q22 = p11[t + 1], p22[t + 1]
+            prior1 = q11 * post1[t] + (1.0 - q22) * post2[t]
+            prior2 = (1.0 - q11) * post1[t] + q22 * post2[t]
+            # 先验概率为0的状态其平滑概率也为0，不参与反向传播
+            ratio1 = smooth[t + 1, 0] / prior1 if prior1 > 0 else 0.0
+            ratio2 = smooth[t + 1, 1] / prior2 if prior2 > 0 else 0.0
+            s1 = post1[t] * (q11 * ratio1 + (1.0 - q11) * ratio2)
+            s2 = post2[t] * ((1.0 - q22) * ratio1 + q22 * ratio2)
+            total = s1 + s2
+            if total > 0:
+                smooth[t, 0], smooth[t, 1] = s1 / total, s2 / total
+            else:
+                smooth[t, 0], smooth[t, 1] = post1[t], post2[t]
+        return smooth
+
+    return implement
+
+
+_kim_smoother = JittedFunction(
+    _signature_t(float64[:, :](float64[:], float64[:], float64[:], float64[:])),
+    (),
+    _kim_smoother_generate,
+)
+
 _provider_signature = _signature_t(float64(float64[:]))
 _provider_gradient_signature = _signature_t(float64[:](float64[:], float64, float64))
 
@@ -484,6 +894,14 @@ providers: Dict[
 
 
 class MS_TVTP(Iterative.Iterative, Logpdf.Logpdf[Iterative._Signature.GradInfo]):
+    """
+    logspace=True时在对数空间中做前向滤波：post列存放对数后验概率，
+    归一化由logaddexp完成，不再需要对归一化常数为0的修补；
+    post列的取值因此与logspace=False时不同
+    """
+
+    logspace: bool
+
     def __init__(
         self,
         submodels: Tuple[Iterative.Iterative, Iterative.Iterative],
@@ -493,34 +911,72 @@ class MS_TVTP(Iterative.Iterative, Logpdf.Logpdf[Iterative._Signature.GradInfo])
         ],
         data_in_names: Tuple[str, str],
         data_out_names: Tuple[str, str, str, str, str],
+        *,
+        logspace: bool = False,
     ) -> None:
         assert isinstance(submodels[0], type(submodels[1]))
         assert isinstance(submodels[1], type(submodels[0]))
         assert len(submodels[0].data_in_names) == len(submodels[1].data_in_names)
         assert len(submodels[0].data_out_names) == len(submodels[1].data_out_names)
 
-        super().__init__(
-            (),
-            data_in_names,
-            data_out_names,
-            submodels,
-            JittedFunction(
+        self.logspace = logspace
+        if logspace:
+            output0 = JittedFunction(
+                Iterative._Numba.Output0,
+                tuple(x._output0_scalar for x in submodels),
+                _tvtp_output0_log_generate,
+            )
+            eval = JittedFunction(
+                Iterative._Numba.Eval,
+                tuple(x._eval_scalar for x in submodels) + provider[:1] + (_logaddexp,),
+                _tvtp_eval_log_generate,
+            )
+            grad = JittedFunction(
+                Iterative._Numba.Grad,
+                tuple(x._grad_scalar for x in submodels) + provider + (_logaddexp,),
+                _tvtp_grad_log_generate,
+            )
+        else:
+            output0 = JittedFunction(
                 Iterative._Numba.Output0,
                 tuple(x._output0_scalar for x in submodels),
                 _tvtp_output0_generate,
-            ),
-            JittedFunction(
+            )
+            eval = JittedFunction(
                 Iterative._Numba.Eval,
                 tuple(x._eval_scalar for x in submodels) + provider[:1],
                 _tvtp_eval_generate,
-            ),
-            JittedFunction(
+            )
+            grad = JittedFunction(
                 Iterative._Numba.Grad,
                 tuple(x._grad_scalar for x in submodels) + provider,
                 _tvtp_grad_generate,
-            ),
+            )
+
+        super().__init__(
+            (), data_in_names, data_out_names, submodels, output0, eval, grad
         )
 
+    def smooth(self, output: ndarray, *, debug: bool = False) -> ndarray:
+        """
+        由negLikelihood.eval输出的表中的转移概率与滤波后验概率计算平滑概率，
+        不重新做前向计算；返回n*2的数组，两列依次为两个状态
+        要求转移概率所在的列没有被输出覆盖
+        """
+        assert self.data_in_index is not None
+        assert self.data_out_index is not None
+        assert not (
+            set(self.data_in_names[:2]) & set(self.data_out_names)
+        ), "转移概率所在的列被输出覆盖，无法计算平滑概率"
+        p11 = numpy.ascontiguousarray(output[:, self.data_in_index[0]])
+        p22 = numpy.ascontiguousarray(output[:, self.data_in_index[1]])
+        post1 = numpy.ascontiguousarray(output[:, self.data_out_index[3]])
+        post2 = numpy.ascontiguousarray(output[:, self.data_out_index[4]])
+        if self.logspace:
+            post1, post2 = numpy.exp(post1), numpy.exp(post2)
+        impl = _kim_smoother.py_func() if debug else _kim_smoother.func()
+        return impl(p11, p22, post1, post2)
+
     def get_constraints(self) -> Constraints:
         return Constraints(
             numpy.empty((0, len(self.coeff_names))),
@@ -0,0 +1,361 @@
+from __future__ import annotations
+
+import math
+from typing import Any, Callable, Tuple
+
+import numpy
+from likelihood.jit import JittedFunction
+from likelihood.stages.abc import Iterative, Logpdf
+from likelihood.stages.abc.Stage import Constraints
+from likelihood.stages.MS_TVTP import _eps
+from overloads.typedefs import ndarray
+
+"""
+K个状态的MS_TVTP，K == 2时与MS_TVTP一致
+输入：转移概率矩阵P按行展开的K*K列，P[i, j]为由状态i转移到状态j的概率，
+      之后依次为各子模型的输入
+输出：likelihood, EX, var, post_1, ..., post_K，之后依次为各子模型的输出
+各子模型须为同一类型，coeff按子模型的顺序等分
+"""
+
+
+def _tvtp_k_output0_generate(
+    *out0_fs: Callable[[ndarray], Tuple[ndarray, ndarray, ndarray, ndarray]],
+) -> Callable[[ndarray], Tuple[ndarray, ndarray, ndarray, ndarray]]:
+    K = len(out0_fs)
+    out0_f = out0_fs[0]
+
+    def implement(coeff: ndarray) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        nC = nCoeff // K
+        assert nC * K == nCoeff
+
+        out0_1, dout_1, pre_1, dpre_1 = out0_f(coeff[:nC])
+        (nOut,) = out0_1.shape
+        (nPre,) = pre_1.shape
+
+        out0 = numpy.zeros((3 + K + K * nOut,))
+        dout = numpy.zeros((3 + K + K * nOut, nCoeff))
+        pre = numpy.zeros((K * nPre,))
+        dpre = numpy.zeros((K * nPre, nCoeff))
+        out0[3 : 3 + K] = 1.0 / K
+        for j in range(K):
+            out0_j, dout_j, pre_j, dpre_j = out0_f(coeff[j * nC : (j + 1) * nC])
+            start = 3 + K + j * nOut
+            out0[start : start + nOut] = out0_j
+            dout[start : start + nOut, j * nC : (j + 1) * nC] = dout_j
+            pre[j * nPre : (j + 1) * nPre] = pre_j
+            dpre[j * nPre : (j + 1) * nPre, j * nC : (j + 1) * nC] = dpre_j
+
+        return out0, dout, pre, dpre
+
+    return implement
+
+
+def _tvtp_k_eval_generate(
+    likeli_provider: Callable[[ndarray], float],
+    *eval_fs: Callable[[ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]],
+) -> Callable[[ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]]:
+    K = len(eval_fs)
+    eval_f = eval_fs[0]
+
+    def implement(
+        coeff: ndarray, input: ndarray, lag: ndarray, pre: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        nC = nCoeff // K
+        assert nC * K == nCoeff
+        nI = (input.shape[0] - K * K) // K
+        assert K * K + nI * K == input.shape[0]
+        nL = (lag.shape[0] - 3 - K) // K
+        assert 3 + K + nL * K == lag.shape[0]
+        nP = pre.shape[0] // K
+        assert nP * K == pre.shape[0]
+
+        # path[i, j]：上一期处于状态i、本期转移到状态j的概率
+        # 每步只分配少量K维的数组，其余按元素循环，避免numpy表达式的临时数组
+        path = numpy.empty((K, K))
+        归一化stage1 = 0.0
+        for j in range(K):
+            for i in range(K):
+                path[i, j] = input[i * K + j] * lag[3 + i]
+                归一化stage1 += path[i, j]
+        # 如果归一化stage1出现0，就是前序likelihood跑飞了
+        if 归一化stage1 == 0:
+            归一化stage1 = 1
+        path /= 归一化stage1
+        prior = numpy.zeros((K,))
+        for j in range(K):
+            for i in range(K):
+                prior[j] += path[i, j]
+
+        output = numpy.empty((3 + K + K * nL,))
+        loglikeli = numpy.empty((K,))
+        lag_j = numpy.empty((nL,))
+        for j in range(K):
+            # 本期状态j的子模型以各来源状态的子模型输出按contrib[i, j]加权作为lag
+            lag_j[:] = 0.0
+            for i in range(K):
+                contrib = path[i, j] / prior[j] if prior[j] > _eps else 1.0 / K
+                for k in range(nL):
+                    lag_j[k] += contrib * lag[3 + K + i * nL + k]
+            out_j, pre[j * nP : (j + 1) * nP] = eval_f(
+                coeff[j * nC : (j + 1) * nC],
+                input[K * K + j * nI : K * K + (j + 1) * nI],
+                lag_j,
+                pre[j * nP : (j + 1) * nP],
+            )
+            output[3 + K + j * nL : 3 + K + (j + 1) * nL] = out_j
+            loglikeli[j] = likeli_provider(out_j)
+
+        # 乘以倍数exp(loglikeli_offset)使最大的pdf为1，避免pdf太小出现0
+        loglikeli_offset = -loglikeli.max()
+        归一化stage2 = 0.0
+        for j in range(K):
+            # rawpost暂存于output的后验列
+            output[3 + j] = prior[j] * math.exp(loglikeli[j] + loglikeli_offset)
+            归一化stage2 += output[3 + j]
+
+        for j in range(K):
+            if 归一化stage2 == 0:
+                # 各状态的后验均下溢为0，Bayes filter输入输出结果不变
+                output[3 + j] = prior[j]
+            else:
+                output[3 + j] /= 归一化stage2
+        output[0] = math.log(归一化stage2) - loglikeli_offset
+
+        EX, EX2 = 0.0, 0.0
+        for j in range(K):
+            mu, var = output[3 + K + j * nL + 1], output[3 + K + j * nL + 2]
+            EX += prior[j] * mu
+            EX2 += prior[j] * (var + mu * mu)
+        output[1] = EX
+        output[2] = max(EX2 - EX * EX, 0.0)
+        return output, pre
+
+    return implement
+
+
+def _tvtp_k_grad_generate(
+    likeli_provider: Callable[[ndarray], float],
+    likeli_gradient: Callable[[ndarray, float, float], ndarray],
+    *grad_fs: Callable[
+        [ndarray, ndarray, ndarray, ndarray, ndarray, ndarray],
+        Tuple[ndarray, ndarray, ndarray, ndarray],
+    ],
+) -> Callable[
+    [ndarray, ndarray, ndarray, ndarray, ndarray, ndarray],
+    Tuple[ndarray, ndarray, ndarray, ndarray],
+]:
+    K = len(grad_fs)
+    grad_f = grad_fs[0]
+
+    def implement(
+        coeff: ndarray,
+        input: ndarray,
+        lag: ndarray,
+        output: ndarray,
+        dL_do: ndarray,
+        dL_dpre: ndarray,
+    ) -> Tuple[ndarray, ndarray, ndarray, ndarray]:
+        (nCoeff,) = coeff.shape
+        nC = nCoeff // K
+        assert nC * K == nCoeff
+        nI = (input.shape[0] - K * K) // K
+        assert K * K + nI * K == input.shape[0]
+        nL = (lag.shape[0] - 3 - K) // K
+        assert 3 + K + nL * K == lag.shape[0]
+        nP = dL_dpre.shape[0] // K
+        assert nP * K == dL_dpre.shape[0]
+
+        # 重算前向的中间量
+        path = numpy.empty((K, K))
+        归一化stage1 = 0.0
+        for j in range(K):
+            for i in range(K):
+                path[i, j] = input[i * K + j] * lag[3 + i]
+                归一化stage1 += path[i, j]
+        stage1_patched = 归一化stage1 == 0
+        if stage1_patched:
+            归一化stage1 = 1
+        path /= 归一化stage1
+        prior = numpy.zeros((K,))
+        for j in range(K):
+            for i in range(K):
+                prior[j] += path[i, j]
+
+        contrib = numpy.empty((K, K))
+        lags = numpy.zeros((K, nL))
+        for j in range(K):
+            for i in range(K):
+                contrib[i, j] = path[i, j] / prior[j] if prior[j] > _eps else 1.0 / K
+                for k in range(nL):
+                    lags[j, k] += contrib[i, j] * lag[3 + K + i * nL + k]
+
+        outs = output[3 + K :].reshape((K, nL))
+        likeli = numpy.empty((K,))
+        for j in range(K):
+            likeli[j] = likeli_provider(outs[j, :])
+        m = likeli.argmax()
+        loglikeli_offset = -likeli[m]
+        归一化stage2 = 0.0
+        for j in range(K):
+            likeli[j] = math.exp(likeli[j] + loglikeli_offset)
+            归一化stage2 += prior[j] * likeli[j]
+        post_shortpath = 归一化stage2 == 0
+
+        EX = 0.0
+        for j in range(K):
+            EX += prior[j] * outs[j, 1]
+
+        # 反向
+        dL_dlike, dL_dEX, dL_dvar = dL_do[0], dL_do[1], dL_do[2]
+        dL_dEX += -dL_dvar * (2 * EX)
+
+        dL_dstage2 = 0.0
+        if not post_shortpath:
+            dL_dstage2 = dL_dlike / 归一化stage2
+            for j in range(K):
+                post_j = prior[j] * likeli[j] / 归一化stage2
+                dL_dstage2 -= dL_do[3 + j] * (post_j / 归一化stage2)
+
+        dL_dprior = numpy.empty((K,))
+        dL_dloglikeli = numpy.empty((K,))
+        dL_dlikeoffset = -dL_dlike
+        for j in range(K):
+            mu, EX2 = outs[j, 1], outs[j, 2] + outs[j, 1] * outs[j, 1]
+            if post_shortpath:
+                # 此时likelihood为-inf，只保留后验对先验的导数
+                dL_dprior[j] = dL_do[3 + j]
+                dL_drawpost = 0.0
+            else:
+                dL_dprior[j] = 0.0
+                dL_drawpost = dL_do[3 + j] / 归一化stage2 + dL_dstage2
+            dL_dprior[j] += dL_drawpost * likeli[j] + dL_dvar * EX2 + dL_dEX * mu
+            dL_dloglikeli[j] = dL_drawpost * prior[j] * likeli[j]
+            dL_dlikeoffset += dL_dloglikeli[j]
+        dL_dloglikeli[m] -= dL_dlikeoffset
+
+        dL_dcoeff = numpy.empty((nCoeff,))
+        dL_dinput = numpy.empty((input.shape[0],))
+        dL_dlag = numpy.zeros((lag.shape[0],))
+        dL_dpre_lag = numpy.empty((dL_dpre.shape[0],))
+        dL_douts = dL_do[3 + K :].reshape((K, nL)).copy()
+        # dL_dpath先存放dL_dcontrib
+        dL_dpath = numpy.empty((K, K))
+        for j in range(K):
+            out_j = outs[j, :]
+            dL_dout_j = dL_douts[j, :]
+            dL_dout_j += likeli_gradient(out_j, likeli[j], dL_dloglikeli[j])
+            dL_dEX2 = dL_dvar * prior[j]
+            dL_dout_j[1] += dL_dEX * prior[j] + dL_dEX2 * (2 * out_j[1])
+            dL_dout_j[2] += dL_dEX2
+
+            (
+                dL_dcoeff[j * nC : (j + 1) * nC],
+                dL_dinput[K * K + j * nI : K * K + (j + 1) * nI],
+                dL_dlag_j,
+                dL_dpre_lag[j * nP : (j + 1) * nP],
+            ) = grad_f(
+                coeff[j * nC : (j + 1) * nC],
+                input[K * K + j * nI : K * K + (j + 1) * nI],
+                lags[j, :],
+                out_j,
+                dL_dout_j,
+                dL_dpre[j * nP : (j + 1) * nP],
+            )
+            for i in range(K):
+                dL_dcontrib = 0.0
+                for k in range(nL):
+                    dL_dlag[3 + K + i * nL + k] += contrib[i, j] * dL_dlag_j[k]
+                    dL_dcontrib += dL_dlag_j[k] * lag[3 + K + i * nL + k]
+                dL_dpath[i, j] = dL_dcontrib
+
+        # contrib[i, j] = path[i, j] / prior[j]，prior[j] = sum(path[:, j])
+        dL_dstage1 = 0.0
+        for j in range(K):
+            if prior[j] > _eps:
+                for i in range(K):
+                    dL_dprior[j] -= dL_dpath[i, j] * contrib[i, j] / prior[j]
+                for i in range(K):
+                    dL_dpath[i, j] = dL_dpath[i, j] / prior[j] + dL_dprior[j]
+            else:
+                for i in range(K):
+                    dL_dpath[i, j] = dL_dprior[j]
+            for i in range(K):
+                dL_dstage1 -= dL_dpath[i, j] * path[i, j]
+        dL_dstage1 /= 归一化stage1
+
+        for i in range(K):
+            for j in range(K):
+                if stage1_patched:
+                    dL_drawpath = 0.0
+                else:
+                    dL_drawpath = dL_dpath[i, j] / 归一化stage1 + dL_dstage1
+                dL_dlag[3 + i] += dL_drawpath * input[i * K + j]
+                dL_dinput[i * K + j] = dL_drawpath * lag[3 + i]
+
+        return (dL_dcoeff, dL_dinput, dL_dlag, dL_dpre_lag)
+
+    return implement
+
+
+class MS_TVTP_K(Iterative.Iterative, Logpdf.Logpdf[Any]):
+    K: int
+
+    def __init__(
+        self,
+        submodels: Tuple[Iterative.Iterative, ...],
+        provider: Tuple[
+            JittedFunction[Callable[[ndarray], float]],
+            JittedFunction[Callable[[ndarray, float, float], ndarray]],
+        ],
+        data_in_names: Tuple[str, ...],
+        data_out_names: Tuple[str, ...],
+    ) -> None:
+        K = len(submodels)
+        assert K >= 2
+        assert len(data_in_names) == K * K, "须按行给出K*K个转移概率"
+        assert len(data_out_names) == 3 + K
+        for s in submodels:
+            assert type(s) is type(submodels[0])
+            assert len(s.coeff_names) == len(submodels[0].coeff_names)
+            assert len(s.data_in_names) == len(submodels[0].data_in_names)
+            assert len(s.data_out_names) == len(submodels[0].data_out_names)
+            # 核函数只调用第一个子模型的标量函数，要求各子模型的标量函数相同
+            for name in ("_output0_scalar", "_eval_scalar", "_grad_scalar"):
+                assert (
+                    getattr(s, name).pickled_bytecode
+                    == getattr(submodels[0], name).pickled_bytecode
+                )
+        self.K = K
+
+        super().__init__(
+            (),
+            data_in_names,
+            data_out_names,
+            submodels,
+            JittedFunction(
+                Iterative._Numba.Output0,
+                tuple(x._output0_scalar for x in submodels),
+                _tvtp_k_output0_generate,
+            ),
+            JittedFunction(
+                Iterative._Numba.Eval,
+                provider[:1] + tuple(x._eval_scalar for x in submodels),
+                _tvtp_k_eval_generate,
+            ),
+            JittedFunction(
+                Iterative._Numba.Grad,
+                provider + tuple(x._grad_scalar for x in submodels),
+                _tvtp_k_grad_generate,
+            ),
+        )
+
+    def get_constraints(self) -> Constraints:
+        return Constraints(
+            numpy.empty((0, len(self.coeff_names))),
+            numpy.empty((0,)),
+            numpy.full((len(self.coeff_names),), -numpy.inf),
+            numpy.full((len(self.coeff_names),), numpy.inf),
+        )
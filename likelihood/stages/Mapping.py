@@ -1,6 +1,6 @@
 from __future__ import annotations
 
-from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
 
 import numpy
 from likelihood.stages.abc.Stage import Constraints, Stage
@@ -63,6 +63,24 @@ class Mapping(Stage[T]):
             dL_dc[i] += v
         return dL_di, dL_dc
 
+    def _eval_batch(
+        self, coeffs: ndarray, inputs: List[ndarray], *, grad: bool, debug: bool
+    ) -> Tuple[List[ndarray], Optional[Any]]:
+        return self.submodel._eval_batch(
+            coeffs[:, self.expand_index], inputs, grad=grad, debug=debug
+        )
+
+    def _grad_batch(
+        self, coeffs: ndarray, gradinfo: Any, dL_do: List[ndarray], *, debug: bool
+    ) -> Tuple[List[ndarray], ndarray]:
+        dL_di, _dL_dc = self.submodel._grad_batch(
+            coeffs[:, self.expand_index], gradinfo, dL_do, debug=debug
+        )
+        dL_dc = numpy.zeros((coeffs.shape[0], len(self.coeff_names)))
+        for i, v in zip(self.expand_index, _dL_dc.T):
+            dL_dc[:, i] += v
+        return dL_di, dL_dc
+
     def get_constraints(self) -> Constraints:
         assert False
 
@@ -1,15 +1,17 @@
-from typing import Tuple
+from typing import Hashable, Tuple
 
 import numpy
 
 from likelihood.KnownIssue import KnownIssue
-from likelihood.stages.abc.Convolution import Convolution
+from likelihood.stages.abc.Convolution import Convolution, _kernel_t
 from likelihood.stages.abc.Stage import Constraints
 from overloads.typedefs import ndarray
 
 
 class Midas_beta(Convolution):
     K: int
+    _ratio: Tuple[ndarray, ndarray]
+    _log_ratio: Tuple[ndarray, ndarray]
 
     def __init__(
         self,
@@ -22,8 +24,16 @@ class Midas_beta(Convolution):
         assert len(data_in_names) == len(data_out_names)
         super().__init__(names, data_in_names, data_out_names, ())
         self.K = k
+        # 只与K有关的常量在构造时算好：k/K、(K-k)/K及其对数（在0处取0，见PATCHED[1]）
+        _k = numpy.arange(1.0, k + 1.0).reshape((k, 1))
+        self._ratio = (_k / k, (k - _k) / k)
+        left, right = (numpy.log(numpy.where(r == 0, 1.0, r)) for r in self._ratio)
+        self._log_ratio = (left, right)
 
-    def kernel(self, omega: ndarray) -> Tuple[ndarray, ndarray]:
+    def _kernel_id(self) -> Hashable:
+        return (type(self), self.K)
+
+    def kernel(self, omega: ndarray, *, grad: bool = True) -> _kernel_t:
         """
         rphi(1 <= k <= K) = (k/K) ** (omega1-1) * (1-k/K) ** (omega2-1)
 
@@ -41,19 +51,16 @@ class Midas_beta(Convolution):
 
         phi = rphi/sum(rphi)
         """
-        k = numpy.arange(1.0, self.K + 1.0)
-        k.shape = (k.shape[0], 1)
         _omega1, _omega2 = omega
 
         if _omega1 <= _omega2:
-            kLeft, kRight = k, self.K - k
+            (rLeft, rRight), (logLeft, _) = self._ratio, self._log_ratio
             oLeft, oRight = _omega1 - 1.0, _omega2 - 1.0
         else:
-            kLeft, kRight = self.K - k, k
+            (rRight, rLeft), (_, logLeft) = self._ratio, self._log_ratio
             oLeft, oRight = _omega2 - 1.0, _omega1 - 1.0
 
         alpha = oLeft / oRight
-        da_do = numpy.array([[1.0, -alpha]]) / oRight
         """
         求rphi = stage1 ** oRight = {(kLeft/K) ** alpha * (kRight/K)} ** oRight
         对alpha的导数(在kLeft为0)的取值
@@ -70,9 +77,16 @@ class Midas_beta(Convolution):
             stage1 = 0 ** alpha * (kRight/K)
             dstage1_da = 0
         """
-        stage1 = (kLeft / self.K) ** alpha * (kRight / self.K)
-        dstage1_da = numpy.log(kLeft / self.K)  # PATCHED[1]: remove {*stage1}
-        dstage1_da[kLeft == 0] = 0.0
+        stage1 = rLeft ** alpha * rRight
+        if not grad:
+            rphi = stage1 ** oRight
+            sum = numpy.sum(rphi)
+            if sum == 0:
+                raise KnownIssue("Midas_beta: 权重全为0")
+            return (rphi / sum).reshape((self.K,)), None
+
+        da_do = numpy.array([[1.0, -alpha]]) / oRight
+        dstage1_da = logLeft  # PATCHED[1]: remove {*stage1}
         dstage1_do = dstage1_da * da_do  # PATCHED[1]: missing {*stage1}
         """
         rphi = stage1 ** oRight
@@ -1,5 +1,6 @@
 from typing import Callable, Optional, Tuple
 
+from likelihood.stages.abc.Convolution import _kernel_t
 from likelihood.stages.abc.Stage import Constraints, Eval_t, Grad_t, Stage
 from likelihood.stages.Linear import Linear, _Linear_gradinfo_t
 from likelihood.stages.Midas_beta import Midas_beta
@@ -11,7 +12,7 @@ _Midas_beta_group_gradinfo_t = Tuple[ndarray, ndarray, ndarray]
 class Midas_beta_group(Stage[_Midas_beta_group_gradinfo_t]):
     _linear_eval: Eval_t[_Linear_gradinfo_t]
     _linear_grad: Grad_t[_Linear_gradinfo_t]
-    _kernel: Optional[Callable[[ndarray], Tuple[ndarray, ndarray]]]
+    _kernel: Optional[Callable[..., _kernel_t]]
     _constraints: Optional[Callable[[], Constraints]]
 
     def __init__(
@@ -27,7 +28,8 @@ class Midas_beta_group(Stage[_Midas_beta_group_gradinfo_t]):
         midas_obj = Midas_beta(
             coeff_name, data_in_names, data_in_names, k=len(data_in_names)
         )
-        self._kernel = midas_obj.kernel
+        # 经由Convolution._kernel取得卷积核，与同K的Midas stage共用缓存
+        self._kernel = midas_obj._kernel
         self._constraints = midas_obj.get_constraints
 
     def _eval(
@@ -35,11 +37,11 @@ class Midas_beta_group(Stage[_Midas_beta_group_gradinfo_t]):
     ) -> Tuple[ndarray, Optional[_Midas_beta_group_gradinfo_t]]:
         assert self._kernel is not None
         assert self._linear_eval is not None
-        kernel, dk_dc = self._kernel(coeff)
+        kernel, dk_dc = self._kernel(coeff, grad=grad)
         output, _gradinfo = self._linear_eval(kernel, input, grad=grad, debug=debug)
         if not grad:
             return output, None
-        assert _gradinfo is not None
+        assert _gradinfo is not None and dk_dc is not None
         return output, (_gradinfo, kernel, dk_dc)
 
     def _grad(
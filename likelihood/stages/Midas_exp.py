@@ -1,15 +1,17 @@
-from typing import Tuple
+from typing import Hashable, Tuple
 
 import numpy
 
 from likelihood.KnownIssue import KnownIssue
-from likelihood.stages.abc.Convolution import Convolution
+from likelihood.stages.abc.Convolution import Convolution, _kernel_t
 from likelihood.stages.abc.Stage import Constraints
 from overloads.typedefs import ndarray
 
 
 class Midas_exp(Convolution):
     K: int
+    _k: ndarray
+    _k_1: ndarray
 
     def __init__(
         self,
@@ -22,14 +24,19 @@ class Midas_exp(Convolution):
         assert len(data_in_names) == len(data_out_names)
         super().__init__((coeff_name,), data_in_names, data_out_names, ())
         self.K = k
+        # 只与K有关的常量在构造时算好
+        self._k = numpy.arange(1.0, k + 1.0).reshape((k, 1))
+        self._k_1 = self._k - 1.0
 
-    def kernel(self, _omega: ndarray) -> Tuple[ndarray, ndarray]:
+    def _kernel_id(self) -> Hashable:
+        return (type(self), self.K)
+
+    def kernel(self, _omega: ndarray, *, grad: bool = True) -> _kernel_t:
         """
         rphi(1 <= k <= K) = omega ** k
         phi = rphi/sum(rphi)
         """
-        k = numpy.arange(1.0, self.K + 1.0)
-        k.shape = (k.shape[0], 1)
+        k = self._k
         omega = float(_omega)
 
         """
@@ -37,12 +44,15 @@ class Midas_exp(Convolution):
         drphi_do = k * omega ** (k-1)
         """
         rphi = omega ** k
-        drphi_do = k * omega ** (k - 1.0)
 
         sum = numpy.sum(rphi)
-        dsum_do = numpy.sum(drphi_do, axis=0, keepdims=True)
         if sum == 0:
             raise KnownIssue("Midas_exp: 权重全为0")
+        if not grad:
+            return (rphi / sum).reshape((self.K,)), None
+
+        drphi_do = k * omega ** self._k_1
+        dsum_do = numpy.sum(drphi_do, axis=0, keepdims=True)
 
         """
         phi = rphi/sum
@@ -1,20 +1,161 @@
 from __future__ import annotations
 
+import threading
 from abc import ABCMeta, abstractmethod
-from typing import Optional, Tuple
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional, Tuple
 
 import numpy
+from likelihood.jit import JittedFunction, _signature_t
 from likelihood.stages.abc.Stage import Stage
+from numba import float64, types  # type: ignore
 from overloads.typedefs import ndarray
+from scipy.signal import fftconvolve  # type: ignore
 
 _Convolution_gradinfo_t = Tuple[ndarray, ndarray, ndarray]
+_kernel_t = Tuple[ndarray, Optional[ndarray]]
+
+# 最近用过的若干个(kernel, dk_dc)，以(_kernel_id(), coeff)为键，_kernel_id()相同的stage共用
+# 信赖域的试探步被拒绝后会在同一点上重新求值，Midas的分组stage也常与其他stage共用系数
+_Kernel_Memo: OrderedDict[Tuple[Hashable, bytes], _kernel_t] = OrderedDict()
+_Kernel_Memo_Lock = threading.Lock()
+_Kernel_Memo_Size = 16
+
+
+def _read_only(result: _kernel_t) -> _kernel_t:
+    # 缓存的数组会交给之后的每个调用者，只给出只读视图
+    kernel, dk_dc = result
+    kernel = kernel.view()
+    kernel.flags.writeable = False
+    if dk_dc is not None:
+        dk_dc = dk_dc.view()
+        dk_dc.flags.writeable = False
+    return kernel, dk_dc
+
+
+class _Signature:
+    Eval = Callable[[ndarray, ndarray], ndarray]
+    Grad = Callable[[ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]]
+
+
+class _Numba:
+    # 卷积核来自缓存，是只读的数组
+    Kernel = types.Array(float64, 1, "C", readonly=True)
+    Eval = _signature_t(float64[:, ::1](float64[:, ::1], Kernel))
+    Grad = _signature_t(
+        types.Tuple((float64[:, ::1], float64[::1]))(
+            float64[:, ::1], Kernel, float64[:, ::1]
+        )
+    )
+
+
+def _eval_generator() -> _Signature.Eval:
+    def implement(input: ndarray, kernel: ndarray) -> ndarray:
+        """
+        按行存放时，out[i, :] += in[i+k-j, :]*ker[j]对所有i与所有列是同一段连续内存
+        按block个元素分块，块内对每个j做一次整段的乘加，各列一并完成且块留在缓存中
+        """
+        block = 2048
+        k = kernel.shape[0] - 1
+        size = (input.shape[0] - k) * input.shape[1]
+        output = numpy.zeros((input.shape[0] - k, input.shape[1]))
+        out, x = output.reshape(size), input.reshape(input.size)
+        for lo in range(0, size, block):
+            hi = min(lo + block, size)
+            o = out[lo:hi]
+            for j in range(k + 1):
+                w = kernel[j]
+                start = lo + (k - j) * input.shape[1]
+                xs = x[start:][: hi - lo]
+                for i in range(hi - lo):
+                    o[i] += xs[i] * w
+        return output
+
+    return implement
+
+
+def _grad_generator() -> _Signature.Grad:
+    def implement(
+        input: ndarray, kernel: ndarray, dL_do: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        """
+        与前向相同的分块，块内对每个j同时累加dL_di的一段与dL_dk[j]
+        """
+        block = 2048
+        k = kernel.shape[0] - 1
+        size = dL_do.size
+        dL_di = numpy.zeros((dL_do.shape[0] + k, dL_do.shape[1]))
+        dL_dk = numpy.zeros((k + 1,))
+        g, x, di = dL_do.reshape(size), input.reshape(input.size), dL_di.reshape(-1)
+        for lo in range(0, size, block):
+            hi = min(lo + block, size)
+            gs = g[lo:hi]
+            for j in range(k + 1):
+                w = kernel[j]
+                start = lo + (k - j) * dL_do.shape[1]
+                ds = di[start:][: hi - lo]
+                for i in range(hi - lo):
+                    ds[i] += gs[i] * w
+                dL_dk[j] += numpy.dot(x[start:][: hi - lo], gs)
+        return dL_di, dL_dk
+
+    return implement
 
 
 class Convolution(Stage[_Convolution_gradinfo_t], metaclass=ABCMeta):
+    # 核的长度不小于fft_threshold时改用FFT卷积，各列一次完成
+    # 实测与numpy.convolve的交叉点：前向与dL_di约在128~256，dL_dk约在256~512
+    fft_threshold: int = 256
+    jit: bool = False
+    _kernel_memo: Optional[Tuple[bytes, _kernel_t]] = None
+    _eval_impl = JittedFunction(_Numba.Eval, (), _eval_generator)
+    _grad_impl = JittedFunction(_Numba.Grad, (), _grad_generator)
+
     @abstractmethod
-    def kernel(self, coeff: ndarray) -> Tuple[ndarray, ndarray]:
+    def kernel(self, coeff: ndarray, *, grad: bool = True) -> _kernel_t:
+        """
+        返回卷积核及其对coeff的Jacobian，grad=False时不计算Jacobian（返回None）
+        """
         pass  # pragma: no cover
 
+    def _kernel_id(self) -> Optional[Hashable]:
+        """
+        卷积核只依赖于coeff与此返回值，返回值相同的stage共用模块级的缓存
+        返回None时只在此stage上记住最近一次的结果，模块级的缓存不持有stage
+        """
+        return None
+
+    def _kernel(self, coeff: ndarray, *, grad: bool) -> _kernel_t:
+        kernel_id = self._kernel_id()
+        if kernel_id is None:
+            memo = self._kernel_memo
+            if memo is not None and memo[0] == coeff.tobytes():
+                if memo[1][1] is not None or not grad:
+                    return memo[1]
+            result = _read_only(self.kernel(coeff, grad=grad))
+            self._kernel_memo = (coeff.tobytes(), result)
+            return result
+        key = (kernel_id, coeff.tobytes())
+        with _Kernel_Memo_Lock:
+            cached = _Kernel_Memo.get(key)
+            if cached is not None and (cached[1] is not None or not grad):
+                _Kernel_Memo.move_to_end(key)
+                return cached
+        result = _read_only(self.kernel(coeff, grad=grad))
+        with _Kernel_Memo_Lock:
+            _Kernel_Memo[key] = result
+            _Kernel_Memo.move_to_end(key)
+            while len(_Kernel_Memo) > _Kernel_Memo_Size:
+                _Kernel_Memo.popitem(last=False)
+        return result
+
+    def enable_jit(self, enabled: bool = True) -> None:
+        """
+        核的长度小于fft_threshold时，以numba编译的核函数代替逐列的numpy.convolve，
+        前向一次完成所有列，反向在同一次扫描中得到dL_di与dL_dk
+        """
+        self.jit = enabled
+
     def _eval(
         self, coeff: ndarray, input: ndarray, *, grad: bool, debug: bool
     ) -> Tuple[ndarray, Optional[_Convolution_gradinfo_t]]:
@@ -24,14 +165,25 @@ class Convolution(Stage[_Convolution_gradinfo_t], metaclass=ABCMeta):
         numpy.convolve:
             conv(in,k)[i] = sum(in[i-j]*ker[j])
         """
-        kernel, dk_dc = self.kernel(coeff)
+        kernel, dk_dc = self._kernel(coeff, grad=grad)
         k = kernel.shape[0] - 1
         assert input.shape[0] > k
-        output = numpy.empty((input.shape[0] - k, input.shape[1]))
-        for i in range(input.shape[1]):
-            output[:, i] = numpy.convolve(input[:, i], kernel, "valid")
+        if kernel.shape[0] >= self.fft_threshold:
+            output = fftconvolve(input, kernel[:, numpy.newaxis], "valid", axes=0)
+        elif self.jit:
+            input = numpy.ascontiguousarray(input)
+            kernel = numpy.ascontiguousarray(kernel)
+            if debug:
+                output = self._eval_impl.py_func()(input, kernel)
+            else:
+                output = self._eval_impl.func()(input, kernel)
+        else:
+            output = numpy.empty((input.shape[0] - k, input.shape[1]))
+            for i in range(input.shape[1]):
+                output[:, i] = numpy.convolve(input[:, i], kernel, "valid")
         if not grad:
             return output, None
+        assert dk_dc is not None
         return output, (input, kernel, dk_dc)
 
     def _grad(
@@ -40,7 +192,7 @@ class Convolution(Stage[_Convolution_gradinfo_t], metaclass=ABCMeta):
         gradinfo: _Convolution_gradinfo_t,
         dL_do: ndarray,
         *,
-        debug: bool
+        debug: bool,
     ) -> Tuple[ndarray, ndarray]:
         """
         dL_di[i] = dL_do[i]*ker[0] + dL_do[i+1]*ker[1] + ... + dL_do[i+k]*ker[k]
@@ -48,8 +200,20 @@ class Convolution(Stage[_Convolution_gradinfo_t], metaclass=ABCMeta):
         dL_dk[j] = in[k-j]*dL_do[0] + in[k-j+1]*dL_do[1] + ... + in[n-j]*dL_do[n-k]
         """
         input, kernel, dk_dc = gradinfo
+        if kernel.shape[0] < self.fft_threshold and self.jit:
+            input = numpy.ascontiguousarray(input)
+            dL_do = numpy.ascontiguousarray(dL_do)
+            if debug:
+                dL_di, dL_dk = self._grad_impl.py_func()(input, kernel, dL_do)
+            else:
+                dL_di, dL_dk = self._grad_impl.func()(input, kernel, dL_do)
+            return dL_di, dL_dk @ dk_dc
         input, kernel = input[::-1, :], kernel[::-1]
         k = kernel.shape[0] - 1
+        if kernel.shape[0] >= self.fft_threshold:
+            dL_di = fftconvolve(dL_do, kernel[:, numpy.newaxis], "full", axes=0)
+            dL_dk = numpy.sum(fftconvolve(input, dL_do, "valid", axes=0), axis=1)
+            return dL_di, dL_dk @ dk_dc
         dL_di = numpy.empty((dL_do.shape[0] + k, dL_do.shape[1]))
         dL_dk = numpy.zeros(kernel.shape)
         for i in range(dL_di.shape[1]):
@@ -1,13 +1,14 @@
 from __future__ import annotations
 
+import math
 from abc import ABCMeta
-from typing import Callable, Optional, Tuple
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
 
 import numba  # type: ignore
 import numpy
 from likelihood.jit import JittedFunction, _signature_t
 from likelihood.stages.abc.Stage import Stage
-from numba import float64, optional, types
+from numba import float64, int64, optional, types
 from overloads.typedefs import ndarray
 
 
@@ -22,6 +23,19 @@ class _Signature:
         Tuple[ndarray, ndarray, ndarray, ndarray],
     ]
     LoopGrad = Callable[[ndarray, GradInfo, ndarray], Tuple[ndarray, ndarray]]
+    BatchGradInfo = Tuple[ndarray, ndarray, ndarray, ndarray, ndarray, ndarray]
+    LoopEvalBatchRet = Tuple[ndarray, Optional[BatchGradInfo]]
+    LoopEvalBatch = Callable[[ndarray, ndarray, ndarray, bool], LoopEvalBatchRet]
+    LoopGradBatch = Callable[[ndarray, BatchGradInfo, ndarray], Tuple[ndarray, ndarray]]
+    CheckpointGradInfo = Tuple[ndarray, ndarray, ndarray, ndarray, ndarray, int]
+    LoopEvalCheckpointRet = Tuple[ndarray, Optional[CheckpointGradInfo]]
+    LoopEvalCheckpoint = Callable[[ndarray, ndarray, bool, int], LoopEvalCheckpointRet]
+    LoopGradCheckpoint = Callable[
+        [ndarray, CheckpointGradInfo, ndarray], Tuple[ndarray, ndarray]
+    ]
+    LoopEvalResume = Callable[
+        [ndarray, ndarray, ndarray, ndarray], Tuple[ndarray, ndarray]
+    ]
 
 
 class _Numba:
@@ -66,6 +80,55 @@ class _Numba:
             float64[::1], GradInfo, float64[:, ::1]
         )
     )
+    BatchGradInfo = _signature_t(
+        types.Tuple(
+            (
+                float64[:, ::1],
+                float64[:, ::1],
+                float64[:, ::1],
+                float64[:, :, ::1],
+                float64[:, :, ::1],
+                int64[::1],
+            )
+        )
+    )
+    LoopEvalBatch = _signature_t(
+        types.Tuple((float64[:, ::1], optional(BatchGradInfo)))(
+            float64[:, ::1], float64[:, ::1], int64[::1], numba.boolean
+        )
+    )
+    LoopGradBatch = _signature_t(
+        types.Tuple((float64[:, ::1], float64[:, ::1]))(
+            float64[:, ::1], BatchGradInfo, float64[:, ::1]
+        )
+    )
+    CheckpointGradInfo = _signature_t(
+        types.Tuple(
+            (
+                float64[:, ::1],
+                float64[:, ::1],
+                float64[:, ::1],
+                float64[:, ::1],
+                float64[:, ::1],
+                int64,
+            )
+        )
+    )
+    LoopEvalCheckpoint = _signature_t(
+        types.Tuple((float64[:, ::1], optional(CheckpointGradInfo)))(
+            float64[::1], float64[:, ::1], numba.boolean, int64
+        )
+    )
+    LoopGradCheckpoint = _signature_t(
+        types.Tuple((float64[:, ::1], float64[::1]))(
+            float64[::1], CheckpointGradInfo, float64[:, ::1]
+        )
+    )
+    LoopEvalResume = _signature_t(
+        types.Tuple((float64[:, ::1], float64[::1]))(
+            float64[::1], float64[:, ::1], float64[::1], float64[::1]
+        )
+    )
 
 
 def _eval_generator(
@@ -119,9 +182,177 @@ def _grad_generator(grad_func: _Signature.Grad) -> _Signature.LoopGrad:
     return implement
 
 
-class Iterative(Stage[_Signature.GradInfo], metaclass=ABCMeta):
+def _eval_batch_generator(loop_eval: _Signature.LoopEval) -> _Signature.LoopEvalBatch:
+    def implement(
+        coeffs: ndarray, inputs: ndarray, offsets: ndarray, grad: bool
+    ) -> _Signature.LoopEvalBatchRet:
+        """
+        第s条序列占据inputs[offsets[s]:offsets[s+1], :]，逐条序列调用单序列循环
+        """
+        nSeries = coeffs.shape[0]
+        assert offsets.shape[0] == nSeries + 1
+        outputs = numpy.empty((0, 0))
+        output0s = numpy.empty((0, 0))
+        d0_dcs = numpy.empty((0, 0, 0))
+        dpre_dcs = numpy.empty((0, 0, 0))
+        for s in range(nSeries):
+            lo, hi = offsets[s], offsets[s + 1]
+            _outputs, g = loop_eval(coeffs[s], inputs[lo:hi], grad)
+            if s == 0:
+                outputs = numpy.empty((inputs.shape[0], _outputs.shape[1]))
+            outputs[lo:hi, :] = _outputs
+            if g is not None:
+                output0, _, _, d0_dc, dpre_dc = g
+                if s == 0:
+                    output0s = numpy.empty((nSeries, output0.shape[0]))
+                    d0_dcs = numpy.empty((nSeries, d0_dc.shape[0], d0_dc.shape[1]))
+                    dpre_dcs = numpy.empty(
+                        (nSeries, dpre_dc.shape[0], dpre_dc.shape[1])
+                    )
+                output0s[s, :] = output0
+                d0_dcs[s, :, :] = d0_dc
+                dpre_dcs[s, :, :] = dpre_dc
+        if not grad:
+            return outputs, None
+        return outputs, (output0s, inputs, outputs, d0_dcs, dpre_dcs, offsets)
+
+    return implement
+
+
+def _grad_batch_generator(loop_grad: _Signature.LoopGrad) -> _Signature.LoopGradBatch:
+    def implement(
+        coeffs: ndarray, gradinfo: _Signature.BatchGradInfo, dL_do: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        output0s, inputs, outputs, d0_dcs, dpre_dcs, offsets = gradinfo
+        nSeries = coeffs.shape[0]
+        dL_di = numpy.empty(inputs.shape)
+        dL_dc = numpy.empty(coeffs.shape)
+        for s in range(nSeries):
+            lo, hi = offsets[s], offsets[s + 1]
+            dL_di[lo:hi, :], dL_dc[s, :] = loop_grad(
+                coeffs[s],
+                (output0s[s], inputs[lo:hi], outputs[lo:hi], d0_dcs[s], dpre_dcs[s]),
+                dL_do[lo:hi],
+            )
+        return dL_di, dL_dc
+
+    return implement
+
+
+def _eval_checkpoint_generator(
+    output0_func: _Signature.Output0, eval_func: _Signature.Eval
+) -> _Signature.LoopEvalCheckpoint:
+    def implement(
+        coeff: ndarray, inputs: ndarray, grad: bool, stride: int
+    ) -> _Signature.LoopEvalCheckpointRet:
+        """
+        与_eval_generator相同，但gradinfo中不保留完整的outputs，
+        只保留每stride步的检查点：进入该步之前的上一行输出与preserve
+        """
+        output0, d0_dc, preserve, dpre_dc = output0_func(coeff)
+        nSample, nOutput = inputs.shape[0], output0.shape[0]
+        nCheckpoint = (nSample + stride - 1) // stride
+        outputs = numpy.empty((nSample, nOutput))
+        ck_outputs = numpy.empty((nCheckpoint, nOutput))
+        ck_preserve = numpy.empty((nCheckpoint, preserve.shape[0]))
+        ck_outputs[0, :] = output0
+        ck_preserve[0, :] = preserve
+        outputs[0, :], preserve = eval_func(coeff, inputs[0, :], output0, preserve)
+        for i in range(1, nSample):
+            if i % stride == 0:
+                ck_outputs[i // stride, :] = outputs[i - 1, :]
+                ck_preserve[i // stride, :] = preserve
+            outputs[i, :], preserve = eval_func(
+                coeff, inputs[i, :], outputs[i - 1, :], preserve
+            )
+        if not grad:
+            return outputs, None
+        return outputs, (inputs, ck_outputs, ck_preserve, d0_dc, dpre_dc, stride)
+
+    return implement
+
+
+def _grad_checkpoint_generator(
+    eval_func: _Signature.Eval, grad_func: _Signature.Grad
+) -> _Signature.LoopGradCheckpoint:
+    def implement(
+        coeff: ndarray, gradinfo: _Signature.CheckpointGradInfo, dL_do: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        """
+        从后往前逐段处理：自检查点重新前向计算该段的outputs，再对该段反向扫描
+        重算的结果与前向扫描逐位相同，额外的计算量约为一次前向扫描
+        """
+        inputs, ck_outputs, ck_preserve, d0_dc, dpre_dc, stride = gradinfo
+        nSample, nInput = inputs.shape
+        nOutput = ck_outputs.shape[1]
+        dL_di = numpy.empty((nSample, nInput))
+        dL_dc = numpy.zeros(coeff.shape)
+        dL_dpre = numpy.zeros((dpre_dc.shape[0],))
+        dL_dc0 = numpy.zeros(coeff.shape)
+        dL_d0 = numpy.zeros((nOutput,))
+        segment = numpy.empty((stride, nOutput))
+        for j in range(ck_outputs.shape[0] - 1, -1, -1):
+            start = j * stride
+            stop = min(start + stride, nSample)
+            output, preserve = ck_outputs[j, :], ck_preserve[j, :].copy()
+            for i in range(start, stop):
+                output, preserve = eval_func(coeff, inputs[i, :], output, preserve)
+                segment[i - start, :] = output
+            for i in range(stop - 1, start - 1, -1):
+                if i > start:
+                    previous = segment[i - start - 1, :]
+                else:
+                    previous = ck_outputs[j, :]
+                _dL_dc, dL_di[i, :], _dL_do, dL_dpre = grad_func(
+                    coeff,
+                    inputs[i, :],
+                    previous,
+                    segment[i - start, :],
+                    dL_do[i, :],
+                    dL_dpre,
+                )
+                if i > 0:
+                    dL_dc += _dL_dc
+                    dL_do[i - 1, :] += _dL_do
+                else:
+                    dL_dc0, dL_d0 = _dL_dc, _dL_do
+
+        dL_dc += dL_dc0 + dL_d0 @ d0_dc + dL_dpre @ dpre_dc  # type: ignore
+        return dL_di, dL_dc
+
+    return implement
+
+
+def _eval_resume_generator(eval_func: _Signature.Eval) -> _Signature.LoopEvalResume:
+    def implement(
+        coeff: ndarray, inputs: ndarray, output: ndarray, preserve: ndarray
+    ) -> Tuple[ndarray, ndarray]:
+        """
+        从上一行输出与preserve接着前向扫描，返回新增的outputs与最新的preserve
+        """
+        nSample, nOutput = inputs.shape[0], output.shape[0]
+        outputs = numpy.empty((nSample, nOutput))
+        for i in range(nSample):
+            output, preserve = eval_func(coeff, inputs[i, :], output, preserve)
+            outputs[i, :] = output
+        return outputs, preserve
+
+    return implement
+
+
+class _Checkpointed(NamedTuple):
+    gradinfo: _Signature.CheckpointGradInfo
+
+
+class Iterative(Stage[Any], metaclass=ABCMeta):
     _eval_impl: JittedFunction[_Signature.LoopEval]
     _grad_impl: JittedFunction[_Signature.LoopGrad]
+    _eval_batch_impl: JittedFunction[_Signature.LoopEvalBatch]
+    _grad_batch_impl: JittedFunction[_Signature.LoopGradBatch]
+    _eval_checkpoint_impl: JittedFunction[_Signature.LoopEvalCheckpoint]
+    _grad_checkpoint_impl: JittedFunction[_Signature.LoopGradCheckpoint]
+    _eval_resume_impl: JittedFunction[_Signature.LoopEvalResume]
+    checkpoint: bool = False
 
     _output0_scalar: JittedFunction[_Signature.Output0]
     _eval_scalar: JittedFunction[_Signature.Eval]
@@ -142,29 +373,107 @@ class Iterative(Stage[_Signature.GradInfo], metaclass=ABCMeta):
             _Numba.LoopEval, (output0, eval), _eval_generator
         )
         self._grad_impl = JittedFunction(_Numba.LoopGrad, (grad,), _grad_generator)
+        self._eval_batch_impl = JittedFunction(
+            _Numba.LoopEvalBatch, (self._eval_impl,), _eval_batch_generator
+        )
+        self._grad_batch_impl = JittedFunction(
+            _Numba.LoopGradBatch, (self._grad_impl,), _grad_batch_generator
+        )
+        self._eval_checkpoint_impl = JittedFunction(
+            _Numba.LoopEvalCheckpoint, (output0, eval), _eval_checkpoint_generator
+        )
+        self._grad_checkpoint_impl = JittedFunction(
+            _Numba.LoopGradCheckpoint, (eval, grad), _grad_checkpoint_generator
+        )
+        self._eval_resume_impl = JittedFunction(
+            _Numba.LoopEvalResume, (eval,), _eval_resume_generator
+        )
         self._output0_scalar = output0
         self._eval_scalar = eval
         self._grad_scalar = grad
 
+    def enable_checkpoint(self, enabled: bool = True) -> None:
+        """
+        检查点模式：gradinfo只保留约sqrt(n)个检查点而不是完整的outputs，
+        反向扫描时逐段重算，以约一次前向扫描的计算量换取O(sqrt(n))的内存
+        """
+        self.checkpoint = enabled
+
     def _eval(
         self, coeff: ndarray, inputs: ndarray, *, grad: bool, debug: bool
-    ) -> Tuple[ndarray, Optional[_Signature.GradInfo]]:
+    ) -> Tuple[ndarray, Optional[Any]]:
+        if not debug and numpy.isfortran(inputs):
+            inputs = numpy.ascontiguousarray(inputs)
+        if self.checkpoint and grad:
+            stride = max(1, math.ceil(math.sqrt(inputs.shape[0])))
+            if debug:
+                impl = self._eval_checkpoint_impl.py_func()
+            else:
+                impl = self._eval_checkpoint_impl.func()
+            outputs, gradinfo = impl(coeff, inputs, grad, stride)
+            assert gradinfo is not None
+            return outputs, _Checkpointed(gradinfo)
         if debug:
             return self._eval_impl.py_func()(coeff, inputs, grad)
-        if numpy.isfortran(inputs):
-            inputs = numpy.ascontiguousarray(inputs)
         return self._eval_impl.func()(coeff, inputs, grad)
 
     def _grad(
-        self,
-        coeff: ndarray,
-        gradinfo: _Signature.GradInfo,
-        dL_do: ndarray,
-        *,
-        debug: bool
+        self, coeff: ndarray, gradinfo: Any, dL_do: ndarray, *, debug: bool
     ) -> Tuple[ndarray, ndarray]:
+        if not debug and numpy.isfortran(dL_do):
+            dL_do = numpy.ascontiguousarray(dL_do)
+        if isinstance(gradinfo, _Checkpointed):
+            if debug:
+                impl = self._grad_checkpoint_impl.py_func()
+            else:
+                impl = self._grad_checkpoint_impl.func()
+            return impl(coeff, gradinfo.gradinfo, dL_do)
         if debug:
             return self._grad_impl.py_func()(coeff, gradinfo, dL_do)
-        if numpy.isfortran(dL_do):
-            dL_do = numpy.ascontiguousarray(dL_do)
         return self._grad_impl.func()(coeff, gradinfo, dL_do)
+
+    def _initial_state(self, coeff: ndarray) -> Tuple[ndarray, ndarray]:
+        output0, _, preserve, _ = self._output0_scalar.func()(coeff)
+        return output0, preserve
+
+    def _eval_resume(
+        self, coeff: ndarray, inputs: ndarray, state: Tuple[ndarray, ndarray]
+    ) -> Tuple[ndarray, Tuple[ndarray, ndarray]]:
+        """
+        state为(上一行输出, preserve)，初值由_initial_state给出
+        """
+        outputs, preserve = self._eval_resume_impl.func()(
+            coeff, numpy.ascontiguousarray(inputs), *state
+        )
+        if not outputs.shape[0]:
+            return outputs, state
+        return outputs, (outputs[-1, :].copy(), preserve)
+
+    def _eval_batch(
+        self, coeffs: ndarray, inputs: List[ndarray], *, grad: bool, debug: bool
+    ) -> Tuple[List[ndarray], Optional[Any]]:
+        offsets = numpy.cumsum([0] + [x.shape[0] for x in inputs], dtype=numpy.int64)
+        assert numpy.all(offsets[1:] > offsets[:-1])
+        _coeffs = numpy.ascontiguousarray(coeffs)
+        _inputs = numpy.ascontiguousarray(numpy.concatenate(inputs, axis=0))
+        if debug:
+            outputs, gradinfo = self._eval_batch_impl.py_func()(
+                _coeffs, _inputs, offsets, grad
+            )
+        else:
+            outputs, gradinfo = self._eval_batch_impl.func()(
+                _coeffs, _inputs, offsets, grad
+            )
+        return numpy.split(outputs, offsets[1:-1]), gradinfo
+
+    def _grad_batch(
+        self, coeffs: ndarray, gradinfo: Any, dL_do: List[ndarray], *, debug: bool
+    ) -> Tuple[List[ndarray], ndarray]:
+        offsets = gradinfo[5]
+        _coeffs = numpy.ascontiguousarray(coeffs)
+        _dL_do = numpy.ascontiguousarray(numpy.concatenate(dL_do, axis=0))
+        if debug:
+            dL_di, dL_dc = self._grad_batch_impl.py_func()(_coeffs, gradinfo, _dL_do)
+        else:
+            dL_di, dL_dc = self._grad_batch_impl.func()(_coeffs, gradinfo, _dL_do)
+        return numpy.split(dL_di, offsets[1:-1]), dL_dc
@@ -14,6 +14,7 @@ from typing import (
 )
 
 import numpy
+from likelihood.workspace import extend_rows
 from overloads.shortcuts import assertNoInfNaN, isunique
 from overloads.typedefs import ndarray
 
@@ -108,42 +109,104 @@ class Stage(Generic[_gradinfo_t], metaclass=ABCMeta):
     ) -> Constraints:
         ...  # pragma: no cover
 
-    def eval(
-        self, coeff: ndarray, input: ndarray, *, grad: bool, debug: bool
-    ) -> Tuple[ndarray, Optional[_gradinfo_t]]:
+    def _eval_batch(
+        self, coeffs: ndarray, inputs: List[ndarray], *, grad: bool, debug: bool
+    ) -> Tuple[List[ndarray], Optional[Any]]:
+        """
+        多序列版本的_eval，coeffs的第s行对应inputs[s]
+        默认实现逐条序列调用_eval，gradinfo为逐条序列的列表
+        """
+        outputs: List[ndarray] = []
+        gradinfo: List[Optional[_gradinfo_t]] = []
+        for coeff, input in zip(coeffs, inputs):
+            output, g = self._eval(coeff, input, grad=grad, debug=debug)
+            outputs.append(output)
+            gradinfo.append(g)
+        if not grad:
+            return outputs, None
+        return outputs, gradinfo
+
+    def _grad_batch(
+        self, coeffs: ndarray, gradinfo: Any, dL_do: List[ndarray], *, debug: bool
+    ) -> Tuple[List[ndarray], ndarray]:
+        dL_di: List[ndarray] = []
+        dL_dc = numpy.zeros(coeffs.shape)
+        for i, (coeff, g, _dL_do) in enumerate(zip(coeffs, gradinfo, dL_do)):
+            _dL_di, dL_dc[i, :] = self._grad(coeff, g, _dL_do, debug=debug)
+            dL_di.append(_dL_di)
+        return dL_di, dL_dc
+
+    def _paste_output(self, input: ndarray, _output: ndarray) -> ndarray:
         """
         主要处理消除k-lag的问题
         对于长度缩小了的输出，从原input上截取k-lag项（也就是最后几项）
         然后将output贴进去
         另外，在此处对output检查是最经济的，只需要检查被输出的少数列，而不是更新后的完整sheet
         """
-        _output, gradinfo = self._eval(
-            coeff, input[:, self.data_in_index], grad=grad, debug=debug
-        )
         assertNoInfNaN(_output)
         k = input.shape[0] - _output.shape[0]
         assert k >= 0
         output = input[k:, :] if k else input
         output[:, self.data_out_index] = _output
-        return output, gradinfo
+        return output
 
-    def grad(
-        self, coeff: ndarray, gradinfo: _gradinfo_t, dL_do: ndarray, *, debug: bool
-    ) -> Tuple[ndarray, ndarray]:
+    def _take_dL_do(self, dL_do: ndarray) -> ndarray:
         _dL_do: ndarray = dL_do[:, self.data_out_index]
         dL_do[:, self.data_out_index] = 0.0
-        _dL_di, dL_dc = self._grad(coeff, gradinfo, _dL_do, debug=debug)
+        return _dL_do
+
+    def _paste_dL_di(self, dL_do: ndarray, _dL_di: ndarray) -> ndarray:
         assertNoInfNaN(_dL_di)
-        assertNoInfNaN(dL_dc)
         k = _dL_di.shape[0] - dL_do.shape[0]
         assert k >= 0
         if k:
-            dL_di = numpy.zeros((_dL_di.shape[0], dL_do.shape[1]))
-            dL_di[k:, :] = dL_do
+            extended = extend_rows(dL_do, k)
+            if extended is not None:
+                dL_di = extended
+            else:
+                dL_di = numpy.zeros((_dL_di.shape[0], dL_do.shape[1]))
+                dL_di[k:, :] = dL_do
         else:
             dL_di = dL_do
         dL_di[:, self.data_in_index] += _dL_di
-        return dL_di, dL_dc
+        return dL_di
+
+    def eval(
+        self, coeff: ndarray, input: ndarray, *, grad: bool, debug: bool
+    ) -> Tuple[ndarray, Optional[_gradinfo_t]]:
+        _output, gradinfo = self._eval(
+            coeff, input[:, self.data_in_index], grad=grad, debug=debug
+        )
+        return self._paste_output(input, _output), gradinfo
+
+    def grad(
+        self, coeff: ndarray, gradinfo: _gradinfo_t, dL_do: ndarray, *, debug: bool
+    ) -> Tuple[ndarray, ndarray]:
+        _dL_di, dL_dc = self._grad(
+            coeff, gradinfo, self._take_dL_do(dL_do), debug=debug
+        )
+        assertNoInfNaN(dL_dc)
+        return self._paste_dL_di(dL_do, _dL_di), dL_dc
+
+    def eval_batch(
+        self, coeffs: ndarray, inputs: List[ndarray], *, grad: bool, debug: bool
+    ) -> Tuple[List[ndarray], Optional[Any]]:
+        _outputs, gradinfo = self._eval_batch(
+            coeffs,
+            [input[:, self.data_in_index] for input in inputs],
+            grad=grad,
+            debug=debug,
+        )
+        return [self._paste_output(x, o) for x, o in zip(inputs, _outputs)], gradinfo
+
+    def grad_batch(
+        self, coeffs: ndarray, gradinfo: Any, dL_do: List[ndarray], *, debug: bool
+    ) -> Tuple[List[ndarray], ndarray]:
+        _dL_di, dL_dc = self._grad_batch(
+            coeffs, gradinfo, [self._take_dL_do(x) for x in dL_do], debug=debug
+        )
+        assertNoInfNaN(dL_dc)
+        return [self._paste_dL_di(x, d) for x, d in zip(dL_do, _dL_di)], dL_dc
 
     def register_coeff_and_data_names(
         self,
@@ -0,0 +1,111 @@
+from __future__ import annotations
+
+import argparse
+import importlib
+import sys
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from likelihood import jit
+from likelihood.jit import JittedFunction
+from likelihood.likelihood import negLikelihood
+from likelihood.stages.abc.Convolution import Convolution
+from likelihood.stages.abc.Iterative import Iterative
+from likelihood.stages.abc.Stage import Stage
+from likelihood.stages.Mapping import Mapping
+
+
+_kernels_t = Dict[Tuple[bytes, ...], Tuple[str, JittedFunction[Any]]]
+
+
+def _collect_stage(s: Stage[Any], kernels: _kernels_t, batch: bool) -> None:
+    if isinstance(s, Mapping):
+        _collect_stage(s.submodel, kernels, batch)
+    if isinstance(s, Iterative):
+        names: Tuple[str, ...] = ("_eval_impl", "_grad_impl")
+        if batch:
+            names += ("_eval_batch_impl", "_grad_batch_impl")
+        if s.checkpoint:
+            names += ("_eval_checkpoint_impl", "_grad_checkpoint_impl")
+        for name in names:
+            k: JittedFunction[Any] = getattr(s, name)
+            kernels.setdefault(k.pickled_bytecode, (f"{type(s).__name__}.{name}", k))
+        # MS_TVTP等迭代模块的子模型只以标量函数的形式参与编译，已包含在依赖之中
+        return
+    if isinstance(s, Convolution) and s.jit:
+        for name in ("_eval_impl", "_grad_impl"):
+            k = getattr(s, name)
+            kernels.setdefault(k.pickled_bytecode, (f"Convolution.{name}", k))
+    for sub in s.submodels:
+        _collect_stage(sub, kernels, batch)
+
+
+def collect_kernels(
+    nll: negLikelihood, *, batch: bool = False
+) -> List[Tuple[str, JittedFunction[Any]]]:
+    """
+    遍历negLikelihood的stage树（含Mapping.submodel与Merge.submodels），
+    按pickled_bytecode去重后返回所有会被调用的循环核函数及其名称
+    """
+    kernels: _kernels_t = {}
+    stages = nll.stages + ((nll.penalty,) if nll.penalty is not None else ())
+    for s in stages:
+        _collect_stage(s, kernels, batch)
+    return list(kernels.values())
+
+
+def warmup(
+    nll: negLikelihood,
+    *,
+    workers: Optional[int] = None,
+    batch: bool = False,
+) -> List[Tuple[str, float]]:
+    """
+    预先编译negLikelihood用到的所有核函数及其依赖，互不依赖的函数以多进程并发编译
+    返回本次新编译的每个函数的(函数名, 编译耗时秒数)，详见jit.compile_parallel
+    """
+    kernels = collect_kernels(nll, batch=batch)
+    return jit.compile_parallel([k for _, k in kernels], workers=workers)
+
+
+def _load_factory(spec: str) -> Callable[[], negLikelihood]:
+    module_name, _, attr = spec.partition(":")
+    assert attr, f"{spec}的格式应为 package.module:factory"
+    factory: Callable[[], negLikelihood] = getattr(
+        importlib.import_module(module_name), attr
+    )
+    return factory
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m likelihood.warmup",
+        description="预编译negLikelihood所用到的全部核函数",
+    )
+    parser.add_argument(
+        "factory", nargs="+", help="返回negLikelihood的可调用对象，如 package.module:factory"
+    )
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--cache-dir", default=None, help="磁盘缓存目录，默认取LIKELIHOOD_JIT_CACHE_DIR"
+    )
+    parser.add_argument("--batch", action="store_true", help="同时编译多序列核函数")
+    args = parser.parse_args(argv)
+
+    if args.cache_dir is not None:
+        jit.set_disk_cache_dir(args.cache_dir)
+    # 编译结果只有写入磁盘缓存才能留给之后的进程，否则随本进程退出而丢弃
+    if jit.get_disk_cache_dir() is None:
+        parser.error("未设置磁盘缓存目录，请指定--cache-dir或LIKELIHOOD_JIT_CACHE_DIR")
+
+    total = 0.0
+    for spec in args.factory:
+        nll = _load_factory(spec)()
+        for name, seconds in warmup(nll, workers=args.workers, batch=args.batch):
+            print(f"{name} {seconds:.4f}s")
+            total += seconds
+    print(f"total {total:.4f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+from __future__ import annotations
+
+import weakref
+from typing import Optional, Tuple
+
+import numpy
+from overloads.typedefs import ndarray
+
+# 由Workspace分配的梯度表，只有这些表上方的空余行可以被Stage借用
+_Owned: weakref.WeakValueDictionary[int, ndarray] = weakref.WeakValueDictionary()
+
+
+def extend_rows(a: ndarray, k: int) -> Optional[ndarray]:
+    """
+    若a是某块Workspace梯度表的底部切片，且其上方至少还有k行，
+    则返回向上扩展k行后的视图（新增的k行已清零），否则返回None
+    """
+    base = a.base
+    if base is None or _Owned.get(id(base)) is not base:
+        return None
+    assert isinstance(base, numpy.ndarray)
+    if a.ndim != 2 or not a.flags.c_contiguous or a.shape[1] != base.shape[1]:
+        return None
+    offset = a.ctypes.data - base.ctypes.data
+    row, remainder = divmod(offset, base.strides[0])
+    if remainder or row < k or row + a.shape[0] != base.shape[0]:
+        return None
+    start = row - k
+    extended: ndarray = base[start:, :]
+    extended[:k, :] = 0.0
+    return extended
+
+
+class Workspace:
+    """
+    反向扫描所用的预分配内存，按Variables的尺寸一次分配，尺寸不变时反复使用
+    dL_dL取梯度表的底部若干行，带有k-lag的stage向上借用空余的行，
+    因为总的lag不超过输入的行数，整个反向扫描不再分配与数据等长的表
+    """
+
+    shape: Optional[Tuple[int, int]]
+    nCoeff: int
+    dL: ndarray
+    dL_dc: ndarray
+
+    def __init__(self, nCoeff: int) -> None:
+        self.shape = None
+        self.nCoeff = nCoeff
+        self.dL_dc = numpy.empty((nCoeff,))
+
+    def resize(self, shape: Tuple[int, int]) -> None:
+        # 只在列数改变或行数不足时重新分配，较短的输入（如分块求值的最后一块）沿用原表
+        if (
+            self.shape is not None
+            and self.shape[1] == shape[1]
+            and self.shape[0] >= shape[0]
+        ):
+            return
+        self.shape = shape
+        self.dL = numpy.empty(shape)
+        _Owned[id(self.dL)] = self.dL
+
+    def dL_dL(self, shape: Tuple[int, int]) -> ndarray:
+        assert self.shape is not None
+        assert shape[0] <= self.shape[0] and shape[1] == self.shape[1]
+        top = self.shape[0] - shape[0]
+        dL_dL: ndarray = self.dL[top:, :]
+        dL_dL.fill(0.0)
+        dL_dL[:, 0] = -1.0
+        return dL_dL
+
+    def zero_dL_dc(self) -> ndarray:
+        self.dL_dc.fill(0.0)
+        return self.dL_dc
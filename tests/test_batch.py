@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch_tvtp import NLL, generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("ones", numpy.ones((n,)))),
+        *(("Y1", None), ("mean1", None), ("var1", None), ("EX2_1", None)),
+        *(("Y2", None), ("mean2", None), ("var2", None), ("EX2_2", None)),
+        *(("p11col", None), ("p22col", None)),
+    )
+    nll = NLL()
+
+    # 长度不同的序列，各自使用不同的参数
+    batch = (input, input.index(from_=100, to=n), input.index(from_=0, to=n // 2))
+    coeffs = numpy.stack((coeff, coeff * 1.01, coeff * 0.99))
+    for debug in (True, False):
+        fvals1, outputs1 = nll.eval_batch(coeffs, batch, regularize=False, debug=debug)
+        fvals2, outputs2, grads2 = nll.value_and_grad_batch(
+            coeffs, batch, regularize=False, debug=debug
+        )
+        for i, d in enumerate(batch):
+            fval, output, grad = nll.value_and_grad(
+                coeffs[i], d, regularize=False, debug=debug
+            )
+            assert fvals1[i] == fval and fvals2[i] == fval
+            assert numpy.all(outputs1[i] == output)
+            assert numpy.all(outputs2[i] == output)
+            assert numpy.all(grads2[i] == grad)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([1.0, 1.0, 0.011, 0.089, 0.89, 0.022, 0.078, 0.89]), 500)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    assert nll.buffers is None
+
+    fval1, output1, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+    grad3 = nll.grad(coeff * 0.9, input, regularize=False)
+    pool = nll.enable_buffer_pool(max_buffers=2)
+    fval2, output2, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+    assert fval1 == fval2
+    assert numpy.all(output1 == output2)
+    assert numpy.all(grad1 == grad2)
+
+    # 交给调用者的输出表从不归还池中，之后的求值不会覆盖它
+    assert len(pool) == 0
+    kept = output2.copy()
+    for _ in range(3):
+        assert numpy.all(nll.grad(coeff * 0.9, input, regularize=False) == grad3)
+    assert numpy.all(output2 == kept)
+    assert pool.misses == 2 and pool.hits == 2 and len(pool) == 1
+
+    # 超出max_buffers的空闲缓冲区不再保留
+    pool.release(numpy.empty((7, 3)))
+    pool.release(numpy.empty((8, 3)))
+    assert len(pool) == 2
+    try:
+        pool.release(pool.acquire(input.sheet.shape))
+        pool.release(pool._free[input.sheet.shape][0])
+        assert False
+    except AssertionError as e:
+        assert str(e) == "缓冲区被重复归还"
+
+    nll.disable_buffer_pool()
+    assert nll.buffers is None
+
+    view = input.index(from_=1, to=len(input.dates))
+    assert numpy.shares_memory(view.sheet, input.sheet)
+    fval3, _ = nll.eval(coeff, view, regularize=False)
+    copied = Variables(tuple(range(1, n - 1)), ("Y", x[2:]), ("X", x[1:-1]))
+    fval4, _ = nll.eval(coeff, copied, regularize=False)
+    assert fval3 == fval4
+
+
+def run_chunked(n: int, k: int) -> None:
+    numpy.random.seed(0)
+    x = numpy.random.randn(n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X"),
+        (
+            Midas_exp("omega", ("X",), ("X",), k=k),
+            LogNormpdf("var", ("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    beta0 = numpy.array([0.5, 1.0])
+    expected = nll.value_and_grad_chunked(
+        beta0, input, chunk_rows=300, regularize=False
+    )
+
+    # 分块求值逐块归还工作表，各块复用同一块缓冲区，末尾不足一块的尺寸另占一块
+    pool = nll.enable_buffer_pool(max_buffers=2)
+    fval, dL_dc = nll.value_and_grad_chunked(
+        beta0, input, chunk_rows=300, regularize=False
+    )
+    assert fval == expected[0] and numpy.all(dL_dc == expected[1])
+    assert pool.misses == 2 and len(pool) == 2
+    hits = pool.hits
+    assert nll.eval_chunked(beta0, input, chunk_rows=300, regularize=False) == fval
+    assert pool.misses == 2 and pool.hits > hits and len(pool) == 2
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+    def test_2(self) -> None:
+        run_chunked(1000, 20)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
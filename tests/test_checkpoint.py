@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.cache import _nbytes
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+
+    garch = Garch(("c", "a", "b"), "X", "X")
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (garch, LogNormpdf_var(("Y", "X"), ("Y", "X"))),
+        None,
+    )
+
+    fval1, output1, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+    _, _, gradinfo1 = nll._eval(coeff, input, grad=True, regularize=False, debug=False)
+
+    garch.enable_checkpoint()
+    try:
+        fval2, output2, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+        _, _, gradinfo2 = nll._eval(
+            coeff, input, grad=True, regularize=False, debug=False
+        )
+        _, _, grad3 = nll.value_and_grad(coeff, input, regularize=False, debug=True)
+    finally:
+        garch.enable_checkpoint(False)
+
+    assert fval1 == fval2
+    assert numpy.all(output1 == output2)
+    assert numpy.all(grad1 == grad2)
+    assert numpy.allclose(grad3, grad1, rtol=1e-12, atol=1e-12)
+
+    assert gradinfo1 is not None and gradinfo2 is not None
+    assert _nbytes(tuple(gradinfo2[0])) < _nbytes(tuple(gradinfo1[0]))
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
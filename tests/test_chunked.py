@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_midasexp import generate
+
+
+def run_once(coeff: ndarray, n: int, k: int) -> None:
+    x = generate(coeff, n, k)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+    beta0 = numpy.array([0.5, 1.0])
+
+    nll = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X"),
+        (
+            Midas_exp("omega", ("X",), ("X",), k=k),
+            LogNormpdf("var", ("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    assert nll.is_streamable()
+
+    fval, _, grad = nll.value_and_grad(beta0, input, regularize=False)
+    for chunk_rows in (k + 1, 100, 333, n):
+        fval1 = nll.eval_chunked(beta0, input, chunk_rows=chunk_rows, regularize=False)
+        fval2, grad2 = nll.value_and_grad_chunked(
+            beta0, input, chunk_rows=chunk_rows, regularize=False
+        )
+        assert fval1 == fval2
+        assert numpy.isclose(fval1, fval, rtol=1e-12)
+        assert numpy.allclose(grad2, grad, rtol=1e-10, atol=1e-12)
+
+    garch = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    assert not garch.is_streamable()
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.8]), 1000, 30)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+
+def run_once(coeff: ndarray, n: int, k: int) -> None:
+    numpy.random.seed(0)
+    x, y = numpy.random.randn(n), numpy.random.randn(n)
+    input = Variables(tuple(range(n)), ("Y", y), ("X", x), ("X2", x * x))
+
+    midas = Midas_exp("omega", ("X", "X2"), ("X", "X2"), k=k)
+    nll = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X", "X2"),
+        (midas, LogNormpdf("var", ("Y", "X"), ("Y", "X"))),
+        None,
+    )
+
+    assert k >= midas.fft_threshold
+    fval1, output1, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+
+    midas.fft_threshold = k + 1
+    try:
+        fval2, output2, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+    finally:
+        del midas.fft_threshold
+
+    assert output1.shape == output2.shape
+    assert numpy.allclose(fval1, fval2, rtol=1e-12, atol=0)
+    assert numpy.allclose(output1, output2, rtol=1e-10, atol=1e-12)
+    assert numpy.allclose(grad1, grad2, rtol=1e-8, atol=1e-10)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.99, 1.0]), 3000, 300)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
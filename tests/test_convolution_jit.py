@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from likelihood.warmup import collect_kernels
+from overloads.typedefs import ndarray
+
+
+def run_once(coeff: ndarray, n: int, k: int) -> None:
+    numpy.random.seed(0)
+    x, y = numpy.random.randn(n), numpy.random.randn(n)
+    input = Variables(tuple(range(n)), ("Y", y), ("X", x), ("X2", x * x))
+
+    midas = Midas_exp("omega", ("X", "X2"), ("X", "X2"), k=k)
+    nll = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X", "X2"),
+        (midas, LogNormpdf("var", ("Y", "X"), ("Y", "X"))),
+        None,
+    )
+
+    assert not collect_kernels(nll)
+    fval1, output1, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+
+    midas.enable_jit()
+    try:
+        assert len(collect_kernels(nll)) == 2
+        fval2, output2, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+        _, _, grad3 = nll.value_and_grad(coeff, input, regularize=False, debug=True)
+    finally:
+        midas.enable_jit(False)
+
+    assert output1.shape == output2.shape
+    assert numpy.allclose(fval1, fval2, rtol=1e-12, atol=0)
+    assert numpy.allclose(output1, output2, rtol=1e-12, atol=1e-12)
+    assert numpy.allclose(grad1, grad2, rtol=1e-10, atol=1e-10)
+    assert numpy.allclose(grad3, grad2, rtol=1e-12, atol=1e-12)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.9, 1.0]), 3000, 30)
+
+    def test_2(self) -> None:
+        run_once(numpy.array([0.2, 1.0]), 100, 1)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    fval0, output0 = nll.eval(coeff, input, regularize=False)
+    grad0 = nll.grad(coeff, input, regularize=False)
+
+    cache = nll.enable_cache(max_bytes=1 << 30)
+    fval1, output1 = nll.eval(coeff, input, regularize=False)
+    grad1 = nll.grad(coeff, input, regularize=False)
+    assert cache.hits == 1 and cache.misses == 1
+    assert fval1 == fval0
+    assert numpy.all(output1 == output0)
+    assert numpy.all(grad1 == grad0)
+
+    # 调用者拿到的输出表是只读的，不能改动之后命中时返回的内容
+    try:
+        output1[:, 0] = 0.0
+        assert False
+    except ValueError:
+        pass
+    fval2, output2, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+    assert cache.hits == 2
+    assert output2 is not output1 and not output2.flags.writeable
+    assert fval2 == fval0
+    assert numpy.all(output2 == output0)
+    assert numpy.all(grad2 == grad0)
+
+    # 不同的参数未命中，另一份Variables视图也不与原表共用条目
+    nll.eval(coeff * 1.01, input, regularize=False)
+    nll.eval(coeff, input.index(from_=0, to=n - 1), regularize=False)
+    assert cache.misses == 3
+
+    nll.disable_cache()
+    _, output3 = nll.eval(coeff, input, regularize=False)
+    assert output3.flags.writeable
+
+
+def run_evict(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    c1, c2, c3 = coeff, coeff * 1.01, coeff * 0.99
+
+    # 先测出一个条目的大小，再把预算设为恰好容纳两个条目
+    probe = nll.enable_cache(max_bytes=1 << 30)
+    nll.eval(c1, input, regularize=False)
+    size = probe.nbytes
+    cache = nll.enable_cache(max_bytes=2 * size)
+
+    nll.eval(c1, input, regularize=False)
+    nll.eval(c2, input, regularize=False)
+    assert len(cache) == 2 and cache.nbytes == 2 * size and cache.evictions == 0
+
+    # 命中c1后c2成为最久未用的条目，加入c3时被逐出
+    nll.eval(c1, input, regularize=False)
+    nll.eval(c3, input, regularize=False)
+    assert cache.evictions == 1 and len(cache) == 2
+    assert cache.nbytes <= cache.max_bytes
+
+    hits, misses = cache.hits, cache.misses
+    nll.eval(c1, input, regularize=False)
+    nll.eval(c3, input, regularize=False)
+    assert cache.hits == hits + 2 and cache.misses == misses
+    nll.eval(c2, input, regularize=False)
+    assert cache.misses == misses + 1 and cache.evictions == 2
+
+    # 超过整个预算的条目不进入缓存，也不逐出已有的条目
+    small = nll.enable_cache(max_bytes=size - 1)
+    nll.eval(c1, input, regularize=False)
+    assert len(small) == 0 and small.nbytes == 0 and small.evictions == 0
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+    def test_2(self) -> None:
+        run_evict(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
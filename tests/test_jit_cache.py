@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import os
+import pickle
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, List
+
+import numba  # type: ignore
+import numpy
+from likelihood import jit, likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from numba import float64  # type: ignore
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit._Disk_Cache_Dir
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            jit.set_disk_cache_dir(directory)
+
+            jit._Jitted_Function_Cache.clear()
+            fval1, _, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+            assert len(os.listdir(directory))
+
+            jit._Jitted_Function_Cache.clear()
+            fval2, _, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+        finally:
+            jit.set_disk_cache_dir(disk_cache_dir)
+            jit._Jitted_Function_Cache.clear()
+            jit._Jitted_Function_Cache.update(memory_cache)
+
+    assert fval1 == fval2
+    assert numpy.all(grad1 == grad2)
+
+
+def add_one() -> Callable[[float], float]:
+    def implement(x: float) -> float:
+        return x + 1.0
+
+    return implement
+
+
+def add_two() -> Callable[[float], float]:
+    def implement(x: float) -> float:
+        return x + 2.0
+
+    return implement
+
+
+def twice(f: Callable[[float], float]) -> Callable[[float], float]:
+    def implement(x: float) -> float:
+        return f(x) * 2.0
+
+    return implement
+
+
+_signature = jit._signature_t(float64(float64))
+
+
+def twice_of(inner: Callable[[], Callable[[float], float]]) -> Any:
+    f = jit.JittedFunction(_signature, (), inner)
+    for _ in range(2):
+        f = jit.JittedFunction(_signature, (f,), twice)
+    return f
+
+
+def compile_in_child(directory: str, inner: Callable[[], Any]) -> float:
+    jit.set_disk_cache_dir(directory)
+    return twice_of(inner).func()(1.0)  # type: ignore
+
+
+def run_processes() -> None:
+    """
+    同一个generator依赖不同的函数，在两个新进程中分别编译并写入磁盘缓存，
+    两者的numba符号编号相同；本进程同时载入两者时，外层函数不能链接到另一进程编译的内层函数
+    """
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit._Disk_Cache_Dir
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as directory:
+        expected = []
+        for inner in (add_one, add_two):
+            with ProcessPoolExecutor(1, mp_context=context) as executor:
+                expected.append(
+                    executor.submit(compile_in_child, directory, inner).result()
+                )
+        assert expected == [8.0, 12.0]
+        try:
+            jit.set_disk_cache_dir(directory)
+            jit._Jitted_Function_Cache.clear()
+            funcs = [twice_of(f).func() for f in (add_one, add_two)]
+            assert [f(1.0) for f in funcs] == expected
+            names = [f.overloads[f.signatures[0]].fndesc.mangled_name for f in funcs]
+            assert names[0] != names[1]
+        finally:
+            jit.set_disk_cache_dir(disk_cache_dir)
+            jit._Jitted_Function_Cache.clear()
+            jit._Jitted_Function_Cache.update(memory_cache)
+
+
+def run_other_environment() -> None:
+    """
+    其他numba/llvmlite版本写入的缓存文件不被载入，而是重新编译并覆盖
+    """
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit._Disk_Cache_Dir
+    events: List[jit.JitEvent] = []
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            jit.set_disk_cache_dir(directory)
+            jit._Jitted_Function_Cache.clear()
+            assert twice_of(add_one).func()(1.0) == 8.0
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                with open(path, "rb") as file:
+                    _, data = pickle.load(file)
+                with open(path, "wb") as file:
+                    pickle.dump((b"other", data), file)
+
+            jit._Jitted_Function_Cache.clear()
+            jit.add_event_hook(events.append)
+            assert twice_of(add_one).func()(1.0) == 8.0
+        finally:
+            jit.remove_event_hook(events.append)
+            jit.set_disk_cache_dir(disk_cache_dir)
+            jit._Jitted_Function_Cache.clear()
+            jit._Jitted_Function_Cache.update(memory_cache)
+    kinds = [e.kind for e in events]
+    assert "disk_hit" not in kinds
+    assert kinds.count("compile_end") == 3
+
+
+_offset = 1.0
+
+
+def _shift_once(x: float) -> float:
+    return x + _offset
+
+
+def _shift_twice(x: float) -> float:
+    return x + 2.0 * _offset
+
+
+_shift = numba.njit(_shift_once)
+
+
+def add_offset() -> Callable[[float], float]:
+    def implement(x: float) -> float:
+        y: float = _shift(x)
+        return y
+
+    return implement
+
+
+def run_fingerprint() -> None:
+    """
+    编译结果中冻结了所引用的全局量与辅助函数，修改它们后不能再命中旧的缓存文件
+    """
+    namespace, shift = globals(), _shift
+    f = jit.JittedFunction(_signature, (), add_offset)
+    digest = f._digest()
+    try:
+        namespace["_offset"] = 2.0
+        assert f._digest() != digest
+        namespace["_offset"] = 1.0
+        assert f._digest() == digest
+        namespace["_shift"] = numba.njit(_shift_twice)
+        assert f._digest() != digest
+    finally:
+        namespace["_offset"] = 1.0
+        namespace["_shift"] = shift
+
+    # 缓存文件的权限按umask给出，而非mkstemp的0600
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit._Disk_Cache_Dir
+    umask = os.umask(0o027)
+    with tempfile.TemporaryDirectory() as directory:
+        try:
+            jit.set_disk_cache_dir(directory)
+            jit._Jitted_Function_Cache.clear()
+            assert f.func()(1.0) == 2.0
+            modes = [
+                os.stat(os.path.join(directory, name)).st_mode & 0o777
+                for name in os.listdir(directory)
+            ]
+            assert modes == [0o640]
+        finally:
+            os.umask(umask)
+            jit.set_disk_cache_dir(disk_cache_dir)
+            jit._Jitted_Function_Cache.clear()
+            jit._Jitted_Function_Cache.update(memory_cache)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+    def test_2(self) -> None:
+        run_processes()
+
+    def test_3(self) -> None:
+        run_other_environment()
+
+    def test_4(self) -> None:
+        run_fingerprint()
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
+    Test_1().test_3()
+    Test_1().test_4()
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from typing import List
+
+import numpy
+from likelihood import jit, likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+    events: List[jit.JitEvent] = []
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit._Disk_Cache_Dir
+    try:
+        jit.set_disk_cache_dir(None)
+        jit.add_event_hook(events.append)
+        jit.set_profiling(True)
+        jit.reset_registry()
+
+        jit._Jitted_Function_Cache.clear()
+        fval1, _, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+        fval2, _, grad2 = nll.value_and_grad(coeff, input, regularize=False)
+        registry = jit.get_registry()
+    finally:
+        jit.remove_event_hook(events.append)
+        jit.set_profiling(False)
+        jit.set_disk_cache_dir(disk_cache_dir)
+        jit._Jitted_Function_Cache.clear()
+        jit._Jitted_Function_Cache.update(memory_cache)
+
+    assert fval1 == fval2
+    assert numpy.all(grad1 == grad2)
+
+    kinds = [e.kind for e in events]
+    assert kinds.count("compile_start") == kinds.count("compile_end") > 0
+    assert "memory_hit" in kinds
+    assert all(e.duration is not None for e in events if e.kind == "compile_end")
+
+    assert sum(s.compiles for s in registry.values()) == kinds.count("compile_end")
+    assert sum(s.calls for s in registry.values()) >= 4
+    assert all(s.call_seconds >= 0 for s in registry.values())
+
+    # 未开启统计且没有回调时，热路径上的命中不做记录
+    jit.reset_registry()
+    nll.value_and_grad(coeff, input, regularize=False)
+    assert all(s.memory_hits == 0 for s in jit.get_registry().values())
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
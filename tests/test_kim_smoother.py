@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+import itertools
+import math
+from typing import Tuple
+
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Copy import Copy
+from likelihood.stages.Garch_mean import Garch_mean
+from likelihood.stages.Linear import Linear
+from likelihood.stages.Logistic import Logistic
+from likelihood.stages.MS_TVTP import MS_TVTP, providers
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+
+class NLL(likelihood.negLikelihood):
+    """
+    时变转移概率的两状态模型，转移概率与后验概率分别存放在不同的列
+    """
+
+    tvtp: MS_TVTP
+
+    def __init__(self, logspace: bool) -> None:
+        self.tvtp = MS_TVTP(
+            (
+                Garch_mean(
+                    ("c1", "a1", "b1"),
+                    ("Y1", "mean1"),
+                    ("Y1", "mean1", "var1", "EX2_1"),
+                ),
+                Garch_mean(
+                    ("c2", "a2", "b2"),
+                    ("Y2", "mean2"),
+                    ("Y2", "mean2", "var2", "EX2_2"),
+                ),
+            ),
+            providers["normpdf"],
+            ("p11col", "p22col"),
+            ("Y", "EX", "var", "post1", "post2"),
+            logspace=logspace,
+        )
+        super().__init__(
+            ("p11b1", "p11b2", "p22b1", "p22b2") + ("c1", "a1", "b1", "c2", "a2", "b2"),
+            (
+                ("Y", "zeros", "ones", "Z", "EX", "var", "post1", "post2")
+                + ("Y1", "mean1", "var1", "EX2_1")
+                + ("Y2", "mean2", "var2", "EX2_2")
+                + ("p11col", "p22col")
+            ),
+            (
+                Linear(("p11b1", "p11b2"), ("ones", "Z"), "p11col"),
+                Linear(("p22b1", "p22b2"), ("ones", "Z"), "p22col"),
+                Logistic(("p11col", "p22col"), ("p11col", "p22col")),
+                Copy(("Y", "zeros"), ("Y1", "mean1")),
+                Copy(("Y", "zeros"), ("Y2", "mean2")),
+                self.tvtp,
+            ),
+            None,
+        )
+
+
+def make_input(x: ndarray, z: ndarray) -> Variables[int]:
+    n = x.shape[0]
+    return Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("ones", numpy.ones((n,))), ("Z", z)),
+        *(("EX", None), ("var", None), ("post1", None), ("post2", None)),
+        *(("Y1", None), ("mean1", None), ("var1", None), ("EX2_1", None)),
+        *(("Y2", None), ("mean2", None), ("var2", None), ("EX2_2", None)),
+        *(("p11col", None), ("p22col", None)),
+    )
+
+
+def enumerate_paths(output: ndarray, names: Tuple[str, ...]) -> ndarray:
+    """
+    各状态的条件分布与历史无关时，Kim smoother是精确的，可与穷举全部路径的结果比较
+    """
+    col = {name: i for i, name in enumerate(names)}
+    x = output[:, col["Y1"]]
+    n = x.shape[0]
+    p11, p22 = output[:, col["p11col"]], output[:, col["p22col"]]
+    pdf = numpy.empty((n, 2))
+    for j, (mean, var) in enumerate((("mean1", "var1"), ("mean2", "var2"))):
+        err, v = x - output[:, col[mean]], output[:, col[var]]
+        pdf[:, j] = numpy.exp(-(err * err) / (2.0 * v)) / numpy.sqrt(2.0 * math.pi * v)
+    smooth = numpy.zeros((n, 2))
+    for path in itertools.product((0, 1), repeat=n + 1):
+        # path[0]为第0行之前的状态，前向滤波的初始概率为0.5, 0.5
+        weight = 0.5
+        for t in range(n):
+            stay = p11[t] if path[t] == 0 else p22[t]
+            weight *= stay if path[t] == path[t + 1] else 1.0 - stay
+            weight *= pdf[t, path[t + 1]]
+        for t in range(n):
+            smooth[t, path[t + 1]] += weight
+    smooth = smooth / smooth.sum(axis=1, keepdims=True)
+    return smooth
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    numpy.random.seed(0)
+    x = numpy.random.normal(size=(n,)) * numpy.where(numpy.arange(n) % 6 < 3, 0.3, 2.0)
+    z = numpy.random.normal(size=(n,))
+    input = make_input(x, z)
+
+    nll, nll_log = NLL(False), NLL(True)
+    _, output = nll.eval(coeff, input, regularize=False)
+    _, output_log = nll_log.eval(coeff, input, regularize=False)
+    smooth = nll.tvtp.smooth(output)
+    assert numpy.all(smooth == nll.tvtp.smooth(output, debug=True))
+    smooth_log = nll_log.tvtp.smooth(output_log)
+
+    post = output[:, [input.data_names.index("post1"), input.data_names.index("post2")]]
+    assert numpy.allclose(smooth.sum(axis=1), 1.0)
+    assert numpy.all(smooth[-1, :] == post[-1, :])
+    assert numpy.allclose(smooth, smooth_log, rtol=1e-12, atol=1e-12)
+    assert numpy.allclose(
+        smooth, enumerate_paths(output, input.data_names), rtol=1e-10, atol=1e-12
+    )
+
+
+class Test_1:
+    def test_1(self) -> None:
+        # a=b=0时各状态的方差为常数
+        run_once(numpy.array([1.5, 0.5, 1.0, -0.8, 0.09, 0.0, 0.0, 4.0, 0.0, 0.0]), 12)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import gc
+import weakref
+from typing import Any, List
+
+import numpy
+from likelihood.stages.abc.Convolution import Convolution, _Kernel_Memo, _kernel_t
+from likelihood.stages.abc.Stage import Constraints
+from likelihood.stages.Midas_beta import Midas_beta
+from likelihood.stages.Midas_beta_group import Midas_beta_group
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.stages.Midas_exp_group import Midas_exp_group
+from overloads.typedefs import ndarray
+
+
+def run_once(single: Any, group: Any, coeff: ndarray, k: int) -> None:
+    calls: List[bool] = []
+    kernel = type(single).kernel
+
+    def counted(self: Any, coeff: ndarray, *, grad: bool = True) -> Any:
+        calls.append(grad)
+        return kernel(self, coeff, grad=grad)
+
+    numpy.random.seed(0)
+    input = numpy.random.randn(100, k)
+    _Kernel_Memo.clear()
+    type(single).kernel = counted
+    try:
+        phi, dphi = single.kernel(coeff)
+        phi0, dphi0 = single.kernel(coeff, grad=False)
+        assert dphi is not None and dphi0 is None
+        assert numpy.all(phi0 == phi)
+        del calls[:]
+
+        output1, _ = single._eval(coeff, input, grad=False, debug=False)
+        output2, _ = single._eval(coeff, input, grad=False, debug=False)
+        assert calls == [False]
+        output3, gradinfo = single._eval(coeff, input, grad=True, debug=False)
+        assert calls == [False, True]
+        assert gradinfo is not None and numpy.all(gradinfo[2] == dphi)
+        assert numpy.all(output1 == output2) and numpy.all(output1 == output3)
+        phi1, dphi1 = single._kernel(coeff, grad=True)
+        assert not phi1.flags.writeable and not dphi1.flags.writeable
+
+        # 分组stage的卷积核与同K的Midas stage共用缓存
+        group._eval(coeff, input, grad=True, debug=False)
+        assert calls == [False, True]
+        group._eval(coeff * 1.01, input, grad=False, debug=False)
+        assert calls == [False, True, False]
+    finally:
+        type(single).kernel = kernel
+
+
+class Moving(Convolution):
+    def kernel(self, coeff: ndarray, *, grad: bool = True) -> _kernel_t:
+        return numpy.full((3,), float(coeff) / 3), numpy.full((3, 1), 1 / 3)
+
+    def get_constraints(self) -> Constraints:
+        return Constraints(
+            numpy.empty((0, 1)), numpy.empty((0,)), numpy.zeros(1), numpy.ones(1)
+        )
+
+
+def run_unshared(coeff: ndarray) -> None:
+    numpy.random.seed(0)
+    input = numpy.random.randn(100, 1)
+    _Kernel_Memo.clear()
+    stage = Moving(("w",), ("X",), ("X",), ())
+    output1, _ = stage._eval(coeff, input, grad=True, debug=False)
+    output2, _ = stage._eval(coeff, input, grad=True, debug=False)
+    assert numpy.all(output1 == output2)
+    assert stage._kernel(coeff, grad=True) is stage._kernel(coeff, grad=True)
+    assert not stage._kernel(coeff, grad=True)[0].flags.writeable
+
+    # 没有_kernel_id的stage不进入模块级的缓存，回收stage即释放其卷积核
+    assert not _Kernel_Memo
+    ref = weakref.ref(stage)
+    del stage
+    gc.collect()
+    assert ref() is None
+
+
+class Squared(Midas_exp):
+    def kernel(self, _omega: ndarray, *, grad: bool = True) -> _kernel_t:
+        phi, dphi = super().kernel(_omega, grad=grad)
+        return phi**2, (None if dphi is None else 2 * phi.reshape(dphi.shape) * dphi)
+
+
+def run_subclass(coeff: ndarray, k: int) -> None:
+    names = tuple(f"X{i}" for i in range(k))
+    _Kernel_Memo.clear()
+    base = Midas_exp("omega", names, names, k=k)
+    derived = Squared("omega", names, names, k=k)
+
+    # 改写了kernel的子类与同K的基类不共用缓存
+    phi, _ = base._kernel(coeff, grad=True)
+    phi2, _ = derived._kernel(coeff, grad=True)
+    assert numpy.allclose(phi2, phi**2) and not numpy.allclose(phi2, phi)
+    assert len(_Kernel_Memo) == 2
+    assert derived._kernel(coeff, grad=True) is derived._kernel(coeff, grad=True)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        names = tuple(f"X{i}" for i in range(7))
+        run_once(
+            Midas_exp("omega", names, names, k=7),
+            Midas_exp_group("omega", names, "Y"),
+            numpy.array([0.7]),
+            7,
+        )
+
+    def test_2(self) -> None:
+        names = tuple(f"X{i}" for i in range(5))
+        run_once(
+            Midas_beta(("omega1", "omega2"), names, names, k=5),
+            Midas_beta_group(("omega1", "omega2"), names, "Y"),
+            numpy.array([1.5, 3.0]),
+            5,
+        )
+
+    def test_3(self) -> None:
+        run_unshared(numpy.array([1.5]))
+
+    def test_4(self) -> None:
+        run_subclass(numpy.array([0.7]), 7)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
+    Test_1().test_3()
+    Test_1().test_4()
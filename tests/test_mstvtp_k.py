@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+from typing import Tuple
+
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Copy import Copy
+from likelihood.stages.Garch_mean import Garch_mean
+from likelihood.stages.Linear import Linear
+from likelihood.stages.Logistic import Logistic
+from likelihood.stages.MS_TVTP import providers
+from likelihood.stages.MS_TVTP_K import MS_TVTP_K
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.common import nll2func
+from tests.test_garch_tvtp import NLL, generate
+
+
+def garch(i: int) -> Garch_mean:
+    return Garch_mean(
+        (f"c{i}", f"a{i}", f"b{i}"),
+        (f"Y{i}", f"mean{i}"),
+        (f"Y{i}", f"mean{i}", f"var{i}", f"EX2_{i}"),
+    )
+
+
+def submodel_names(K: int) -> Tuple[str, ...]:
+    return tuple(
+        x for i in range(1, K + 1) for x in (f"Y{i}", f"mean{i}", f"var{i}", f"EX2_{i}")
+    )
+
+
+class NLL2(likelihood.negLikelihood):
+    """
+    以K*K个转移概率表示的两状态模型，与tests.test_garch_tvtp.NLL相同
+    """
+
+    def __init__(self) -> None:
+        transition = ("p11col", "p12col", "p21col", "p22col")
+        super().__init__(
+            ("p11b1", "p22b1", "c1", "a1", "b1", "c2", "a2", "b2"),
+            ("Y", "zeros", "ones", "mones") + submodel_names(2) + transition,
+            (
+                Linear(("p11b1",), ("ones",), "p11col"),
+                Linear(("p11b1",), ("mones",), "p12col"),
+                Linear(("p22b1",), ("mones",), "p21col"),
+                Linear(("p22b1",), ("ones",), "p22col"),
+                Logistic(transition, transition),
+                Copy(("Y", "zeros"), ("Y1", "mean1")),
+                Copy(("Y", "zeros"), ("Y2", "mean2")),
+                MS_TVTP_K(
+                    (garch(1), garch(2)),
+                    providers["normpdf"],
+                    transition,
+                    ("Y", "zeros", "ones", "p11col", "p22col"),
+                ),
+            ),
+            None,
+        )
+
+
+class NLL3(likelihood.negLikelihood):
+    """
+    转移概率矩阵逐行给出的三状态模型
+    """
+
+    def __init__(self) -> None:
+        transition = tuple(f"p{i}{j}" for i in range(1, 4) for j in range(1, 4))
+        super().__init__(
+            ("c1", "a1", "b1", "c2", "a2", "b2", "c3", "a3", "b3"),
+            ("Y", "zeros", "EX", "var", "post1", "post2", "post3")
+            + submodel_names(3)
+            + transition,
+            (
+                Copy(("Y", "zeros"), ("Y1", "mean1")),
+                Copy(("Y", "zeros"), ("Y2", "mean2")),
+                Copy(("Y", "zeros"), ("Y3", "mean3")),
+                MS_TVTP_K(
+                    (garch(1), garch(2), garch(3)),
+                    providers["normpdf"],
+                    transition,
+                    ("Y", "EX", "var", "post1", "post2", "post3"),
+                ),
+            ),
+            None,
+        )
+
+
+def numerical_grad(
+    nll: likelihood.negLikelihood, x: ndarray, input: Variables[int]
+) -> ndarray:
+    g = numpy.zeros(x.shape)
+    for i in range(x.shape[0]):
+        h = 1e-6 * max(abs(x[i]), 1e-3)
+        xp, xm = x.copy(), x.copy()
+        xp[i] += h
+        xm[i] -= h
+        fp = nll.eval(xp, input, regularize=False)[0]
+        fm = nll.eval(xm, input, regularize=False)[0]
+        g[i] = (fp - fm) / (2 * h)
+    return g
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input2 = Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("ones", numpy.ones((n,)))),
+        *(("Y1", None), ("mean1", None), ("var1", None), ("EX2_1", None)),
+        *(("Y2", None), ("mean2", None), ("var2", None), ("EX2_2", None)),
+        *(("p11col", None), ("p22col", None)),
+    )
+    inputK = Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("ones", numpy.ones((n,)))),
+        ("mones", -numpy.ones((n,))),
+        *((name, None) for name in submodel_names(2)),
+        *((name, None) for name in ("p11col", "p12col", "p21col", "p22col")),
+    )
+    fval1, output1, grad1 = NLL().value_and_grad(coeff, input2, regularize=False)
+    fval2, output2, grad2 = NLL2().value_and_grad(coeff, inputK, regularize=False)
+    assert numpy.allclose(fval1, fval2, rtol=1e-12, atol=0)
+    assert numpy.allclose(grad1, grad2, rtol=1e-9, atol=1e-9)
+    for name in ("p11col", "p22col", "var1", "var2"):
+        i1, i2 = input2.data_names.index(name), inputK.data_names.index(name)
+        assert numpy.allclose(output1[:, i1], output2[:, i2], rtol=1e-12, atol=1e-12)
+
+    numpy.random.seed(1)
+    transition = numpy.random.rand(n, 3, 3) + numpy.eye(3) * 5
+    transition /= transition.sum(axis=2, keepdims=True)
+    input3 = Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("EX", None), ("var", None)),
+        *(("post1", None), ("post2", None), ("post3", None)),
+        *((name, None) for name in submodel_names(3)),
+        *(
+            (f"p{i + 1}{j + 1}", transition[:, i, j])
+            for i in range(3)
+            for j in range(3)
+        ),
+    )
+    beta3 = numpy.array([0.011, 0.089, 0.89, 0.022, 0.078, 0.89, 0.05, 0.1, 0.8])
+    nll3 = NLL3()
+    nll2func(nll3, beta3, input3, regularize=False)
+    fval3, output3, grad3 = nll3.value_and_grad(beta3, input3, regularize=False)
+    assert numpy.isfinite(fval3)
+    assert numpy.allclose(output3[:, 4:7].sum(axis=1), 1.0)
+    assert numpy.allclose(
+        grad3, numerical_grad(nll3, beta3, input3), rtol=1e-5, atol=1e-4
+    )
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([1.0, 1.0, 0.011, 0.089, 0.89, 0.022, 0.078, 0.89]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
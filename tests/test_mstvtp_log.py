@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Copy import Copy
+from likelihood.stages.Garch_mean import Garch_mean
+from likelihood.stages.Linear import Linear
+from likelihood.stages.Logistic import Logistic
+from likelihood.stages.MS_TVTP import MS_TVTP, providers
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.common import nll2func
+from tests.test_garch_tvtp import NLL, generate
+from tests.test_mstvtp_k import numerical_grad
+
+
+class NLL_log(likelihood.negLikelihood):
+    """
+    与tests.test_garch_tvtp.NLL相同，但在对数空间中滤波
+    """
+
+    def __init__(self) -> None:
+        super().__init__(
+            ("p11b1", "p22b1", "c1", "a1", "b1", "c2", "a2", "b2"),
+            (
+                ("Y", "zeros", "ones")
+                + ("Y1", "mean1", "var1", "EX2_1")
+                + ("Y2", "mean2", "var2", "EX2_2")
+                + ("p11col", "p22col")
+            ),
+            (
+                Linear(("p11b1",), ("ones",), "p11col"),
+                Linear(("p22b1",), ("ones",), "p22col"),
+                Logistic(("p11col", "p22col"), ("p11col", "p22col")),
+                Copy(("Y", "zeros"), ("Y1", "mean1")),
+                Copy(("Y", "zeros"), ("Y2", "mean2")),
+                MS_TVTP(
+                    (
+                        Garch_mean(
+                            ("c1", "a1", "b1"),
+                            ("Y1", "mean1"),
+                            ("Y1", "mean1", "var1", "EX2_1"),
+                        ),
+                        Garch_mean(
+                            ("c2", "a2", "b2"),
+                            ("Y2", "mean2"),
+                            ("Y2", "mean2", "var2", "EX2_2"),
+                        ),
+                    ),
+                    providers["normpdf"],
+                    ("p11col", "p22col"),
+                    ("Y", "zeros", "ones", "p11col", "p22col"),
+                    logspace=True,
+                ),
+            ),
+            None,
+        )
+
+
+def make_input(x: ndarray) -> Variables[int]:
+    n = x.shape[0]
+    return Variables(
+        tuple(range(n)),
+        *(("Y", x), ("zeros", None), ("ones", numpy.ones((n,)))),
+        *(("Y1", None), ("mean1", None), ("var1", None), ("EX2_1", None)),
+        *(("Y2", None), ("mean2", None), ("var2", None), ("EX2_2", None)),
+        *(("p11col", None), ("p22col", None)),
+    )
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    input = make_input(generate(coeff, n))
+    nll_log = NLL_log()
+    nll2func(nll_log, coeff, input, regularize=False)
+
+    # 正常数据上与原有的滤波一致，post列为其对数
+    fval1, output1, grad1 = NLL().value_and_grad(coeff, input, regularize=False)
+    fval2, output2, grad2 = nll_log.value_and_grad(coeff, input, regularize=False)
+    assert numpy.allclose(fval1, fval2, rtol=1e-12, atol=0)
+    assert numpy.allclose(grad1, grad2, rtol=1e-10, atol=1e-10)
+    for name in ("p11col", "p22col"):
+        i = input.data_names.index(name)
+        assert numpy.allclose(output1[:, i], numpy.exp(output2[:, i]), atol=1e-12)
+    for name in ("Y", "zeros", "ones", "var1", "var2"):
+        i = input.data_names.index(name)
+        assert numpy.allclose(output1[:, i], output2[:, i], rtol=1e-12, atol=1e-12)
+
+    # 转移概率舍入为1，离群值使一侧后验概率下溢为0：
+    # 原有的滤波从此停留在另一状态，对数空间中仍保留该状态的后验概率
+    beta = numpy.array([40.0, 40.0, 0.0001, 0.05, 0.9, 0.5, 0.05, 0.9])
+    x = numpy.random.RandomState(0).normal(size=(300,)) * 0.03
+    x[150] = 40.0
+    input = make_input(x)
+    fval1, _, _ = NLL().value_and_grad(beta, input, regularize=False)
+    fval2, output2, grad2 = nll_log.value_and_grad(beta, input, regularize=False)
+    assert numpy.isfinite(fval2) and numpy.all(numpy.isfinite(grad2))
+    assert fval2 < fval1
+    i = input.data_names.index("p11col")
+    assert numpy.all(numpy.isfinite(output2[:, i]))
+    assert numpy.allclose(
+        grad2, numerical_grad(nll_log, beta, input), rtol=1e-6, atol=1e-5
+    )
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([1.0, 1.0, 0.011, 0.089, 0.89, 0.022, 0.078, 0.89]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
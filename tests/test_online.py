@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.online import OnlineFilter, WarmStart
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def check_filter(
+    nll: likelihood.negLikelihood, coeff: ndarray, input: Variables[int]
+) -> None:
+    fval, output = nll.eval(coeff, input, regularize=False)
+
+    online = OnlineFilter(nll, coeff)
+    n = len(input.dates)
+    bounds = [0, n // 2, n // 2 + 1, n // 2 + 2, n - 7, n]
+    outputs = []
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        _, _output = online.update(input.index(from_=start, to=stop))
+        outputs.append(_output)
+
+    assert online.nRows == output.shape[0]
+    assert numpy.isclose(online.fval, fval, rtol=1e-12)
+    assert numpy.allclose(numpy.concatenate(outputs), output, rtol=1e-12, atol=0)
+
+
+def check_warm(
+    nll: likelihood.negLikelihood, coeff: ndarray, input: Variables[int]
+) -> None:
+    fval, output, grad = nll.value_and_grad(coeff, input, regularize=False)
+    n = len(input.dates)
+
+    warm = WarmStart(nll, coeff, input.index(from_=0, to=n // 2))
+    # 同一张表的视图共享只读内存，确认前缀时不再逐列计算摘要
+    assert warm.matches(input)
+    assert not warm.matches(input.index(from_=1, to=n))
+    assert warm.digests == 0
+    extended = warm.extend(input.index(from_=0, to=n - 7)).extend(input)
+    assert extended.nRows == n and extended.digests == 0
+    assert numpy.isclose(extended.fval, fval, rtol=1e-12)
+    assert numpy.allclose(extended.output, output, rtol=1e-12, atol=0)
+    assert numpy.allclose(extended.dL_dc, grad, rtol=1e-10, atol=1e-12)
+    assert extended.extend(input).fval == extended.fval
+
+    # 内容相同但不共享内存的表逐列比较摘要
+    copied = Variables(
+        input.dates,
+        *((name, input.sheet[:, i].copy()) for i, name in enumerate(input.data_names))
+    )
+    assert warm.matches(copied) and warm.digests == 1
+    changed = Variables(
+        input.dates,
+        *((name, input.sheet[:, i]) for i, name in enumerate(input.data_names))
+    )
+    changed.sheet.flags.writeable = True
+    changed.sheet[0, 0] += 1.0
+    assert not warm.matches(changed) and warm.digests == 2
+    assert numpy.isclose(
+        warm.extend(changed).fval, nll.eval(coeff, changed, regularize=False)[0]
+    )
+
+    # 放入EvalCache后，在coeff处对同一个Variables的eval与grad直接命中
+    cache = nll.enable_cache(max_bytes=1 << 30)
+    extended.seed_cache()
+    fval1, output1 = nll.eval(coeff, input, regularize=False)
+    grad1 = nll.grad(coeff, input, regularize=False)
+    assert cache.hits == 2 and cache.misses == 0
+    assert fval1 == extended.fval and numpy.all(output1 == extended.output)
+    assert numpy.all(grad1 == extended.dL_dc)
+    nll.disable_cache()
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+
+    garch = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    check_filter(garch, coeff, input)
+    try:
+        WarmStart(garch, coeff, input)
+        assert False
+    except AssertionError as e:
+        assert str(e) == "含有Iterative的模型无法只对新增的行求值"
+
+    midas = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X"),
+        (
+            Midas_exp("omega", ("X",), ("X",), k=30),
+            LogNormpdf("var", ("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    check_filter(midas, numpy.array([0.8, 1.0]), input)
+    check_warm(midas, numpy.array([0.8, 1.0]), input)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
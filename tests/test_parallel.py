@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+from typing import Any, Dict
+
+import numpy
+from likelihood import likelihood
+from likelihood.parallel import FitPool
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from optimizer import trust_region
+from overloads import difference
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def factory() -> likelihood.negLikelihood:
+    return likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+
+def fit(nll: likelihood.negLikelihood, input: Variables[int]) -> ndarray:
+    y = input.sheet[:, 0]
+    beta0 = numpy.array([numpy.std(y) ** 2 * 0.1, 0.1, 0.8])
+
+    def func(x: ndarray) -> float:
+        return nll.eval(x, input, regularize=False)[0]
+
+    def grad(x: ndarray) -> ndarray:
+        return nll.grad(x, input, regularize=False)
+
+    opts = trust_region.Trust_Region_Options(max_iter=300)
+    opts.tol_grad = 1e-5
+    result = trust_region.trust_region(func, grad, beta0, nll.get_constraints(), opts)
+    return result.x
+
+
+def run_once(coeff: ndarray, n: int, nSeries: int) -> None:
+    datasets = []
+    for seed in range(nSeries):
+        x = generate(coeff, n, seed=seed)
+        x, y = x[:-1], x[1:]
+        datasets.append(Variables(tuple(range(n - 1)), ("Y", y), ("X", x)))
+
+    results: Dict[int, Any] = {}
+    with FitPool(factory, fit, processes=2) as pool:
+        for index, beta_mle in pool.imap(datasets):
+            results[index] = beta_mle
+
+    assert sorted(results.keys()) == list(range(nSeries))
+    for index, beta_mle in results.items():
+        abserr_mle = difference.absolute(coeff, beta_mle)
+        print("seed: ", index, "mle: ", beta_mle, "abserr_mle: ", abserr_mle)
+        assert abserr_mle < 0.1
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000, 4)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
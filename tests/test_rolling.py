@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+from typing import List
+
+import numpy
+from likelihood import likelihood
+from likelihood.rolling import rolling_fit, rolling_windows
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from optimizer import trust_region
+from overloads import difference
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def factory() -> likelihood.negLikelihood:
+    return likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+
+def fit(
+    nll: likelihood.negLikelihood, input: Variables[int], beta0: ndarray
+) -> ndarray:
+    def func(x: ndarray) -> float:
+        return nll.eval(x, input, regularize=False)[0]
+
+    def grad(x: ndarray) -> ndarray:
+        return nll.grad(x, input, regularize=False)
+
+    opts = trust_region.Trust_Region_Options(max_iter=300)
+    opts.tol_grad = 1e-5
+    result = trust_region.trust_region(func, grad, beta0, nll.get_constraints(), opts)
+    return result.x
+
+
+def run_once(coeff: ndarray, n: int, window: int, step: int) -> None:
+    x = generate(coeff, n, seed=0)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+    nll = factory()
+    beta0 = numpy.array([numpy.std(y) ** 2 * 0.1, 0.1, 0.8])
+
+    windows = rolling_windows(n - 1, window=window, step=step)
+    assert windows[0] == (0, window)
+    assert all(to - from_ == window for from_, to in windows)
+    assert rolling_windows(n - 1, window=window, step=step, expanding=True) == [
+        (0, to) for _, to in windows
+    ]
+
+    serial = rolling_fit(nll, fit, input, beta0, window=window, step=step, chains=2)
+    parallel = rolling_fit(
+        nll, fit, input, beta0, window=window, step=step, processes=2
+    )
+    assert serial.coeffs.shape == (len(windows), 3)
+    assert not serial.issues and not parallel.issues
+    assert numpy.all(serial.windows == numpy.array(windows))
+    assert numpy.all(serial.end_dates == serial.windows[:, 1] - 1)
+    # 链的划分相同，进程内与进程池中的结果应完全一致
+    assert numpy.all(serial.coeffs == parallel.coeffs)
+
+    for w, beta_mle in enumerate(serial.coeffs):
+        abserr_mle = difference.absolute(coeff, beta_mle)
+        print("window: ", w, "mle: ", beta_mle, "abserr_mle: ", abserr_mle)
+        assert abserr_mle < 0.2
+
+    expanding = rolling_fit(
+        nll, fit, input, beta0, window=window, step=step, expanding=True
+    )
+    assert difference.absolute(coeff, expanding.coeffs[-1, :]) < 0.1
+
+
+def run_warm(n: int, window: int, step: int) -> None:
+    numpy.random.seed(0)
+    x = numpy.random.randn(n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+
+    def midas() -> likelihood.negLikelihood:
+        return likelihood.negLikelihood(
+            ("omega", "var"),
+            ("Y", "X"),
+            (
+                Midas_exp("omega", ("X",), ("X",), k=20),
+                LogNormpdf("var", ("Y", "X"), ("Y", "X")),
+            ),
+            None,
+        )
+
+    cold = midas()
+    nll = midas()
+    cache = nll.enable_cache(max_bytes=1 << 30)
+    misses: List[int] = []
+
+    def step_fit(
+        nll: likelihood.negLikelihood, input: Variables[int], beta0: ndarray
+    ) -> ndarray:
+        # 只在初始点上求值一次，然后走一小步，检查预先放入缓存的结果
+        before = cache.misses
+        fval, _ = nll.eval(beta0, input, regularize=False)
+        grad = nll.grad(beta0, input, regularize=False)
+        misses.append(cache.misses - before)
+        fval0, _, grad0 = cold.value_and_grad(beta0, input, regularize=False)
+        assert numpy.isclose(fval, fval0, rtol=1e-12)
+        assert numpy.allclose(grad, grad0, rtol=1e-10, atol=1e-12)
+        beta: ndarray = beta0 * 0.99
+        nll.eval(beta, input, regularize=False)
+        return beta
+
+    beta0 = numpy.array([0.5, 1.0])
+    result = rolling_fit(
+        nll, step_fit, input, beta0, window=window, step=step, expanding=True
+    )
+    # 首个窗口之后，初始点上的eval不再完整求值，而是命中WarmStart预先放入的条目
+    assert not result.issues
+    assert misses == [1] + [0] * (len(result.windows) - 1)
+    assert numpy.allclose(result.coeffs[-1], beta0 * 0.99 ** len(result.windows))
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000, 600, 100)
+
+    def test_2(self) -> None:
+        run_warm(1000, 400, 150)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()
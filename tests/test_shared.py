@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import gc
+import multiprocessing
+import pickle
+import subprocess
+import sys
+import time
+from typing import Any, Tuple
+
+import numpy
+from likelihood import likelihood
+from likelihood.shared import SharedVariables
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+ATTACH = """
+import sys
+from likelihood.shared import SharedHandle
+eval(sys.argv[1]).attach()
+"""
+
+
+def factory() -> likelihood.negLikelihood:
+    return likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+
+def evaluate(task: Tuple[ndarray, Variables[Any]]) -> float:
+    coeff, input = task
+    assert not input.sheet.flags.writeable
+    return factory().eval(coeff, input, regularize=False)[0]
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+    fval, _ = factory().eval(coeff, input, regularize=False)
+
+    with SharedVariables(input) as shared:
+        attached = shared.handle.attach()
+        assert numpy.all(attached.dates == input.dates)
+        assert numpy.all(attached.sheet == input.sheet)
+        assert len(pickle.dumps(shared.variables)) < input.sheet.nbytes
+
+        coeffs = [coeff * (1 + 0.01 * i) for i in range(4)]
+        with multiprocessing.Pool(2) as pool:
+            fvals = pool.map(evaluate, [(c, shared.variables) for c in coeffs])
+        del attached
+
+        # 由挂载得到的视图与切片持有映射，原表被回收后仍可访问
+        attached = shared.handle.attach()
+        sub = attached.index(from_=10, to=20)
+        column = attached.sheet[:, 1]
+        del attached
+        gc.collect()
+        assert numpy.all(sub.sheet == input.sheet[10:20, :])
+        assert numpy.all(column == input.sheet[:, 1])
+        kept = shared.variables.subset("X")
+
+        # 另一个进程（自带resource_tracker）挂载后退出，不会删除共享内存
+        subprocess.run([sys.executable, "-c", ATTACH, repr(shared.handle)], check=True)
+        time.sleep(1.0)  # 等待该进程的resource_tracker退出
+        assert numpy.all(shared.handle.attach().sheet == input.sheet)
+
+    # 发布方关闭后，仍被引用的视图在回收前保持可用
+    gc.collect()
+    assert numpy.all(kept.sheet == input.sheet[:, 1:])
+    del sub, column, kept
+    gc.collect()
+
+    assert fvals[0] == fval
+    for c, f in zip(coeffs, fvals):
+        assert f == factory().eval(c, input, regularize=False)[0]
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
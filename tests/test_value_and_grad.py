@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+    for debug in (True, False):
+        fval1, output1 = nll.eval(coeff, input, regularize=False, debug=debug)
+        grad1 = nll.grad(coeff, input, regularize=False, debug=debug)
+        fval2, output2, grad2 = nll.value_and_grad(
+            coeff, input, regularize=False, debug=debug
+        )
+        assert fval1 == fval2
+        assert numpy.all(output1 == output2)
+        assert numpy.all(grad1 == grad2)
+
+    h = 1e-7
+    for i in range(coeff.shape[0]):
+        xp, xm = coeff.copy(), coeff.copy()
+        xp[i] += h
+        xm[i] -= h
+        fp, _ = nll.eval(xp, input, regularize=False)
+        fm, _ = nll.eval(xm, input, regularize=False)
+        assert abs((fp - fm) / (2 * h) - grad2[i]) < 1e-4 * max(1.0, abs(grad2[i]))
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta, timezone
+
+import numpy
+from likelihood.Variables import Variables
+
+
+def run_once(n: int) -> None:
+    x = numpy.arange(n, dtype=numpy.float64)
+    start = datetime(2020, 1, 1)
+    dates = tuple(start + timedelta(hours=i) for i in range(n))
+
+    input = Variables(dates, ("Y", x), ("X", x * 2))
+    assert input.dates.dtype == numpy.dtype("datetime64[ns]")
+    assert numpy.all(input.dates == numpy.array(dates, dtype="datetime64[ns]"))
+    # date仍是与构造时相同的datetime元组
+    assert input.date == dates
+
+    window = input.index_by_date(dates[10], dates[20])
+    assert window.date == dates[10:20]
+    assert numpy.all(window.sheet[:, 0] == x[10:20])
+    assert numpy.shares_memory(window.dates, input.dates)
+    assert numpy.shares_memory(window.sheet, input.sheet)
+
+    window = input.index_by_date(numpy.datetime64(dates[-1]), dates[-1] + timedelta(1))
+    assert len(window.date) == 1
+
+    # 带时区的datetime换算为UTC存放
+    tz = timezone(timedelta(hours=8))
+    aware = Variables(
+        tuple((d + timedelta(hours=8)).replace(tzinfo=tz) for d in dates), ("Y", x)
+    )
+    assert numpy.all(aware.dates == input.dates)
+    assert aware.date == dates
+    try:
+        Variables((dates[0], dates[1].replace(tzinfo=tz)), ("Y", x[:2]))
+        assert False
+    except AssertionError as e:
+        assert str(e) == "日期不能混用带时区与不带时区的datetime"
+
+    ints = Variables(numpy.arange(n) * 5, ("Y", x))
+    assert ints.dates.dtype == numpy.int64
+    int_window = ints.index_by_date(12, 33)
+    assert int_window.date == (15, 20, 25, 30)
+    assert all(type(d) is int for d in int_window.date)
+
+    shuffled = Variables(numpy.arange(n)[::-1].copy(), ("Y", x))
+    try:
+        shuffled.index_by_date(0, n)
+        assert False
+    except AssertionError as e:
+        assert str(e)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
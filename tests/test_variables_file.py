@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    x, y = x[:-1], x[1:]
+    input = Variables(tuple(range(n - 1)), ("Y", y), ("X", x))
+
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "garch.var")
+        input.save(path)
+        with open(path, "rb") as file:
+            assert b'"validated": true' in file.read(256)
+        mapped = Variables.memmap(path)
+
+        assert numpy.all(mapped.dates == input.dates)
+        assert mapped.data_names == input.data_names
+        assert isinstance(mapped.sheet, numpy.memmap)
+        assert not mapped.sheet.flags.writeable
+        assert numpy.all(mapped.sheet == input.sheet)
+
+        fval1, _, grad1 = nll.value_and_grad(coeff, input, regularize=False)
+        fval2, _, grad2 = nll.value_and_grad(coeff, mapped, regularize=False)
+        assert fval1 == fval2
+        assert numpy.all(grad1 == grad2)
+
+        pickled = pickle.dumps(mapped)
+        assert len(pickled) < input.sheet.nbytes
+        assert numpy.all(pickle.loads(pickled).sheet == input.sheet)
+
+        start = datetime(2020, 1, 1)
+        dated = Variables(
+            tuple(start + timedelta(days=i) for i in range(n - 1)),
+            ("Y", y),
+            ("X", x),
+        )
+        dated.save(path)
+        assert numpy.all(Variables.memmap(path).dates == dated.dates)
+        del mapped
+
+    # 按值pickle的Variables重建后sheet仍是只读的，求值时无需重新检查
+    rebuilt = pickle.loads(pickle.dumps(input))
+    assert rebuilt.validated and not rebuilt.sheet.flags.writeable
+    assert rebuilt.data_names == input.data_names and rebuilt.date == input.date
+    assert numpy.all(rebuilt.sheet == input.sheet)
+    assert nll.eval(coeff, rebuilt, regularize=False)[0] == fval1
+
+    assert input.validated and not input.sheet.flags.writeable
+    input.sheet.flags.writeable = True
+    input.sheet[0, 1] = numpy.nan
+    try:
+        nll.eval(coeff, input, regularize=False)
+    except AssertionError:
+        pass
+    else:
+        assert False
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
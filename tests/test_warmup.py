@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+from typing import Optional
+
+from likelihood import jit
+from likelihood.warmup import collect_kernels, main, warmup
+
+from tests.test_garch_tvtp import NLL
+
+
+def run_once(disk_cache_dir: Optional[str]) -> None:
+    nll = NLL()
+
+    kernels = collect_kernels(nll)
+    assert [name for name, _ in kernels] == ["MS_TVTP._eval_impl", "MS_TVTP._grad_impl"]
+
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    previous = jit.get_disk_cache_dir()
+    try:
+        jit.set_disk_cache_dir(disk_cache_dir)
+        jit._Jitted_Function_Cache.clear()
+        for name, seconds in warmup(nll, workers=2):
+            print(name, seconds)
+            assert seconds >= 0
+        # 编译期间不改动本进程的磁盘缓存设置
+        assert jit.get_disk_cache_dir() == disk_cache_dir
+        for _, k in kernels:
+            assert k.pickled_bytecode in jit._Jitted_Function_Cache
+        assert not len(warmup(nll))
+    finally:
+        jit.set_disk_cache_dir(previous)
+        jit._Jitted_Function_Cache.clear()
+        jit._Jitted_Function_Cache.update(memory_cache)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        # 未设置磁盘缓存时，worker的编译结果经由临时目录交给本进程
+        run_once(None)
+
+
+class Test_2:
+    def test_1(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            run_once(directory)
+            assert len(os.listdir(directory))
+
+
+def run_main() -> None:
+    memory_cache = dict(jit._Jitted_Function_Cache)
+    disk_cache_dir = jit.get_disk_cache_dir()
+    try:
+        # 没有磁盘缓存时编译结果随进程退出而丢弃，命令行以错误退出
+        jit.set_disk_cache_dir(None)
+        try:
+            main(["tests.test_garch_tvtp:NLL"])
+            assert False
+        except SystemExit as e:
+            assert e.code == 2
+
+        with tempfile.TemporaryDirectory() as directory:
+            jit._Jitted_Function_Cache.clear()
+            assert main(["tests.test_garch_tvtp:NLL", "--cache-dir", directory]) == 0
+            assert len(os.listdir(directory))
+    finally:
+        jit.set_disk_cache_dir(disk_cache_dir)
+        jit._Jitted_Function_Cache.clear()
+        jit._Jitted_Function_Cache.update(memory_cache)
+
+
+class Test_3:
+    def test_1(self) -> None:
+        run_main()
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_2().test_1()
+    Test_3().test_1()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy
+from likelihood import likelihood
+from likelihood.stages.Garch import Garch
+from likelihood.stages.LogNormpdf import LogNormpdf
+from likelihood.stages.LogNormpdf_var import LogNormpdf_var
+from likelihood.stages.Midas_exp import Midas_exp
+from likelihood.Variables import Variables
+from overloads.typedefs import ndarray
+
+from tests.test_garch import generate
+
+
+def run_once(coeff: ndarray, n: int) -> None:
+    x = generate(coeff, n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("c", "a", "b"),
+        ("Y", "X"),
+        (
+            Garch(("c", "a", "b"), "X", "X"),
+            LogNormpdf_var(("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    assert nll.workspace is None
+
+    coeffs = [coeff * (1.0 + 0.0002 * i) for i in range(160)]
+    expected = [nll.grad(c, input, regularize=False) for c in coeffs]
+
+    # 默认不启用workspace，同一个negLikelihood可以被多个线程同时求梯度
+    with ThreadPoolExecutor(8) as executor:
+        results = list(
+            executor.map(lambda c: nll.grad(c, input, regularize=False), coeffs)
+        )
+    assert all(numpy.all(r == e) for r, e in zip(results, expected))
+
+    nll.enable_workspace()
+    for c, e in zip(coeffs[:4], expected):
+        assert numpy.all(nll.grad(c, input, regularize=False) == e)
+        fval, _, grad = nll.value_and_grad(c, input, regularize=False)
+        assert numpy.all(grad == e)
+    nll.disable_workspace()
+    assert nll.workspace is None
+
+
+def run_lagged(n: int, k: int) -> None:
+    numpy.random.seed(0)
+    x = numpy.random.randn(n)
+    input = Variables(tuple(range(n - 1)), ("Y", x[1:]), ("X", x[:-1]))
+    nll = likelihood.negLikelihood(
+        ("omega", "var"),
+        ("Y", "X"),
+        (
+            Midas_exp("omega", ("X",), ("X",), k=k),
+            LogNormpdf("var", ("Y", "X"), ("Y", "X")),
+        ),
+        None,
+    )
+    beta0 = numpy.array([0.5, 1.0])
+
+    # 带有k-lag的stage在workspace中向上借用空余的行，结果应与逐次分配一致
+    expected = nll.grad(beta0, input, regularize=False)
+    nll.enable_workspace()
+    for _ in range(2):
+        assert numpy.all(nll.grad(beta0, input, regularize=False) == expected)
+
+
+class Test_1:
+    def test_1(self) -> None:
+        run_once(numpy.array([0.01, 0.25, 0.7]), 1000)
+
+    def test_2(self) -> None:
+        run_lagged(1000, 20)
+
+
+if __name__ == "__main__":
+    Test_1().test_1()
+    Test_1().test_2()